@@ -0,0 +1,177 @@
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+import asyncio
+import json
+import math
+import time
+
+import config
+import metrics
+
+
+class Rejected(Exception):
+    """Запрос не допущен: status_code — 429 или 413, retry_after — подсказка клиенту в секундах."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: Optional[int] = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Ограничивает число одновременных запросов и объём загружаемых ими данных.
+
+    Запросы сверх лимита ждут в очереди FIFO ограниченной длины; при полной
+    очереди или слишком долгом ожидании запрос сразу отклоняется с 429.
+    Retry-After оценивается по среднему времени обработки запроса.
+    Запрос неизвестного размера (без Content-Length) занимает unknown_size байт.
+    """
+
+    def __init__(self, max_requests: int, max_bytes: int, queue_size: int, queue_timeout: float, unknown_size: int = 0):
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.unknown_size = min(unknown_size, max_bytes)
+        self.active = 0
+        self.active_bytes = 0
+        self.rejected = 0
+        self._waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+        self._avg_seconds: Optional[float] = None
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _fits(self, size: int) -> bool:
+        return self.active < self.max_requests and self.active_bytes + size <= self.max_bytes
+
+    def _take(self, size: int) -> None:
+        self.active += 1
+        self.active_bytes += size
+
+    def retry_after(self) -> int:
+        """Оценка времени до освобождения места для ещё одного запроса."""
+        avg = self._avg_seconds if self._avg_seconds is not None else 1.0
+        return max(1, math.ceil((self.queued + 1) * avg / self.max_requests))
+
+    def _reject(self, status_code: int, detail: str) -> Rejected:
+        self.rejected += 1
+        return Rejected(status_code, detail, self.retry_after() if status_code == 429 else None)
+
+    async def acquire(self, size: int) -> None:
+        if size > self.max_bytes:
+            raise self._reject(413, f"Запрос больше допустимого объёма {self.max_bytes} байт")
+        if not self._waiters and self._fits(size):
+            self._take(size)
+            return
+        if self.queued >= self.queue_size:
+            raise self._reject(429, "Сервер перегружен, повторите запрос позже")
+
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (size, waiter)
+        self._waiters.append(entry)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done():
+                # Место уже выделено, но запрос не дождался его
+                self.release(size)
+            else:
+                waiter.cancel()
+                self._waiters.remove(entry)
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._reject(429, "Сервер перегружен, повторите запрос позже")
+            raise
+
+    def grow(self, extra: int) -> None:
+        """Учитывает байты, пришедшие сверх занятого размера; не ждёт, а только задерживает следующие запросы."""
+        self.active_bytes += extra
+
+    def release(self, size: int, seconds: Optional[float] = None) -> None:
+        self.active -= 1
+        self.active_bytes -= size
+        if seconds is not None:
+            self._avg_seconds = seconds if self._avg_seconds is None else 0.8 * self._avg_seconds + 0.2 * seconds
+        while self._waiters and self._fits(self._waiters[0][0]):
+            size, waiter = self._waiters.popleft()
+            if waiter.cancelled():
+                continue
+            self._take(size)
+            waiter.set_result(None)
+
+
+controller = AdmissionController(
+    config.ADMISSION_MAX_REQUESTS,
+    config.ADMISSION_MAX_BYTES,
+    config.ADMISSION_QUEUE_SIZE,
+    config.ADMISSION_QUEUE_TIMEOUT,
+    config.ADMISSION_UNKNOWN_BYTES,
+)
+
+metrics.Gauge("convert_admission_active", "Допущенные запросы.", function=lambda: controller.active)
+metrics.Gauge("convert_admission_active_bytes", "Объём загрузок допущенных запросов.", function=lambda: controller.active_bytes)
+metrics.Gauge("convert_admission_queued", "Запросы в очереди на допуск.", function=lambda: controller.queued)
+metrics.Counter("convert_admission_rejected_total", "Отклонённые запросы (429 и 413).", function=lambda: controller.rejected)
+
+
+class AdmissionMiddleware:
+    """ASGI-middleware: допуск запросов к тяжёлым путям до разбора тела запроса.
+
+    Размер загрузки берётся из Content-Length, поэтому решение принимается до
+    того, как тело начнёт записываться во временные файлы. Запрос без
+    Content-Length (chunked) занимает unknown_size контроллера, а его тело
+    считается по мере приёма: байты сверх этого тоже учитываются. На
+    некорректный Content-Length — 400. Место освобождается после отправки
+    последнего байта ответа.
+    """
+
+    def __init__(self, app, paths: Dict[str, str], controller: AdmissionController = controller):
+        self.app = app
+        self.paths = paths
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or metrics.endpoint_for(self.paths, scope["path"]) is None:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and not content_length.strip().isdigit():
+            await self._send_rejection(send, Rejected(400, "Некорректный заголовок Content-Length"))
+            return
+        size = self.controller.unknown_size if content_length is None else int(content_length)
+        try:
+            await self.controller.acquire(size)
+        except Rejected as e:
+            await self._send_rejection(send, e)
+            return
+
+        reserved = size
+        received = 0
+
+        async def metered_receive():
+            nonlocal reserved, received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > reserved:
+                    self.controller.grow(received - reserved)
+                    reserved = received
+            return message
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive if content_length is not None else metered_receive, send)
+        finally:
+            self.controller.release(reserved, time.perf_counter() - start)
+
+    @staticmethod
+    async def _send_rejection(send, error: Rejected) -> None:
+        body = json.dumps({"detail": error.detail}, ensure_ascii=False).encode()
+        headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        if error.retry_after is not None:
+            headers.append((b"retry-after", str(error.retry_after).encode()))
+        await send({"type": "http.response.start", "status": error.status_code, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
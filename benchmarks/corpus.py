@@ -0,0 +1,55 @@
+"""Синтетические изображения и архивы для бенчмарков."""
+from typing import Dict, List, Tuple
+import io
+import random
+import statistics
+import zipfile
+
+from PIL import Image
+
+
+def make_noise(size: Tuple[int, int], sigma: float, seed: int) -> Image.Image:
+    """Гауссов шум вокруг 128, как Image.effect_noise, но из random.Random(seed): одинаковый при каждом запуске.
+
+    Равномерные байты переводятся в нормальное распределение таблицей
+    обратной функции распределения, без вычислений на каждый пиксель.
+    """
+    uniform = Image.frombytes("L", size, random.Random(seed).randbytes(size[0] * size[1]))
+    normal = statistics.NormalDist(128, sigma)
+    return uniform.point([min(255, max(0, round(normal.inv_cdf((value + 0.5) / 256)))) for value in range(256)])
+
+
+def make_image(size: Tuple[int, int], fmt: str = "JPEG", seed: int = 0, mode: str = "RGB") -> bytes:
+    """Синтетическое фото: градиенты с шумом, чтобы кодек не сжимал его тривиально; зависит только от seed."""
+    gradient = Image.linear_gradient("L").rotate(seed * 37 % 360).resize(size)
+    noise = make_noise(size, 12, seed)
+    bands = [gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)]
+    if mode == "RGBA":
+        bands.append(gradient.transpose(Image.Transpose.FLIP_TOP_BOTTOM))
+    img = Image.merge(mode, bands)
+    output = io.BytesIO()
+    img.save(output, fmt, quality=90)
+    return output.getvalue()
+
+
+def make_corpus(count: int, size: Tuple[int, int], fmt: str = "JPEG") -> Dict[str, bytes]:
+    """count разных изображений одного размера: имя файла -> содержимое."""
+    suffix = "webp" if fmt == "WEBP" else "jpg"
+    return {f"img_{i:04d}.{suffix}": make_image(size, fmt, seed=i) for i in range(count)}
+
+
+def make_zip(files: Dict[str, bytes]) -> bytes:
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_STORED) as archive:
+        for name, content in files.items():
+            archive.writestr(f"images/{name}", content)
+    return output.getvalue()
+
+
+def parse_size(value: str) -> Tuple[int, int]:
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def sizes(values: List[str]) -> List[Tuple[int, int]]:
+    return [parse_size(value) for value in values]
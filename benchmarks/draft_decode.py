@@ -0,0 +1,63 @@
+"""Сравнение полного декодирования и декодирования с уменьшением (draft) в resize-путях.
+
+Запуск: python benchmarks/draft_decode.py [--repeat N]
+"""
+from pathlib import Path
+import argparse
+import io
+import math
+import sys
+import time
+
+from PIL import Image, ImageChops, ImageStat
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from imaging import TARGET_SIZE, open_image, resize_image  # noqa: E402
+from corpus import make_image  # noqa: E402
+
+SIZES = [(4000, 6000), (6000, 4000), (3000, 4000), (1600, 1200)]
+
+
+def full_decode(content: bytes) -> Image.Image:
+    img = Image.open(io.BytesIO(content)).convert("RGB")
+    return resize_image(img, TARGET_SIZE)
+
+
+def draft_decode(content: bytes) -> Image.Image:
+    with open_image(content, TARGET_SIZE) as img:
+        rgb_img = img.convert("RGB")
+    return resize_image(rgb_img, TARGET_SIZE)
+
+
+def measure(func, content: bytes, repeat: int) -> float:
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(content)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def psnr(a: Image.Image, b: Image.Image) -> float:
+    rms = ImageStat.Stat(ImageChops.difference(a, b)).rms
+    mse = sum(value ** 2 for value in rms) / len(rms)
+    return math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'размер':>12} {'полное, мс':>12} {'draft, мс':>12} {'ускорение':>10} {'PSNR, дБ':>9}")
+    for size in SIZES:
+        content = make_image(size)
+        full = measure(full_decode, content, args.repeat)
+        draft = measure(draft_decode, content, args.repeat)
+        quality = psnr(full_decode(content), draft_decode(content))
+        print(f"{size[0]:>5}x{size[1]:<6} {full * 1000:>12.1f} {draft * 1000:>12.1f} {full / draft:>9.1f}x {quality:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
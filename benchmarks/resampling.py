@@ -0,0 +1,82 @@
+"""Скорость и качество пресетов ресэмплинга против прежнего пути resize.
+
+Прежний путь: конвертация в RGB на исходном разрешении, затем thumbnail с
+LANCZOS. Для каждого пресета измеряется время декодирования с изменением
+размера и PSNR результата относительно прежнего пути. У изображений с
+альфа-каналом прежний путь тоже накладывает прозрачность на белый фон, иначе
+сравнение теряет смысл.
+
+Запуск: python benchmarks/resampling.py [--repeat N]
+"""
+from pathlib import Path
+import argparse
+import math
+import sys
+import time
+
+from PIL import Image, ImageChops, ImageStat
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from imaging import RESAMPLING_PRESETS, TARGET_SIZE, flatten, letterbox, open_image, resize_image  # noqa: E402
+from corpus import make_image  # noqa: E402
+
+CASES = [
+    ((4000, 6000), "JPEG", "RGB"),
+    ((3000, 4000), "WEBP", "RGB"),
+    ((3000, 4000), "WEBP", "RGBA"),
+    ((1600, 1200), "JPEG", "RGB"),
+]
+
+
+def previous(content: bytes) -> Image.Image:
+    with open_image(content, TARGET_SIZE) as img:
+        rgb_img = flatten(img)
+    rgb_img.thumbnail(TARGET_SIZE, Image.Resampling.LANCZOS)
+    return letterbox(rgb_img, TARGET_SIZE)
+
+
+def with_preset(preset: str):
+    def run(content: bytes) -> Image.Image:
+        with open_image(content, TARGET_SIZE) as img:
+            img.load()
+            return resize_image(img.copy(), TARGET_SIZE, preset)
+    return run
+
+
+def measure(func, content: bytes, repeat: int) -> float:
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(content)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def psnr(a: Image.Image, b: Image.Image) -> float:
+    rms = ImageStat.Stat(ImageChops.difference(a, b)).rms
+    mse = sum(value ** 2 for value in rms) / len(rms)
+    return math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'вход':>22} {'пресет':>9} {'мс':>8} {'ускорение':>10} {'PSNR, дБ':>9}")
+    for size, fmt, mode in CASES:
+        content = make_image(size, fmt, mode=mode)
+        label = f"{size[0]}x{size[1]} {fmt} {mode}"
+        base = measure(previous, content, args.repeat)
+        reference = previous(content)
+        print(f"{label:>22} {'прежний':>9} {base * 1000:>8.1f} {'1.0x':>10} {'—':>9}")
+        for preset in RESAMPLING_PRESETS:
+            func = with_preset(preset)
+            seconds = measure(func, content, args.repeat)
+            quality = psnr(reference, func(content))
+            print(f"{label:>22} {preset:>9} {seconds * 1000:>8.1f} {base / seconds:>9.1f}x {quality:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
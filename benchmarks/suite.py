@@ -0,0 +1,299 @@
+"""Воспроизводимый бенчмарк функций конвертации и всех эндпоинтов.
+
+Генерирует синтетические WebP/JPEG, прогоняет их через resize_image, цикл
+конвертации в одном процессе и пять эндпоинтов через ASGI без сети. Для
+каждого случая считает изображений в секунду, перцентили задержки и пиковый
+RSS (основной процесс плюс пул воркеров) и сохраняет результат в JSON.
+
+Запуск:
+    python benchmarks/suite.py --count 20 --size 2000x3000 --output before.json
+    python benchmarks/suite.py --compare before.json after.json
+"""
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+import uuid
+
+# Кэш результатов исказил бы повторные прогоны
+os.environ.setdefault("CONVERT_CACHE_MEMORY_BYTES", "0")
+os.environ.setdefault("CONVERT_CACHE_DISK_BYTES", "0")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from PIL import Image  # noqa: E402
+
+import workers  # noqa: E402
+from corpus import make_corpus, make_zip, sizes  # noqa: E402
+from imaging import TARGET_SIZE, CanvasPool, convert_image, letterbox, resize_image, shrink  # noqa: E402
+
+
+def _rss_kb(pid: str) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+class PeakRSS:
+    """Периодически замеряет суммарный RSS процесса и воркеров пула (только Linux)."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self) -> None:
+        while not self._stop.is_set():
+            pids = ["self"]
+            if workers._pool is not None:
+                pids += [str(pid) for pid in list(workers._pool._processes or {})]
+            self.peak_kb = max(self.peak_kb, sum(_rss_kb(pid) for pid in pids))
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "PeakRSS":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {"p50_ms": pick(0.5) * 1000, "p90_ms": pick(0.9) * 1000, "p99_ms": pick(0.99) * 1000,
+            "mean_ms": statistics.fmean(ordered) * 1000}
+
+
+def report(name: str, images: int, elapsed: float, latencies: List[float], peak_kb: int, **extra) -> dict:
+    result = {"case": name, "images": images, "seconds": elapsed,
+              "images_per_sec": images / elapsed if elapsed else 0.0,
+              "peak_rss_mb": peak_kb / 1024, **percentiles(latencies), **extra}
+    line = (f"{name:<36} {result['images_per_sec']:>9.1f} img/s  p50 {result['p50_ms']:>8.1f} мс  "
+            f"p99 {result['p99_ms']:>8.1f} мс  RSS {result['peak_rss_mb']:>7.1f} МБ")
+    if "canvas_allocations" in extra:
+        line += f"  холстов выделено {extra['canvas_allocations']}"
+    print(line)
+    return result
+
+
+def bench_per_image(name: str, func: Callable[[bytes], object], corpus: Dict[str, bytes], repeat: int) -> dict:
+    latencies = []
+    with PeakRSS() as rss:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for content in corpus.values():
+                t = time.perf_counter()
+                func(content)
+                latencies.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - start
+    return report(name, len(latencies), elapsed, latencies, rss.peak_kb)
+
+
+def bench_resize_image(corpus: Dict[str, bytes], repeat: int) -> dict:
+    """Только resize_image: изображения декодируются заранее, копия на каждый вызов."""
+    decoded = [Image.open(io.BytesIO(content)).convert("RGB") for content in corpus.values()]
+    latencies = []
+    with PeakRSS() as rss:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for img in decoded:
+                copy = img.copy()
+                t = time.perf_counter()
+                resize_image(copy, TARGET_SIZE)
+                latencies.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - start
+    return report("resize_image", len(latencies), elapsed, latencies, rss.peak_kb)
+
+
+def bench_letterbox(corpus: Dict[str, bytes], repeat: int, pooled: bool) -> dict:
+    """Только размещение на холсте: уменьшенные заранее изображения, с пулом холстов и без."""
+    shrunk = [shrink(Image.open(io.BytesIO(content)).convert("RGB"), TARGET_SIZE) for content in corpus.values()]
+    # Без пула холст выделяется на каждый вызов: CanvasPool(0) ничего не хранит, но считает выделения
+    canvases = CanvasPool(64 * 1024 * 1024 if pooled else 0)
+    latencies = []
+    with PeakRSS() as rss:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for img in shrunk:
+                t = time.perf_counter()
+                canvases.release(letterbox(img, TARGET_SIZE, canvases))
+                latencies.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - start
+    stats = canvases.stats()
+    return report(f"letterbox {'pooled' if pooled else 'fresh'}", len(latencies), elapsed, latencies, rss.peak_kb,
+                  canvas_allocations=stats["allocations"], canvas_reuses=stats["reuses"])
+
+
+# Минимальный ASGI-клиент: запросы идут прямо в приложение, без сокетов
+
+def multipart(fields: List[Tuple[str, str, bytes]]) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    parts = []
+    for field, filename, content in fields:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n".encode() + content + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+async def asgi_post(app, path: str, body: bytes, content_type: str) -> Tuple[int, float, bytes]:
+    """Отправляет POST в ASGI-приложение; возвращает статус, время до первого байта и тело."""
+    done = asyncio.Event()
+    sent = False
+    status = 0
+    first_byte: Optional[float] = None
+    chunks = []
+    start = time.perf_counter()
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status, first_byte
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                done.set()
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 0), "server": ("bench", 80),
+    }
+    await app(scope, receive, send)
+    done.set()
+    return status, first_byte or 0.0, b"".join(chunks)
+
+
+def bench_endpoint(app, name: str, path: str, fields: List[Tuple[str, str, bytes]], images: int, repeat: int) -> dict:
+    body, content_type = multipart(fields)
+
+    async def run():
+        latencies, ttfb, output_bytes = [], [], 0
+        # Прогрев: запуск пула процессов не должен попадать в замер
+        await asgi_post(app, path, body, content_type)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            t = time.perf_counter()
+            status, first_byte, content = await asgi_post(app, path, body, content_type)
+            if status != 200:
+                raise RuntimeError(f"{path}: HTTP {status}: {content[:200]!r}")
+            latencies.append((time.perf_counter() - t) / images)
+            ttfb.append(first_byte)
+            output_bytes = len(content)
+        return time.perf_counter() - start, latencies, ttfb, output_bytes
+
+    with PeakRSS() as rss:
+        elapsed, latencies, ttfb, output_bytes = asyncio.run(run())
+    return report(name, images * repeat, elapsed, latencies, rss.peak_kb,
+                  ttfb_p50_ms=statistics.median(ttfb) * 1000, output_bytes=output_bytes)
+
+
+def run_suite(args) -> dict:
+    import main4
+
+    results = []
+    for size in sizes(args.size):
+        label = f"{size[0]}x{size[1]}x{args.count}"
+        print(f"-- корпус {label}")
+        webp = make_corpus(args.count, size, "WEBP")
+        jpeg = make_corpus(args.count, size, "JPEG")
+
+        results.append(bench_resize_image(jpeg, args.repeat))
+        results.append(bench_letterbox(jpeg, args.repeat, pooled=False))
+        results.append(bench_letterbox(jpeg, args.repeat, pooled=True))
+        results.append(bench_per_image("convert loop webp", convert_image, webp, args.repeat))
+        results.append(bench_per_image("convert loop webp resize", lambda c: convert_image(c, TARGET_SIZE), webp, args.repeat))
+        results.append(bench_per_image("convert loop jpeg resize", lambda c: convert_image(c, TARGET_SIZE), jpeg, args.repeat))
+
+        webp_files = [("files", name, content) for name, content in webp.items()]
+        webp_zip = [("file", "images.zip", make_zip(webp))]
+        cases = [
+            ("/convert-webp/", webp_files),
+            ("/convert-zip/", webp_zip),
+            ("/convert-webp-resize/", webp_files),
+            ("/convert-zip-resize/", webp_zip),
+            ("/resize-jpeg/", [("files", name, content) for name, content in jpeg.items()]),
+        ]
+        for path, fields in cases:
+            results.append(bench_endpoint(main4.app, f"POST {path}", path, fields, args.count, args.repeat))
+        for result in results:
+            result.setdefault("corpus", label)
+
+    workers.shutdown_pool()
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "workers": workers.config.WORKERS,
+        "args": vars(args),
+        "results": results,
+    }
+
+
+def compare(before_path: str, after_path: str) -> None:
+    before = {(r["corpus"], r["case"]): r for r in json.loads(Path(before_path).read_text())["results"]}
+    after = {(r["corpus"], r["case"]): r for r in json.loads(Path(after_path).read_text())["results"]}
+    print(f"{'корпус':<18} {'случай':<36} {'img/s было':>11} {'стало':>9} {'изм.':>7} {'p99 было':>9} {'стало':>9}")
+    for key in before:
+        if key not in after:
+            continue
+        old, new = before[key], after[key]
+        change = new["images_per_sec"] / old["images_per_sec"] - 1 if old["images_per_sec"] else 0.0
+        print(f"{key[0]:<18} {key[1]:<36} {old['images_per_sec']:>11.1f} {new['images_per_sec']:>9.1f} "
+              f"{change:>+7.0%} {old['p99_ms']:>9.1f} {new['p99_ms']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=20, help="изображений в корпусе")
+    parser.add_argument("--size", nargs="+", default=["2000x3000"], help="размеры изображений, например 800x600 4000x6000")
+    parser.add_argument("--repeat", type=int, default=3, help="повторов каждого случая")
+    parser.add_argument("--output", help="куда сохранить результаты в JSON")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="сравнить два JSON с результатами")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    data = run_suite(args)
+    if args.output:
+        Path(args.output).write_text(json.dumps(data, ensure_ascii=False, indent=2))
+        print(f"Результаты сохранены в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Передача данных воркерам и обратно: через канал пула (pickle) и через файлы обмена.
+
+Конвертация заменена чтением входа и возвратом результата заданного размера
+(четверть входа), поэтому измеряется только передача. Задачи отправляются
+одновременно, как из конвейера с окном 2 x CONVERT_WORKERS.
+
+Запуск: python benchmarks/transport.py [--count N]
+"""
+from pathlib import Path
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import config  # noqa: E402
+import workers  # noqa: E402
+from transport import Spool, Spooled, call_spooled, shutdown_spool  # noqa: E402
+
+SIZES = [64 * 1024, 256 * 1024, 1024 * 1024, 8 * 1024 * 1024, 32 * 1024 * 1024]
+
+
+def echo(source, size: int):
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            f.read()
+    return b"\0" * size, {}
+
+
+async def through_pipe(data: bytes, spool: Spool) -> None:
+    await workers.run_in_pool(echo, data, len(data) // 4)
+
+
+async def through_spool(data: bytes, spool: Spool) -> None:
+    source = await asyncio.to_thread(spool.put, data)
+    try:
+        result, _ = await workers.run_in_pool(call_spooled, echo, spool.directory, spool.min_bytes, source, len(data) // 4)
+    finally:
+        source.remove()
+    if isinstance(result, Spooled):
+        await asyncio.to_thread(result.take)
+
+
+async def measure(func, data: bytes, count: int) -> float:
+    # Один каталог обмена на все задачи, как у конвейера одного запроса
+    spool = Spool(min_bytes=1)
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*(func(data, spool) for _ in range(count)))
+        return (time.perf_counter() - start) / count
+    finally:
+        spool.close()
+
+
+async def run(count: int) -> None:
+    # Процессы пула запускаются до замеров
+    await asyncio.gather(*(workers.run_in_pool(os.getpid) for _ in range(config.WORKERS)))
+    print(f"{'вход, КБ':>9} {'канал, мс':>10} {'файлы, мс':>10} {'ускорение':>10}")
+    for size in SIZES:
+        data = os.urandom(size)
+        pipe = await measure(through_pipe, data, count)
+        spool = await measure(through_spool, data, count)
+        print(f"{size // 1024:>9} {pipe * 1000:>10.2f} {spool * 1000:>10.2f} {pipe / spool:>9.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=64)
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(args.count))
+    finally:
+        workers.shutdown_pool()
+        shutdown_spool()
+
+
+if __name__ == "__main__":
+    main()
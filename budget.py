@@ -0,0 +1,66 @@
+from typing import Dict
+
+import config
+
+
+class BudgetExceeded(ValueError):
+    """Изображение не помещается в бюджет и пропускается без декодирования."""
+
+
+class Budget:
+    """Бюджеты пикселей и байтов на одно изображение и на весь запрос.
+
+    check() вызывается после чтения заголовка, до декодирования; принятые
+    изображения расходуют бюджет запроса.
+    """
+
+    def __init__(
+        self,
+        max_image_pixels: int = None,
+        max_image_bytes: int = None,
+        max_request_pixels: int = None,
+        max_request_bytes: int = None,
+    ):
+        self.max_image_pixels = config.MAX_IMAGE_PIXELS if max_image_pixels is None else max_image_pixels
+        self.max_image_bytes = config.MAX_IMAGE_BYTES if max_image_bytes is None else max_image_bytes
+        self.max_request_pixels = config.MAX_REQUEST_PIXELS if max_request_pixels is None else max_request_pixels
+        self.max_request_bytes = config.MAX_REQUEST_BYTES if max_request_bytes is None else max_request_bytes
+        self.pixels = 0
+        self.bytes = 0
+
+    def check(self, size: int, width: int, height: int) -> None:
+        pixels = width * height
+        if pixels > self.max_image_pixels:
+            raise BudgetExceeded(f"{width}x{height} больше лимита {self.max_image_pixels} пикселей на изображение")
+        if size > self.max_image_bytes:
+            raise BudgetExceeded(f"{size} байт больше лимита {self.max_image_bytes} байт на изображение")
+        if self.pixels + pixels > self.max_request_pixels:
+            raise BudgetExceeded(f"исчерпан лимит {self.max_request_pixels} пикселей на запрос")
+        if self.bytes + size > self.max_request_bytes:
+            raise BudgetExceeded(f"исчерпан лимит {self.max_request_bytes} байт на запрос")
+        self.pixels += pixels
+        self.bytes += size
+
+    def describe(self) -> str:
+        return (
+            f"на изображение {self.max_image_pixels} пикселей и {self.max_image_bytes} байт, "
+            f"на запрос {self.max_request_pixels} пикселей и {self.max_request_bytes} байт"
+        )
+
+    def headers(self) -> Dict[str, str]:
+        return {
+            "X-Max-Image-Pixels": str(self.max_image_pixels),
+            "X-Max-Image-Bytes": str(self.max_image_bytes),
+            "X-Max-Request-Pixels": str(self.max_request_pixels),
+            "X-Max-Request-Bytes": str(self.max_request_bytes),
+        }
+
+    def to_dict(self) -> Dict[str, int]:
+        return {
+            "max_image_pixels": self.max_image_pixels,
+            "max_image_bytes": self.max_image_bytes,
+            "max_request_pixels": self.max_request_pixels,
+            "max_request_bytes": self.max_request_bytes,
+            "used_pixels": self.pixels,
+            "used_bytes": self.bytes,
+        }
@@ -0,0 +1,342 @@
+"""Пакетная конвертация без HTTP: каталоги и ZIP-архивы на локальном диске.
+
+Использует те же стадии и функции (imaging.process_image, process_pyramid,
+resize_image), что и API, и распределяет изображения по всем ядрам через
+пул процессов. Уже готовые результаты пропускаются, прогресс со скоростью
+и оценкой оставшегося времени печатается по ходу работы.
+
+Запуск:
+    python bulk.py photos/ --output converted/
+    python bulk.py photos/ archive.zip --operation convert-webp-resize --sizes 1080x1440,540x720
+    python bulk.py jpegs/ --operation resize-jpeg --skip hash
+"""
+from concurrent.futures import FIRST_COMPLETED, wait
+from pathlib import Path, PurePosixPath
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+from fastapi import HTTPException
+
+import config
+import workers
+from cache import ResultCache
+from imaging import DEFAULT_PRESET, RESAMPLING_PRESETS, TARGET_SIZE, Quality, process_image, process_pyramid
+from ingest import ArchiveError, open_archive, read_member
+from operations import encode_target, jpg_name, parse_sizes, resize_args, resized_name
+
+MANIFEST = ".convert-manifest.json"
+
+# Каталоги размеров пирамиды (1080x1440/ и т.п.), которые bulk.py создаёт сам
+SIZE_DIR = re.compile(r"\d+x\d+")
+
+# Операция -> (расширения входных файлов, имя результата, размеры по умолчанию)
+OPERATIONS = {
+    "convert-webp": ((".webp",), jpg_name, None),
+    "convert-webp-resize": ((".webp",), jpg_name, [TARGET_SIZE]),
+    "resize-jpeg": ((".jpg", ".jpeg"), resized_name, [TARGET_SIZE]),
+}
+
+
+def convert_file(
+    source: Union[bytes, str],
+    transforms: list,
+    sizes: Optional[List[Tuple[int, int]]],
+    quality: Quality,
+    outputs: List[str],
+    preset: str = DEFAULT_PRESET,
+) -> int:
+    """Конвертирует одно изображение и записывает результаты в outputs; возвращает число байт.
+
+    Выполняется в рабочем процессе. Файлы пишутся через временный .part,
+    поэтому прерванный запуск не оставляет недописанных JPEG.
+    """
+    if sizes is None:
+        results = [process_image(source, transforms, quality)]
+    else:
+        results = process_pyramid(source, transforms, sizes, quality, preset=preset)
+    written = 0
+    for path, data in zip(outputs, results):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial_path = path + ".part"
+        with open(partial_path, "wb") as output:
+            output.write(data)
+        os.replace(partial_path, path)
+        written += len(data)
+    return written
+
+
+class Task:
+    """Одно входное изображение: файл на диске или элемент ZIP-архива."""
+
+    def __init__(self, label: str, root: Path, relative: PurePosixPath, path: Optional[Path] = None,
+                 archive=None, info=None, mtime: float = 0.0):
+        self.label = label
+        self.root = root
+        self.relative = relative
+        self.path = path
+        self.archive = archive
+        self.info = info
+        self.mtime = mtime
+
+    def read(self) -> bytes:
+        if self.path is not None:
+            return self.path.read_bytes()
+        return read_member(self.archive, self.info)
+
+
+class Progress:
+    """Счётчики запуска и периодическая печать скорости и оставшегося времени."""
+
+    def __init__(self, total: int, interval: float = 2.0):
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.written = 0
+        self.start = time.perf_counter()
+        self._last = 0.0
+
+    def report(self, force: bool = False) -> None:
+        now = time.perf_counter()
+        if not force and now - self._last < self.interval:
+            return
+        self._last = now
+        elapsed = max(now - self.start, 1e-9)
+        finished = self.done + self.failed + self.skipped
+        rate = (self.done + self.failed) / elapsed
+        remaining = self.total - finished
+        eta = f"{remaining / rate:.0f} с" if rate > 0 else "неизвестно"
+        print(
+            f"{finished}/{self.total}: готово {self.done}, ошибок {self.failed}, пропущено {self.skipped}; "
+            f"{rate:.1f} изобр/с, {self.written / elapsed / 1024 / 1024:.1f} МБ/с, осталось ~{eta}",
+            flush=True,
+        )
+
+
+def _safe_relative(name: str) -> PurePosixPath:
+    """Путь элемента архива без абсолютных частей и '..'."""
+    return PurePosixPath(*[part for part in PurePosixPath(name).parts if part not in ("", ".", "..", "/")])
+
+
+def _walk(item: Path, output: Optional[Path], result_suffix: str) -> Iterator[Path]:
+    """Файлы каталога item без собственных результатов bulk.py.
+
+    Пропускаются каталог --output, если он внутри item, каталоги размеров
+    пирамиды в корне (при записи рядом с исходниками) и файлы с именем
+    результата операции, например *_resized.jpg для resize-jpeg: иначе
+    повторный запуск принял бы вчерашние результаты за новые исходники.
+    """
+    skip_dir = output.resolve() if output else None
+    for directory, dirnames, filenames in os.walk(item):
+        current = Path(directory)
+        dirnames[:] = sorted(
+            name for name in dirnames
+            if (current / name).resolve() != skip_dir
+            and not (output is None and current == item and SIZE_DIR.fullmatch(name))
+        )
+        for name in sorted(filenames):
+            if not name.lower().endswith(result_suffix):
+                yield current / name
+
+
+def collect(inputs: List[Path], suffixes: Tuple[str, ...], output: Optional[Path], name=jpg_name) -> List[Task]:
+    """Находит входные изображения в каталогах и ZIP-архивах.
+
+    Результаты для каталога пишутся в output (зеркальным деревом) или рядом
+    с исходниками; для архива — в output или в каталог с именем архива.
+    name — имя результата операции: файлы с таким именем не считаются входами.
+    """
+    # Хвост имени результата: ".jpg" для конвертации, "_resized.jpg" для resize-jpeg
+    result_suffix = name("x")[1:]
+    tasks: List[Task] = []
+    for item in inputs:
+        if item.is_dir():
+            root = output or item
+            for path in _walk(item, output, result_suffix):
+                if path.name.lower().endswith(suffixes):
+                    relative = PurePosixPath(path.relative_to(item).as_posix())
+                    tasks.append(Task(str(path), root, relative, path=path, mtime=path.stat().st_mtime))
+        elif item.suffix.lower() == ".zip":
+            root = (output / item.stem) if output else item.with_suffix("")
+            try:
+                archive, members = open_archive(str(item), suffixes)
+            except ArchiveError as e:
+                print(f"Ошибка чтения {item}: {str(e)}")
+                continue
+            mtime = item.stat().st_mtime
+            for info in members:
+                tasks.append(Task(f"{item}:{info.filename}", root, _safe_relative(info.filename),
+                                  archive=archive, info=info, mtime=mtime))
+        elif item.is_file() and item.name.lower().endswith(suffixes):
+            tasks.append(Task(str(item), output or item.parent, PurePosixPath(item.name), path=item,
+                              mtime=item.stat().st_mtime))
+        else:
+            print(f"Пропущен {item}: не каталог, не ZIP и не подходящий файл")
+    return tasks
+
+
+def _outputs(task: Task, name, sizes: Optional[List[Tuple[int, int]]]) -> List[str]:
+    relative = task.relative.with_name(name(task.relative.name))
+    if sizes is None:
+        return [str(task.root / relative)]
+    return [str(task.root / f"{width}x{height}" / relative) for width, height in sizes]
+
+
+def _up_to_date(outputs: List[str], mtime: float) -> bool:
+    try:
+        return all(os.stat(path).st_mtime >= mtime for path in outputs)
+    except FileNotFoundError:
+        return False
+
+
+def _manifest_name(task: Task, outputs: List[str]) -> str:
+    return Path(outputs[0]).relative_to(task.root).as_posix()
+
+
+def _load_manifest(root: Path) -> Dict[str, str]:
+    try:
+        with open(root / MANIFEST, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _save_manifest(root: Path, manifest: Dict[str, str]) -> None:
+    root.mkdir(parents=True, exist_ok=True)
+    partial_path = root / (MANIFEST + ".part")
+    with open(partial_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(partial_path, root / MANIFEST)
+
+
+def run(
+    tasks: List[Task],
+    operation: str,
+    name,
+    transforms: list,
+    sizes: Optional[List[Tuple[int, int]]],
+    quality: Quality,
+    skip: str,
+    window: int,
+    preset: str = DEFAULT_PRESET,
+) -> Progress:
+    """Раздаёт задачи пулу, держа в работе не больше window изображений."""
+    progress = Progress(len(tasks))
+    manifests: Dict[Path, Dict[str, str]] = {}
+    params = (transforms, None if sizes is None else (tuple(sizes), preset), quality)
+    pool = workers.get_pool()
+    pending = {}
+
+    def submissions() -> Iterator[tuple]:
+        for task in tasks:
+            outputs = _outputs(task, name, sizes)
+            key = None
+            try:
+                if skip == "mtime" and _up_to_date(outputs, task.mtime):
+                    progress.skipped += 1
+                    continue
+                # Архивы читаются в основном процессе; файлы с диска — в воркере,
+                # если содержимое не нужно для хэша
+                source = task.read() if task.path is None or skip == "hash" else str(task.path)
+                if skip == "hash":
+                    key = ResultCache.key(operation, source, params)
+                    manifest = manifests.setdefault(task.root, _load_manifest(task.root))
+                    if manifest.get(_manifest_name(task, outputs)) == key and all(os.path.exists(path) for path in outputs):
+                        progress.skipped += 1
+                        continue
+            except Exception as e:
+                progress.failed += 1
+                print(f"Ошибка чтения {task.label}: {str(e)}")
+                continue
+            yield task, key, pool.submit(convert_file, source, transforms, sizes, quality, outputs, preset), outputs
+
+    def collect_done(done) -> None:
+        for future in done:
+            task, key, outputs = pending.pop(future)
+            try:
+                progress.written += future.result()
+                progress.done += 1
+                if key is not None:
+                    manifests[task.root][_manifest_name(task, outputs)] = key
+            except Exception as e:
+                progress.failed += 1
+                print(f"Ошибка конвертации {task.label}: {str(e)}")
+
+    try:
+        for task, key, future, outputs in submissions():
+            pending[future] = (task, key, outputs)
+            if len(pending) >= window:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect_done(done)
+            progress.report()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect_done(done)
+            progress.report()
+    finally:
+        for root, manifest in manifests.items():
+            _save_manifest(root, manifest)
+    progress.report(force=True)
+    return progress
+
+
+def _sizes_arg(value: str) -> List[Tuple[int, int]]:
+    try:
+        return parse_sizes(value)
+    except HTTPException as e:
+        raise argparse.ArgumentTypeError(e.detail)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Пакетная конвертация WebP/JPEG из каталогов и ZIP-архивов")
+    parser.add_argument("inputs", nargs="+", type=Path, help="каталоги, ZIP-архивы или отдельные файлы")
+    parser.add_argument("--operation", choices=sorted(OPERATIONS), default="convert-webp")
+    parser.add_argument("--output", type=Path, help="каталог для зеркального дерева (по умолчанию рядом с исходниками)")
+    parser.add_argument("--sizes", type=_sizes_arg, help="размеры для операций с изменением размера, например 1080x1440,540x720")
+    parser.add_argument("--preset", choices=list(RESAMPLING_PRESETS), default=DEFAULT_PRESET,
+                        help=f"пресет ресэмплинга (по умолчанию {DEFAULT_PRESET})")
+    parser.add_argument("--max-bytes", type=int, help="бюджет на JPEG в байтах")
+    parser.add_argument("--min-psnr", type=float, help="порог PSNR в дБ")
+    parser.add_argument("--skip", choices=["mtime", "hash", "none"], default="mtime",
+                        help="как определять, что результат уже готов (по умолчанию mtime)")
+    parser.add_argument("--workers", type=int, default=config.WORKERS, help="число процессов (по умолчанию все ядра)")
+    args = parser.parse_args(argv)
+
+    suffixes, name, default_sizes = OPERATIONS[args.operation]
+    if args.sizes and default_sizes is None:
+        parser.error(f"операция {args.operation} не меняет размер, --sizes не применим")
+    try:
+        quality = encode_target(args.max_bytes, args.min_psnr)
+    except HTTPException as e:
+        parser.error(e.detail)
+    resize = resize_args(args.sizes or default_sizes, args.preset)
+
+    tasks = collect(args.inputs, suffixes, args.output, name)
+    if not tasks:
+        print("Нет файлов для обработки")
+        return 1
+
+    config.WORKERS = max(1, args.workers)
+    try:
+        progress = run(
+            tasks, args.operation, name, resize["transforms"], resize.get("sizes"), quality,
+            args.skip, window=config.WORKERS * 4, preset=args.preset,
+        )
+    except KeyboardInterrupt:
+        print("Прервано")
+        return 130
+    finally:
+        workers.shutdown_pool()
+        for archive in {id(task.archive): task.archive for task in tasks if task.archive is not None}.values():
+            archive.close()
+    return 1 if progress.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,286 @@
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+import PIL
+
+import config
+
+# Входит в ключ: другая версия кодировщика может дать другие байты того же результата
+RESULT_VERSION = f"pillow-{PIL.__version__}"
+
+
+class MemoryTier:
+    """LRU-кэш в памяти с ограничением по суммарному размеру значений."""
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.size = 0
+        self.evictions = 0
+        self._items: "OrderedDict[str, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+            return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.budget:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._items[key] = data
+            self.size += len(data)
+            while self.size > self.budget:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+
+# При вытеснении диск очищается до этой доли бюджета, чтобы не обходить каталог на каждой записи
+_DISK_LOW_WATER = 0.9
+# Как часто (секунд) сверять индекс с каталогом, в который пишут и другие процессы
+_DISK_RESCAN_INTERVAL = 30.0
+# Через сколько секунд недописанный *.tmp считается оставшимся от упавшего процесса
+_DISK_TMP_MAX_AGE = 600.0
+
+
+class DiskTier:
+    """LRU-кэш в каталоге: один файл на ключ, порядок восстанавливается по mtime.
+
+    Каталог может быть общим для нескольких воркеров uvicorn. Файлы пишутся
+    атомарно, get() и contains() смотрят на сам каталог, а не только на
+    индекс процесса, поэтому видят результаты других процессов, а
+    исчезнувший файл считается промахом. Индекс — оценка занятого места:
+    когда она превышает бюджет (и не реже раза в _DISK_RESCAN_INTERVAL
+    секунд), каталог обходится заново и самые старые файлы удаляются по
+    фактическому размеру всех файлов, чьими бы они ни были.
+
+    Результаты отдаются клиентам по ключу (GET /results/{key}), поэтому
+    каталог создаётся доступным только владельцу, а каталог другого
+    пользователя не используется (PermissionError).
+    """
+
+    def __init__(self, directory: str, budget: int):
+        self.budget = budget
+        self.size = 0
+        self.evictions = 0
+        self._dir = Path(directory)
+        self._dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        stat = self._dir.stat()
+        if stat.st_uid != os.getuid():
+            raise PermissionError(f"Каталог кэша {directory} принадлежит другому пользователю")
+        if stat.st_mode & 0o077:
+            self._dir.chmod(0o700)
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._rescan_lock = threading.Lock()
+        self._scanned_at = 0.0
+        self._rescan()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def _path(self, key: str) -> Path:
+        return self._dir / f"{key}.bin"
+
+    def _forget(self, key: str) -> None:
+        size = self._index.pop(key, None)
+        if size is not None:
+            self.size -= size
+
+    def _remember(self, key: str, size: int) -> None:
+        with self._lock:
+            self._forget(key)
+            self._index[key] = size
+            self.size += size
+
+    def _rescan(self) -> None:
+        """Строит индекс по каталогу и удаляет самые давние по mtime файлы сверх бюджета.
+
+        Заодно удаляет временные файлы, которые записывавший процесс не
+        переименовал (упал посреди put()).
+        """
+        if not self._rescan_lock.acquire(blocking=False):
+            return
+        try:
+            stale = time.time() - _DISK_TMP_MAX_AGE
+            for path in self._dir.glob("*.tmp"):
+                try:
+                    if path.stat().st_mtime < stale:
+                        path.unlink()
+                except FileNotFoundError:
+                    pass
+            entries = []
+            for path in self._dir.glob("*.bin"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, path.stem, stat.st_size))
+            entries.sort()
+            total = sum(size for _, _, size in entries)
+            limit = self.budget * _DISK_LOW_WATER if total > self.budget else self.budget
+            kept = 0
+            while kept < len(entries) and total > limit:
+                _, key, size = entries[kept]
+                try:
+                    self._path(key).unlink()
+                except FileNotFoundError:
+                    pass
+                total -= size
+                kept += 1
+            index = OrderedDict((key, size) for _, key, size in entries[kept:])
+            with self._lock:
+                self._index = index
+                self.size = total
+                self.evictions += kept
+                self._scanned_at = time.monotonic()
+        finally:
+            self._rescan_lock.release()
+
+    def contains(self, key: str) -> bool:
+        try:
+            size = self._path(key).stat().st_size
+        except FileNotFoundError:
+            with self._lock:
+                self._forget(key)
+            return False
+        with self._lock:
+            if key not in self._index:
+                self._index[key] = size
+                self.size += size
+        return True
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            data = self._path(key).read_bytes()
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            with self._lock:
+                self._forget(key)
+            return None
+        self._remember(key, len(data))
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.budget:
+            return
+        with tempfile.NamedTemporaryFile(dir=self._dir, suffix=".tmp", delete=False) as tmp:
+            tmp.write(data)
+        os.replace(tmp.name, self._path(key))
+        self._remember(key, len(data))
+        with self._lock:
+            rescan = self.size > self.budget or time.monotonic() - self._scanned_at > _DISK_RESCAN_INTERVAL
+        if rescan:
+            self._rescan()
+
+
+class ResultCache:
+    """Кэш готовых JPEG по хэшу входных байтов и параметрам операции.
+
+    Сначала проверяется память, затем диск; попадание на диске поднимает
+    результат в память. Ключ однозначно определяет байты результата, поэтому
+    он же служит сильным ETag.
+    """
+
+    def __init__(self, memory_budget: int, disk_budget: int, directory: str):
+        self.memory = MemoryTier(memory_budget) if memory_budget > 0 else None
+        self.disk = None
+        if disk_budget > 0 and directory:
+            try:
+                self.disk = DiskTier(directory, disk_budget)
+            except OSError as e:
+                print(f"Дисковый кэш отключён: {e}")
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.memory is not None or self.disk is not None
+
+    @staticmethod
+    def key(operation: str, content: bytes, params: tuple) -> str:
+        return ResultCache.key_for_digest(operation, hashlib.sha256(content).hexdigest(), params)
+
+    @staticmethod
+    def key_for_digest(operation: str, digest: str, params: tuple) -> str:
+        """Ключ по SHA-256 входа (hex): клиент, знающий хэш, может спросить о результате без загрузки."""
+        return hashlib.sha256(f"{operation}:{digest}:{params!r}:{RESULT_VERSION}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        data = self.memory.get(key) if self.memory is not None else None
+        if data is None and self.disk is not None:
+            data = self.disk.get(key)
+            if data is not None and self.memory is not None:
+                self.memory.put(key, data)
+        return data
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def lookup(self, keys: List[str]) -> Optional[List[bytes]]:
+        """Результаты одного входа по ключам (например, по одному на размер); None при промахе.
+
+        Попаданием считается только случай, когда в кэше есть все варианты.
+        """
+        found = []
+        for key in keys:
+            data = self.get(key)
+            if data is None:
+                self._count(False)
+                return None
+            found.append(data)
+        self._count(True)
+        return found
+
+    def contains(self, key: str) -> bool:
+        """Есть ли результат в кэше, без чтения с диска и без учёта в статистике."""
+        if self.memory is not None and self.memory.get(key) is not None:
+            return True
+        return self.disk is not None and self.disk.contains(key)
+
+    def put(self, key: str, data: bytes) -> None:
+        if self.memory is not None:
+            self.memory.put(key, data)
+        if self.disk is not None:
+            self.disk.put(key, data)
+
+    def stats(self) -> Dict[str, int]:
+        stats = {"hits": self.hits, "misses": self.misses}
+        for name, tier in (("memory", self.memory), ("disk", self.disk)):
+            if tier is not None:
+                stats[f"{name}_items"] = len(tier)
+                stats[f"{name}_bytes"] = tier.size
+                stats[f"{name}_budget_bytes"] = tier.budget
+                stats[f"{name}_evictions"] = tier.evictions
+        return stats
+
+
+_cache: Optional[ResultCache] = None
+
+
+def get_cache() -> ResultCache:
+    """Возвращает общий кэш результатов, создавая его при первом обращении."""
+    global _cache
+    if _cache is None:
+        _cache = ResultCache(config.CACHE_MEMORY_BYTES, config.CACHE_DISK_BYTES, config.CACHE_DIR)
+    return _cache
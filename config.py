@@ -0,0 +1,88 @@
+import os
+import tempfile
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
+
+
+# Пул процессов для обработки изображений
+WORKERS = _env_int("CONVERT_WORKERS", os.cpu_count() or 1)
+MAX_TASKS_PER_CHILD = _env_int("CONVERT_MAX_TASKS_PER_CHILD", 200)
+TASK_TIMEOUT = _env_float("CONVERT_TASK_TIMEOUT", 60.0)
+
+# Лимиты для входящих ZIP-архивов
+ZIP_MAX_MEMBERS = _env_int("CONVERT_ZIP_MAX_MEMBERS", 10000)
+ZIP_MAX_MEMBER_SIZE = _env_int("CONVERT_ZIP_MAX_MEMBER_SIZE", 200 * 1024 * 1024)
+ZIP_MAX_TOTAL_SIZE = _env_int("CONVERT_ZIP_MAX_TOTAL_SIZE", 4 * 1024 * 1024 * 1024)
+
+# Кэш результатов конвертации (0 отключает уровень)
+CACHE_MEMORY_BYTES = _env_int("CONVERT_CACHE_MEMORY_BYTES", 128 * 1024 * 1024)
+CACHE_DISK_BYTES = _env_int("CONVERT_CACHE_DISK_BYTES", 1024 * 1024 * 1024)
+# Каталог по умолчанию свой у каждого пользователя: результаты из него отдаются клиентам
+CACHE_DIR = os.environ.get("CONVERT_CACHE_DIR", os.path.join(tempfile.gettempdir(), f"convert-cache-{os.getuid()}"))
+
+# Фоновые задачи (POST /jobs)
+JOB_CONCURRENCY = _env_int("CONVERT_JOB_CONCURRENCY", 2)
+JOB_RESULT_TTL = _env_float("CONVERT_JOB_RESULT_TTL", 3600.0)
+JOB_MAX_QUEUED = _env_int("CONVERT_JOB_MAX_QUEUED", 100)
+JOB_DIR = os.environ.get("CONVERT_JOB_DIR", os.path.join(tempfile.gettempdir(), "convert-jobs"))
+
+# Контроль допуска: ограничение одновременных запросов на конвертацию
+ADMISSION_MAX_REQUESTS = _env_int("CONVERT_ADMISSION_MAX_REQUESTS", 8)
+ADMISSION_MAX_BYTES = _env_int("CONVERT_ADMISSION_MAX_BYTES", 1024 * 1024 * 1024)
+ADMISSION_QUEUE_SIZE = _env_int("CONVERT_ADMISSION_QUEUE_SIZE", 32)
+ADMISSION_QUEUE_TIMEOUT = _env_float("CONVERT_ADMISSION_QUEUE_TIMEOUT", 60.0)
+# Сколько байт занимает запрос без Content-Length (chunked), пока его тело не пришло целиком
+ADMISSION_UNKNOWN_BYTES = _env_int("CONVERT_ADMISSION_UNKNOWN_BYTES", 64 * 1024 * 1024)
+
+# Бюджеты на изображение и на запрос, проверяются по заголовку до декодирования
+MAX_IMAGE_PIXELS = _env_int("CONVERT_MAX_IMAGE_PIXELS", 100_000_000)
+MAX_IMAGE_BYTES = _env_int("CONVERT_MAX_IMAGE_BYTES", 100 * 1024 * 1024)
+MAX_REQUEST_PIXELS = _env_int("CONVERT_MAX_REQUEST_PIXELS", 20_000_000_000)
+MAX_REQUEST_BYTES = _env_int("CONVERT_MAX_REQUEST_BYTES", 10 * 1024 * 1024 * 1024)
+
+# Подбор качества JPEG под целевой размер файла или порог PSNR: максимум попыток кодирования
+JPEG_SEARCH_ATTEMPTS = _env_int("CONVERT_JPEG_SEARCH_ATTEMPTS", 7)
+JPEG_MIN_QUALITY = _env_int("CONVERT_JPEG_MIN_QUALITY", 30)
+
+# Пресет ресэмплинга по умолчанию: fast, balanced или best
+RESAMPLING_PRESET = os.environ.get("CONVERT_RESAMPLING_PRESET", "best")
+
+# Объём переиспользуемых холстов letterbox в каждом воркере (0 отключает пул)
+CANVAS_POOL_BYTES = _env_int("CONVERT_CANVAS_POOL_BYTES", 32 * 1024 * 1024)
+
+# Возобновляемые загрузки частями (/uploads)
+UPLOAD_CHUNK_SIZE = _env_int("CONVERT_UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024)
+UPLOAD_MAX_BYTES = _env_int("CONVERT_UPLOAD_MAX_BYTES", 4 * 1024 * 1024 * 1024)
+UPLOAD_TTL = _env_float("CONVERT_UPLOAD_TTL", 24 * 3600.0)
+UPLOAD_DIR = os.environ.get("CONVERT_UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "convert-uploads"))
+
+# Сколько секунд хранится журнал прогресса запроса после завершения (GET /progress/{id})
+PROGRESS_TTL = _env_float("CONVERT_PROGRESS_TTL", 300.0)
+# Сколько последних событий хранит журнал прогресса (0 — без ограничения)
+PROGRESS_MAX_EVENTS = _env_int("CONVERT_PROGRESS_MAX_EVENTS", 10000)
+
+# Согласование по хэшам (POST /negotiate)
+NEGOTIATE_MAX_HASHES = _env_int("CONVERT_NEGOTIATE_MAX_HASHES", 10000)
+
+# Холодный старт: форматы, которые принимает конвертация (пусто — все форматы Pillow),
+# и прогревочная конвертация в каждом процессе пула до готовности сервиса (0 отключает)
+CODECS = [name.strip() for name in os.environ.get("CONVERT_CODECS", "").split(",") if name.strip()]
+WARMUP = _env_int("CONVERT_WARMUP", 1)
+
+# Сколько байт ответа потоковых эндпоинтов (/convert-webp/, /archive/...) копится на сервере,
+# пока клиент его не читает; дальше формирование ответа ждёт клиента
+DUPLEX_BACKLOG_BYTES = _env_int("CONVERT_DUPLEX_BACKLOG_BYTES", 1024 * 1024 * 1024)
+
+# Обмен данными с воркерами через файлы в общей памяти (tmpfs): входы и JPEG не меньше
+# порога передаются путём к файлу вместо копирования через канал пула (0 отключает)
+SPOOL_MIN_BYTES = _env_int("CONVERT_SPOOL_MIN_BYTES", 512 * 1024)
+SPOOL_DIR = os.environ.get(
+    "CONVERT_SPOOL_DIR",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "convert-spool"),
+)
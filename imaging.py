@@ -0,0 +1,464 @@
+from PIL import Image, ImageChops, ImageStat
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+import importlib
+import io
+import math
+import os
+import threading
+import time
+import warnings
+
+import config
+
+JPEG_QUALITY = 95
+TARGET_SIZE = (1080, 1440)
+
+# Защита воркеров от «декомпрессионных бомб»: больше 2x лимита Pillow не открывает
+Image.MAX_IMAGE_PIXELS = config.MAX_IMAGE_PIXELS
+
+
+# Форматы, которые открывают probe() и open_image(); None — все форматы Pillow (см. use_codecs())
+_formats: Optional[Tuple[str, ...]] = None
+
+
+def codec_plugins(formats: List[str]) -> List[str]:
+    """Проверяет имена форматов CONVERT_CODECS и возвращает модули их плагинов Pillow.
+
+    registered_extensions() загружает все плагины, поэтому вызывается в
+    основном процессе, а воркерам передаётся готовый список модулей.
+    """
+    known = set(Image.registered_extensions().values())
+    plugins = []
+    for name in formats:
+        if name.upper() not in known or name.upper() not in Image.OPEN:
+            raise ValueError(f"Неизвестный или не читаемый Pillow формат {name!r} в CONVERT_CODECS")
+        plugins.append(Image.OPEN[name.upper()][0].__module__)
+    return plugins
+
+
+def use_codecs(formats: List[str], plugins: List[str] = ()) -> None:
+    """Ограничивает probe() и open_image() форматами formats; пустой список снимает ограничение.
+
+    plugins — модули плагинов этих форматов (codec_plugins()). Импортированные
+    заранее, они уже зарегистрированы, и Image.open(formats=...) не загружает
+    остальные ~45 плагинов Pillow, так что первый запрос процесса не платит
+    за это десятки миллисекунд. Остальной код процесса по-прежнему открывает
+    и сохраняет любые форматы.
+    """
+    global _formats
+    for plugin in plugins:
+        importlib.import_module(plugin)
+    _formats = tuple(name.upper() for name in formats) or None
+
+
+def _open(source: "Source") -> Image.Image:
+    return Image.open(io.BytesIO(source) if isinstance(source, bytes) else source, formats=_formats)
+
+
+Source = Union[bytes, str, Path]
+
+
+# Пресеты ресэмплинга: фильтр и reducing_gap для thumbnail(). reducing_gap
+# сначала уменьшает изображение в целое число раз быстрым reduce(), а точный
+# фильтр применяется только к остатку; None — точный фильтр на всём пути.
+RESAMPLING_PRESETS: Dict[str, Tuple[Image.Resampling, Optional[float]]] = {
+    "fast": (Image.Resampling.BILINEAR, 1.0),
+    "balanced": (Image.Resampling.BICUBIC, 2.0),
+    "best": (Image.Resampling.LANCZOS, None),
+}
+DEFAULT_PRESET = config.RESAMPLING_PRESET
+if DEFAULT_PRESET not in RESAMPLING_PRESETS:
+    raise ValueError(f"Неизвестный пресет ресэмплинга {DEFAULT_PRESET!r}, доступны: {', '.join(RESAMPLING_PRESETS)}")
+
+BACKGROUND = (255, 255, 255)
+
+# Режимы, которые thumbnail() уменьшает без потерь качества; остальные
+# (палитра, 1-битные, 16-битные) приводятся к RGB/RGBA до уменьшения
+_RESAMPLABLE_MODES = {"RGB", "RGBA", "L", "LA", "CMYK"}
+
+
+def _has_alpha(img: Image.Image) -> bool:
+    return img.mode in ("RGBA", "LA", "PA", "RGBa", "La") or (img.mode == "P" and "transparency" in img.info)
+
+
+def shrink(img: Image.Image, new_size: tuple, preset: str = DEFAULT_PRESET) -> Image.Image:
+    """Уменьшает изображение, чтобы оно вписалось в new_size, сохраняя режим где возможно."""
+    if img.mode not in _RESAMPLABLE_MODES:
+        img = img.convert("RGBA" if _has_alpha(img) else "RGB")
+    resample, reducing_gap = RESAMPLING_PRESETS[preset]
+    img.thumbnail(new_size, resample, reducing_gap=reducing_gap)
+    return img
+
+
+def flatten(img: Image.Image) -> Image.Image:
+    """Приводит изображение к RGB; прозрачность накладывается на белый фон."""
+    if _has_alpha(img):
+        rgba = img.convert("RGBA")
+        flat = Image.new("RGB", rgba.size, BACKGROUND)
+        flat.paste(rgba, mask=rgba.getchannel("A"))
+        return flat
+    return img.convert("RGB")
+
+
+Box = Tuple[int, int, int, int]
+
+
+class CanvasPool:
+    """Переиспользуемые белые холсты для letterbox в пределах одного процесса.
+
+    Холст берётся через acquire() и возвращается через release() после
+    кодирования. Пул помнит, какой прямоугольник холста закрыла последняя
+    вставка, и перед следующей вставкой заливает белым только ту его часть,
+    которую новое изображение не закроет. Общий объём хранимых холстов
+    ограничен max_bytes; лишние холсты просто не возвращаются в пул.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.allocations = 0
+        self.reuses = 0
+        self._free: Dict[Tuple[int, int], List[Tuple[Image.Image, Box]]] = {}
+        self._lent: Dict[int, Box] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, size: Tuple[int, int], box: Box) -> Image.Image:
+        """Возвращает белый холст size, на котором вне box гарантированно фон."""
+        with self._lock:
+            free = self._free.get(size)
+            entry = free.pop() if free else None
+            if entry is not None:
+                self._bytes -= size[0] * size[1] * 3
+                self.reuses += 1
+            else:
+                self.allocations += 1
+        if entry is None:
+            canvas = Image.new("RGB", size, BACKGROUND)
+        else:
+            canvas, dirty = entry
+            if not _contains(box, dirty):
+                canvas.paste(BACKGROUND, dirty)
+        with self._lock:
+            self._lent[id(canvas)] = box
+        return canvas
+
+    def release(self, canvas: Image.Image) -> None:
+        """Возвращает холст в пул; для изображений не из пула ничего не делает."""
+        with self._lock:
+            box = self._lent.pop(id(canvas), None)
+            if box is None:
+                return
+            cost = canvas.width * canvas.height * 3
+            if self._bytes + cost <= self.max_bytes:
+                self._free.setdefault(canvas.size, []).append((canvas, box))
+                self._bytes += cost
+
+    def stats(self) -> Dict[str, int]:
+        return {"allocations": self.allocations, "reuses": self.reuses, "bytes": self._bytes}
+
+
+def _contains(outer: Box, inner: Box) -> bool:
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and outer[2] >= inner[2] and outer[3] >= inner[3]
+
+
+# Холсты рабочего процесса: каждый воркер пула держит свои
+CANVASES = CanvasPool(config.CANVAS_POOL_BYTES)
+
+
+def letterbox(img: Image.Image, new_size: tuple, canvases: Optional[CanvasPool] = None) -> Image.Image:
+    """Размещает уже уменьшенное изображение по центру белого холста new_size.
+
+    С canvases холст берётся из пула, и его нужно вернуть через
+    canvases.release() после того, как результат больше не нужен. Область
+    изображения на холсте записывается в info["letterbox"]: по ней JpegTarget
+    считает PSNR без полей.
+    """
+    if img.size != new_size:
+        offset = ((new_size[0] - img.size[0]) // 2, (new_size[1] - img.size[1]) // 2)
+        box = (offset[0], offset[1], offset[0] + img.size[0], offset[1] + img.size[1])
+        if canvases is None:
+            new_img = Image.new("RGB", new_size, BACKGROUND)
+        else:
+            new_img = canvases.acquire(tuple(new_size), box)
+        new_img.paste(img, offset)
+        new_img.info["letterbox"] = box
+        return new_img
+    return img
+
+
+def resize_image(
+    img: Image.Image, new_size: tuple, preset: str = DEFAULT_PRESET, canvases: Optional[CanvasPool] = None
+) -> Image.Image:
+    """Изменяет размер изображения, сохраняя пропорции, и возвращает RGB new_size.
+
+    Конвертация в RGB и наложение прозрачности на белый фон выполняются уже
+    после уменьшения, то есть на пикселях результата, а не исходника.
+    """
+    return letterbox(flatten(shrink(img, new_size, preset)), new_size, canvases)
+
+
+def probe(source: Source) -> Tuple[int, int, str]:
+    """Читает только заголовок изображения: ширину, высоту и режим, без декодирования пикселей."""
+    with warnings.catch_warnings():
+        # Размер проверяет вызывающий код, предупреждение Pillow здесь лишнее
+        warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+        with _open(source) as img:
+            return img.width, img.height, img.mode
+
+
+def open_image(source: Source, size: Optional[Tuple[int, int]] = None) -> Image.Image:
+    """Открывает изображение, не декодируя пиксели.
+
+    Если задан целевой размер, декодеру разрешается сразу уменьшить картинку
+    (для JPEG — DCT scaling в 1/2, 1/4 или 1/8) до наименьшего масштаба, который
+    всё ещё покрывает size. Для форматов без такой возможности draft() ничего не делает.
+    """
+    img = _open(source)
+    if size is not None:
+        img.draft("RGB", size)
+    return img
+
+
+class ToRGB:
+    """Стадия конвертации в RGB (JPEG не поддерживает альфа-канал и палитру)."""
+
+    stage = "convert"
+
+    def __repr__(self) -> str:
+        return "ToRGB()"
+
+    def apply(self, img: Image.Image) -> Image.Image:
+        return flatten(img)
+
+
+class Letterbox:
+    """Стадия изменения размера: вписывает изображение в size с белыми полями.
+
+    Сама приводит результат к RGB, поэтому ToRGB перед ней не нужна.
+    """
+
+    stage = "resize"
+
+    def __init__(self, size: Tuple[int, int], preset: str = DEFAULT_PRESET):
+        self.size = tuple(size)
+        self.preset = preset
+
+    def __repr__(self) -> str:
+        return f"Letterbox({self.size!r}, {self.preset!r})"
+
+    def apply(self, img: Image.Image, canvases: Optional[CanvasPool] = None) -> Image.Image:
+        return resize_image(img, self.size, self.preset, canvases)
+
+
+class JpegTarget:
+    """Режим кодирования: наименьшее качество JPEG, укладывающееся в цель.
+
+    Цель — либо бюджет max_bytes на файл (берётся самое высокое качество, при
+    котором файл не больше бюджета), либо порог min_psnr в дБ относительно
+    изображения до сжатия (берётся самое низкое качество, при котором PSNR не
+    ниже порога). Качество ищется двоичным поиском в [min_quality, max_quality]
+    на изображении в памяти, не больше attempts кодирований. Если цель
+    недостижима, возвращается ближайший к ней из опробованных вариантов.
+    """
+
+    def __init__(
+        self,
+        max_bytes: Optional[int] = None,
+        min_psnr: Optional[float] = None,
+        min_quality: int = config.JPEG_MIN_QUALITY,
+        max_quality: int = JPEG_QUALITY,
+        attempts: int = config.JPEG_SEARCH_ATTEMPTS,
+    ):
+        if (max_bytes is None) == (min_psnr is None):
+            raise ValueError("Нужно задать ровно одну цель: max_bytes или min_psnr")
+        self.max_bytes = max_bytes
+        self.min_psnr = min_psnr
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.attempts = max(1, attempts)
+
+    def __repr__(self) -> str:
+        return (
+            f"JpegTarget(max_bytes={self.max_bytes!r}, min_psnr={self.min_psnr!r}, "
+            f"min_quality={self.min_quality!r}, max_quality={self.max_quality!r}, attempts={self.attempts!r})"
+        )
+
+    def _meets(self, img: Image.Image, data: bytes) -> bool:
+        if self.max_bytes is not None:
+            return len(data) <= self.max_bytes
+        return psnr(img, data, img.info.get("letterbox")) >= self.min_psnr
+
+    def encode(self, img: Image.Image) -> bytes:
+        # Для бюджета годные качества лежат снизу, для PSNR — сверху;
+        # ищем границу между годными и негодными
+        by_size = self.max_bytes is not None
+        low, high = self.min_quality, self.max_quality
+        best = closest = None
+        for _ in range(self.attempts):
+            if low > high:
+                break
+            quality = (low + high + by_size) // 2
+            data = _save_jpeg(img, quality)
+            if self._meets(img, data):
+                best = data
+                low, high = (quality + 1, high) if by_size else (low, quality - 1)
+            else:
+                closest = data
+                low, high = (low, quality - 1) if by_size else (quality + 1, high)
+        return best if best is not None else closest
+
+
+Quality = Union[int, JpegTarget]
+
+
+def psnr(img: Image.Image, data: bytes, box: Optional[Tuple[int, int, int, int]] = None) -> float:
+    """PSNR (дБ) между изображением и его JPEG-кодированием data.
+
+    box ограничивает сравнение областью изображения на холсте letterbox:
+    белые поля кодируются почти без потерь и завышали бы PSNR.
+    """
+    box = box or (0, 0, img.width, img.height)
+    with Image.open(io.BytesIO(data)) as decoded:
+        diff = ImageChops.difference(img.crop(box).convert("RGB"), decoded.crop(box).convert("RGB"))
+    stat = ImageStat.Stat(diff)
+    mse = sum(stat.sum2) / (len(stat.sum2) * diff.width * diff.height)
+    if mse == 0:
+        return math.inf
+    return 10 * math.log10(255 ** 2 / mse)
+
+
+def _save_jpeg(img: Image.Image, quality: int) -> bytes:
+    output = io.BytesIO()
+    img.save(output, "JPEG", quality=quality)
+    return output.getvalue()
+
+
+@contextmanager
+def _decoded(
+    source: Source,
+    transforms: List,
+    draft_size: Optional[Tuple[int, int]],
+    timings: Dict[str, float],
+    canvases: Optional[CanvasPool] = None,
+) -> Iterator[Image.Image]:
+    """Декодирует изображение и применяет к нему стадии transforms; Letterbox берёт холст из canvases.
+
+    Результат может быть самим открытым изображением, а выход из with
+    закрывает его вместе с пикселями, поэтому результат используется внутри
+    with — без копии исходного разрешения.
+    """
+    start = time.perf_counter()
+    with open_image(source, draft_size) as opened:
+        opened.load()
+        timings["decode"] = time.perf_counter() - start
+        img = opened
+        for transform in transforms:
+            start = time.perf_counter()
+            img = transform.apply(img, canvases) if isinstance(transform, Letterbox) else transform.apply(img)
+            timings[transform.stage] = timings.get(transform.stage, 0.0) + time.perf_counter() - start
+        yield img
+
+
+def _encode(img: Image.Image, quality: Quality, timings: Dict[str, float]) -> bytes:
+    start = time.perf_counter()
+    data = quality.encode(img) if isinstance(quality, JpegTarget) else _save_jpeg(img, quality)
+    timings["encode"] = timings.get("encode", 0.0) + time.perf_counter() - start
+    return data
+
+
+def process_image(
+    source: Source,
+    transforms: List,
+    quality: Quality = JPEG_QUALITY,
+    timings: Optional[Dict[str, float]] = None,
+) -> bytes:
+    """Декодирует изображение, применяет стадии transforms и кодирует результат в JPEG.
+
+    Все стадии выполняются за один проход в памяти. Если передан timings,
+    в него записывается время декодирования, каждой стадии и кодирования.
+    Холст letterbox берётся из пула процесса и возвращается туда после кодирования.
+    """
+    timings = {} if timings is None else timings
+    draft_size = next((t.size for t in transforms if isinstance(t, Letterbox)), None)
+    with _decoded(source, transforms, draft_size, timings, CANVASES) as img:
+        try:
+            return _encode(img, quality, timings)
+        finally:
+            CANVASES.release(img)
+
+
+def process_pyramid(
+    source: Source,
+    transforms: List,
+    sizes: List[Tuple[int, int]],
+    quality: Quality = JPEG_QUALITY,
+    timings: Optional[Dict[str, float]] = None,
+    preset: str = DEFAULT_PRESET,
+) -> List[bytes]:
+    """Строит из одного декодирования JPEG для каждого размера из sizes (в том же порядке).
+
+    Размеры обрабатываются от крупного масштаба к мелкому, и каждый следующий
+    вариант уменьшается из предыдущего (до добавления полей), а не из оригинала.
+    Конвертация в RGB выполняется отдельно для каждого варианта, на его размере.
+    Первое уменьшение делается прямо на декодированном изображении, без его копии.
+    """
+    timings = {} if timings is None else timings
+    draft_size = (max(width for width, _ in sizes), max(height for _, height in sizes))
+    outputs: List[bytes] = [b""] * len(sizes)
+    with _decoded(source, transforms, draft_size, timings) as img:
+        width, height = img.size
+        order = sorted(range(len(sizes)), key=lambda i: min(sizes[i][0] / width, sizes[i][1] / height), reverse=True)
+        current = img
+        for index in order:
+            start = time.perf_counter()
+            current = shrink(current, sizes[index], preset)
+            canvas = letterbox(flatten(current), sizes[index], CANVASES)
+            timings["resize"] = timings.get("resize", 0.0) + time.perf_counter() - start
+            try:
+                outputs[index] = _encode(canvas, quality, timings)
+            finally:
+                CANVASES.release(canvas)
+    return outputs
+
+
+def process_image_timed(source: Source, transforms: List, quality: Quality = JPEG_QUALITY) -> Tuple[bytes, Dict[str, float]]:
+    """process_image для пула процессов: возвращает JPEG и время стадий."""
+    timings: Dict[str, float] = {}
+    return process_image(source, transforms, quality, timings), timings
+
+
+def process_pyramid_timed(
+    source: Source,
+    transforms: List,
+    sizes: List[Tuple[int, int]],
+    quality: Quality = JPEG_QUALITY,
+    preset: str = DEFAULT_PRESET,
+) -> Tuple[List[bytes], Dict[str, float]]:
+    """process_pyramid для пула процессов: возвращает JPEG всех размеров и время стадий."""
+    timings: Dict[str, float] = {}
+    return process_pyramid(source, transforms, sizes, quality, timings, preset), timings
+
+
+def convert_image(
+    source: Source, size: Optional[Tuple[int, int]] = None, quality: Quality = JPEG_QUALITY, preset: str = DEFAULT_PRESET
+) -> bytes:
+    """Конвертирует изображение в JPEG, при необходимости меняя размер."""
+    transforms = [ToRGB()] if size is None else [Letterbox(size, preset)]
+    return process_image(source, transforms, quality)
+
+
+def warm_up() -> int:
+    """Прогревает процесс пула: конвертирует маленький WebP с прозрачностью как есть и с letterbox.
+
+    Первые декодирование, ресэмплинг и кодирование инициализируют кодеки и
+    заводят холст TARGET_SIZE в пуле холстов, поэтому первый настоящий запрос
+    к процессу не платит за это. Возвращает pid процесса.
+    """
+    buffer = io.BytesIO()
+    Image.new("RGBA", (64, 48), (200, 40, 40, 128)).save(buffer, "WEBP")
+    source = buffer.getvalue()
+    process_image(source, [ToRGB()])
+    process_image(source, [Letterbox(TARGET_SIZE)])
+    return os.getpid()
@@ -0,0 +1,315 @@
+from typing import AsyncIterator, BinaryIO, List, Optional, Tuple, Union
+import zipfile
+import zlib
+
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+import config
+
+
+class ArchiveError(ValueError):
+    """Архив повреждён или превышает лимиты."""
+
+
+def open_archive(fileobj: Union[BinaryIO, str], suffixes: Tuple[str, ...]) -> Tuple[zipfile.ZipFile, List[zipfile.ZipInfo]]:
+    """Открывает ZIP прямо из загруженного файла (или по пути) и отбирает элементы по расширению.
+
+    Используется только центральный каталог архива: ничего не распаковывается,
+    пока элемент не понадобится. Лимиты на число элементов и их несжатый размер
+    проверяются до начала обработки.
+    """
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile as e:
+        raise ArchiveError("Файл не является корректным ZIP-архивом") from e
+
+    members = [
+        info for info in archive.infolist()
+        if not info.is_dir() and info.filename.lower().endswith(suffixes)
+    ]
+    try:
+        if len(members) > config.ZIP_MAX_MEMBERS:
+            raise ArchiveError(f"В архиве больше {config.ZIP_MAX_MEMBERS} файлов")
+        for info in members:
+            if info.file_size > config.ZIP_MAX_MEMBER_SIZE:
+                raise ArchiveError(f"Файл {info.filename} в архиве больше {config.ZIP_MAX_MEMBER_SIZE} байт")
+        if sum(info.file_size for info in members) > config.ZIP_MAX_TOTAL_SIZE:
+            raise ArchiveError(f"Суммарный размер файлов в архиве больше {config.ZIP_MAX_TOTAL_SIZE} байт")
+    except ArchiveError:
+        archive.close()
+        raise
+    return archive, members
+
+
+def read_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo) -> bytes:
+    """Распаковывает один элемент, не доверяя размеру из заголовка архива."""
+    with archive.open(info) as member:
+        data = member.read(config.ZIP_MAX_MEMBER_SIZE + 1)
+    if len(data) > config.ZIP_MAX_MEMBER_SIZE:
+        raise ArchiveError(f"Файл {info.filename} в архиве больше {config.ZIP_MAX_MEMBER_SIZE} байт")
+    return data
+
+
+def copy_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo, output: BinaryIO, block: int = 1024 * 1024) -> None:
+    """Распаковывает элемент в output блоками, с той же проверкой размера, что и read_member."""
+    written = 0
+    with archive.open(info) as member:
+        for data in iter(lambda: member.read(block), b""):
+            written += len(data)
+            if written > config.ZIP_MAX_MEMBER_SIZE:
+                raise ArchiveError(f"Файл {info.filename} в архиве больше {config.ZIP_MAX_MEMBER_SIZE} байт")
+            output.write(data)
+
+
+
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz")
+
+# Блок tar (tarfile.BLOCKSIZE): сам tarfile импортируется только при чтении архива
+_BLOCK = 512
+_GZIP_MAGIC = b"\x1f\x8b"
+# Сколько распакованных байт gzip отдаёт за один шаг: ограничивает память и время без переключения
+_INFLATE_STEP = 1024 * 1024
+
+
+async def _plain(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Байты tar из потока фрагментов; gzip определяется по сигнатуре и распаковывается на лету."""
+    inflate = None
+    head: Optional[bytes] = b""
+    async for chunk in chunks:
+        if head is not None:
+            head += chunk
+            if len(head) < len(_GZIP_MAGIC):
+                continue
+            chunk, head = head, None
+            if chunk.startswith(_GZIP_MAGIC):
+                inflate = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if inflate is None:
+            yield chunk
+            continue
+        data = chunk
+        while data and not inflate.eof:
+            try:
+                output = inflate.decompress(data, _INFLATE_STEP)
+            except zlib.error as e:
+                raise ArchiveError("Файл не является корректным архивом tar.gz") from e
+            if output:
+                yield output
+            data = inflate.unconsumed_tail
+    if head:
+        yield head
+
+
+class TarReader:
+    """Последовательно читает tar или tar.gz из потока фрагментов, не дожидаясь конца архива.
+
+    В отличие от ZIP, у tar нет центрального каталога: каждый элемент идёт
+    сразу за своим заголовком, поэтому его можно отдавать на обработку, пока
+    остальная часть архива ещё загружается. Лимиты ZIP_MAX_* действуют так же,
+    как для ZIP, но проверяются по мере чтения.
+    """
+
+    def __init__(self, chunks: AsyncIterator[bytes], suffixes: Tuple[str, ...]):
+        self._stream = _plain(chunks)
+        self._buffer = bytearray()
+        self.suffixes = suffixes
+        self.count = 0
+        self.total_size = 0
+
+    async def _more(self) -> None:
+        try:
+            self._buffer += await self._stream.__anext__()
+        except StopAsyncIteration:
+            raise ArchiveError("Архив оборван: поток закончился до конца элемента")
+
+    async def _read(self, size: int) -> bytes:
+        while len(self._buffer) < size:
+            await self._more()
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    async def _skip(self, size: int) -> None:
+        """Пропускает данные, не накапливая их в памяти."""
+        while size > 0:
+            if not self._buffer:
+                await self._more()
+            step = min(size, len(self._buffer))
+            del self._buffer[:step]
+            size -= step
+
+    async def members(self) -> AsyncIterator[Tuple[str, Union[bytes, ArchiveError]]]:
+        """Отдаёт (имя, байты) подходящих по расширению файлов; вместо байтов — ошибка, если элемент превышает лимит."""
+        import tarfile  # tar нужен редко, его импорт не должен замедлять запуск сервиса
+
+        long_name: Optional[str] = None
+        while True:
+            block = await self._read(_BLOCK)
+            if not block.strip(b"\0"):
+                return
+            try:
+                info = tarfile.TarInfo.frombuf(block, "utf-8", "surrogateescape")
+            except tarfile.HeaderError as e:
+                raise ArchiveError("Файл не является корректным tar-архивом") from e
+            padded = -(-info.size // _BLOCK) * _BLOCK
+            if info.type in (tarfile.GNUTYPE_LONGNAME, tarfile.XHDTYPE):
+                if info.size > 64 * 1024:
+                    raise ArchiveError("Слишком длинный расширенный заголовок в tar-архиве")
+                data = (await self._read(padded))[:info.size]
+                long_name = _long_name(info.type, data) or long_name
+                continue
+            name, long_name = long_name or info.name, None
+            if not info.isreg() or not name.lower().endswith(self.suffixes):
+                await self._skip(padded)
+                continue
+            if self.count >= config.ZIP_MAX_MEMBERS:
+                raise ArchiveError(f"В архиве больше {config.ZIP_MAX_MEMBERS} файлов")
+            if self.total_size + info.size > config.ZIP_MAX_TOTAL_SIZE:
+                raise ArchiveError(f"Суммарный размер файлов в архиве больше {config.ZIP_MAX_TOTAL_SIZE} байт")
+            self.count += 1
+            self.total_size += info.size
+            if info.size > config.ZIP_MAX_MEMBER_SIZE:
+                await self._skip(padded)
+                yield name, ArchiveError(f"Файл {name} в архиве больше {config.ZIP_MAX_MEMBER_SIZE} байт")
+                continue
+            data = await self._read(padded)
+            yield name, data[:info.size]
+
+    async def close(self) -> None:
+        await self._stream.aclose()
+
+
+def _long_name(kind: bytes, data: bytes) -> Optional[str]:
+    """Имя из GNU-заголовка длинного имени или из записи path расширенного заголовка PAX."""
+    import tarfile
+
+    if kind == tarfile.GNUTYPE_LONGNAME:
+        return data.rstrip(b"\0").decode("utf-8", "surrogateescape")
+    # Записи PAX: "<длина> <ключ>=<значение>\n"
+    while data:
+        length, _, rest = data.partition(b" ")
+        try:
+            record = data[:int(length)]
+        except ValueError:
+            return None
+        key, _, value = rest[:int(length) - len(length) - 1].partition(b"=")
+        if key == b"path":
+            return value.rstrip(b"\n").decode("utf-8", "surrogateescape")
+        data = data[len(record):]
+        if not record:
+            return None
+    return None
+
+
+class FormError(ValueError):
+    """Тело multipart/form-data повреждено или превышает лимиты."""
+
+
+# Текстовые поля формы (параметры операции) маленькие
+_FIELD_MAX_SIZE = 64 * 1024
+
+
+def _decode(value: bytes) -> str:
+    try:
+        return value.decode("utf-8")
+    except UnicodeDecodeError:
+        return value.decode("latin-1")
+
+
+class FormPart:
+    """Одна полностью полученная часть формы: поле name, имя файла (None у текстовых полей) и данные."""
+
+    def __init__(self, name: str, filename: Optional[str]):
+        self.name = name
+        self.filename = filename
+        self.data = bytearray()
+        self.error: Optional[FormError] = None
+
+    @property
+    def text(self) -> str:
+        return _decode(bytes(self.data))
+
+
+class MultipartReader:
+    """Разбирает multipart/form-data по мере поступления тела запроса.
+
+    В отличие от разбора формы фреймворком, который вызывает обработчик только
+    после приёма всех частей, parts() отдаёт каждую часть, как только она
+    получена целиком. Тело читается только тогда, когда вызывающий просит
+    следующую часть, поэтому в памяти не больше одной принимаемой части. Файл
+    больше max_file_size не накапливается: часть отдаётся с ошибкой в error.
+    """
+
+    def __init__(self, content_type: Optional[str], chunks: AsyncIterator[bytes], max_file_size: int):
+        kind, options = parse_options_header(content_type)
+        if kind != b"multipart/form-data" or not options.get(b"boundary"):
+            raise FormError("Ожидается тело multipart/form-data")
+        self.max_file_size = max_file_size
+        self._chunks = chunks
+        self._ready: List[FormPart] = []
+        self._part: Optional[FormPart] = None
+        self._headers: dict = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._finished = False
+        self._parser = MultipartParser(options[b"boundary"], {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": lambda data, start, end: self._add_header_field(data[start:end]),
+            "on_header_value": lambda data, start, end: self._add_header_value(data[start:end]),
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": lambda data, start, end: self._add_data(data[start:end]),
+            "on_part_end": self._on_part_end,
+            "on_end": self._on_end,
+        })
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+
+    def _add_header_field(self, data: bytes) -> None:
+        self._header_field += data
+
+    def _add_header_value(self, data: bytes) -> None:
+        self._header_value += data
+
+    def _on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field, self._header_value = b"", b""
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition"))
+        if b"name" not in options:
+            raise FormError("У части формы нет имени поля (Content-Disposition: name)")
+        filename = options.get(b"filename")
+        self._part = FormPart(_decode(options[b"name"]), None if filename is None else _decode(filename))
+
+    def _add_data(self, data: bytes) -> None:
+        part = self._part
+        if part.error is not None:
+            return
+        limit = _FIELD_MAX_SIZE if part.filename is None else self.max_file_size
+        if len(part.data) + len(data) > limit:
+            if part.filename is None:
+                raise FormError(f"Поле {part.name} больше {_FIELD_MAX_SIZE} байт")
+            part.error = FormError(f"Файл {part.filename} больше {self.max_file_size} байт")
+            part.data = bytearray()
+            return
+        part.data += data
+
+    def _on_part_end(self) -> None:
+        self._ready.append(self._part)
+        self._part = None
+
+    def _on_end(self) -> None:
+        self._finished = True
+
+    async def parts(self) -> AsyncIterator[FormPart]:
+        async for chunk in self._chunks:
+            try:
+                self._parser.write(chunk)
+            except MultipartParseError as e:
+                raise FormError("Тело формы повреждено") from e
+            while self._ready:
+                yield self._ready.pop(0)
+        if not self._finished:
+            raise FormError("Тело формы оборвано до конца последней части")
@@ -0,0 +1,263 @@
+from fastapi import HTTPException
+from pathlib import Path
+from typing import Dict, Optional
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+
+import config
+from pipeline import ARCHIVE_FORMATS, Pipeline, archive_filename, close_sources, write_archive
+
+JOB_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+FINISHED = ("done", "failed", "cancelled")
+
+# Как часто (секунд) процесс сохраняет состояние своих незавершённых задач
+_JOB_HEARTBEAT = 5.0
+# Незавершённая задача, чьё состояние не обновлялось столько секунд, прервана вместе с процессом
+_JOB_LOST_AFTER = 30.0
+
+
+class Job:
+    """Фоновая конвертация пакета с результатом в файле.
+
+    Состояние задачи лежит на диске рядом с результатом: {id}.json — статус
+    и счётчики, {id}.events — события прогресса (NDJSON), время изменения
+    {id}.json — последнее обновление. Процесс, выполняющий задачу, держит её
+    в памяти вместе с конвейером и переписывает {id}.json при смене статуса
+    и раз в _JOB_HEARTBEAT секунд; остальные воркеры uvicorn читают задачу
+    с диска (load()).
+    """
+
+    def __init__(self, directory: Path, format: str = "zip", filename: str = "", job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.pipeline: Optional[Pipeline] = None
+        self.format = format
+        self.filename = filename
+        self.media_type = ARCHIVE_FORMATS[format][0]
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        # Счётчики задачи, прочитанной с диска; у своей задачи они берутся из конвейера
+        self.counts: dict = {}
+        self.result_path = directory / f"{self.id}{ARCHIVE_FORMATS[format][1]}"
+        self.meta_path = directory / f"{self.id}.json"
+        self.events_path = directory / f"{self.id}.events"
+        self.task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def load(cls, directory: Path, job_id: str) -> Optional["Job"]:
+        """Читает задачу с диска; None, если её нет (или она уже удалена по сроку)."""
+        meta_path = directory / f"{job_id}.json"
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            updated_at = meta_path.stat().st_mtime
+        except (FileNotFoundError, ValueError):
+            return None
+        job = cls(directory, meta["format"], meta["filename"], job_id)
+        job.status = meta["status"]
+        job.error = meta["error"]
+        job.created_at = meta["created_at"]
+        job.finished_at = meta["finished_at"]
+        job.counts = meta["counts"]
+        if job.status not in FINISHED and time.time() - updated_at > _JOB_LOST_AFTER:
+            job.status = "failed"
+            job.error = "Задача прервана: процесс, выполнявший её, завершился"
+            job.finished_at = updated_at
+        return job
+
+    def save(self) -> None:
+        meta = {
+            "format": self.format,
+            "filename": self.filename,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "counts": self._counts(),
+        }
+        partial_path = self.meta_path.with_name(self.meta_path.name + ".part")
+        partial_path.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        os.replace(partial_path, self.meta_path)
+
+    def _counts(self) -> dict:
+        if self.pipeline is None:
+            return self.counts
+        return {
+            "total": self.pipeline.total,
+            "processed": self.pipeline.processed,
+            "failed": self.pipeline.failed,
+            "skipped": self.pipeline.skipped,
+            "deduplicated": self.pipeline.deduplicated,
+            "budget": self.pipeline.budget.to_dict(),
+        }
+
+    def to_dict(self) -> dict:
+        info = {
+            "id": self.id,
+            "status": self.status,
+            "format": self.format,
+            **self._counts(),
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+        if self.error is not None:
+            info["error"] = self.error
+        if self.finished_at is not None:
+            info["expires_at"] = self.finished_at + config.JOB_RESULT_TTL
+        return info
+
+
+class JobManager:
+    """Очередь фоновых задач с ограничением числа одновременно выполняемых.
+
+    Ждущая задача держит свои загруженные файлы, поэтому ждать может не
+    больше max_queued задач процесса; сверх этого POST /jobs получает 429.
+    Задачи выполняются в процессе, который их принял, а состояние, события
+    и результаты лежат в каталоге JOB_DIR (см. Job), так что каталог можно
+    делить между воркерами uvicorn: любой из них отвечает на GET /jobs/{id}.
+    Файлы задач удаляются через JOB_RESULT_TTL секунд после последнего
+    изменения — фоновой очисткой в любом процессе, в том числе файлы задач
+    упавшего или перезапущенного процесса.
+    """
+
+    def __init__(self, directory: str, concurrency: int, ttl: float, max_queued: int = config.JOB_MAX_QUEUED):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_queued = max_queued
+        self._jobs: Dict[str, Job] = {}
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._maintainer: Optional[asyncio.Task] = None
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.status == "queued")
+
+    def check_capacity(self) -> None:
+        """429, если очередь задач заполнена; вызывается до приёма файлов задачи в работу."""
+        if self.queued >= self.max_queued:
+            raise HTTPException(
+                status_code=429, detail="Очередь фоновых задач заполнена, повторите запрос позже",
+                headers={"Retry-After": "60"},
+            )
+
+    async def submit(self, pipeline: Pipeline, format: str = "zip") -> Job:
+        self.purge_expired()
+        try:
+            self.check_capacity()
+        except HTTPException:
+            await close_sources(pipeline.sources)
+            raise
+        if self._maintainer is None:
+            self._maintainer = asyncio.create_task(self._maintain())
+        job = Job(self.directory, format, archive_filename(pipeline.filename, format))
+        job.pipeline = pipeline
+        # События задачи доступны по GET /jobs/{id}/events в любом процессе
+        pipeline.track_progress(job.events_path)
+        job.save()
+        self._jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(job))
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self.purge_expired()
+        job = self._jobs.get(job_id)
+        if job is None and JOB_ID_PATTERN.fullmatch(job_id):
+            job = Job.load(self.directory, job_id)
+        return job
+
+    def finished(self, job_id: str) -> bool:
+        """Завершена ли задача (или удалена); для потока событий задачи другого процесса."""
+        job = self.get(job_id)
+        return job is None or job.status in FINISHED
+
+    async def _run(self, job: Job) -> None:
+        partial_path = job.result_path.with_name(f"{job.id}.part")
+        try:
+            async with self._semaphore:
+                job.status = "running"
+                job.save()
+                written = await write_archive(job.pipeline, partial_path, job.format)
+                if written:
+                    os.replace(partial_path, job.result_path)
+                    job.status = "done"
+                else:
+                    job.status = "failed"
+                    job.error = job.pipeline.result_detail()
+        except asyncio.CancelledError:
+            if job.status == "queued":
+                await close_sources(job.pipeline.sources)
+            job.status = "cancelled"
+            raise
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            print(f"Ошибка задачи {job.id}: {str(e)}")
+        finally:
+            job.finished_at = time.time()
+            partial_path.unlink(missing_ok=True)
+            job.save()
+
+    def purge_expired(self) -> None:
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and now - job.finished_at > self.ttl:
+                del self._jobs[job_id]
+        for path in self.directory.iterdir():
+            job_id = path.name.split(".", 1)[0]
+            if job_id in self._jobs or not JOB_ID_PATTERN.fullmatch(job_id):
+                continue
+            try:
+                expired = now - path.stat().st_mtime > self.ttl
+            except FileNotFoundError:
+                continue
+            if expired:
+                path.unlink(missing_ok=True)
+
+    async def _maintain(self) -> None:
+        """Обновляет состояние незавершённых задач процесса и раз в min(ttl, 60) секунд удаляет истёкшие."""
+        purged_at = time.monotonic()
+        while True:
+            await asyncio.sleep(_JOB_HEARTBEAT)
+            for job in list(self._jobs.values()):
+                if job.status not in FINISHED:
+                    try:
+                        job.save()
+                    except OSError as e:
+                        print(f"Не удалось сохранить состояние задачи {job.id}: {e}")
+            if time.monotonic() - purged_at >= min(self.ttl, 60.0):
+                purged_at = time.monotonic()
+                self.purge_expired()
+
+    async def shutdown(self) -> None:
+        # Результаты остаются на диске: их отдают другие воркеры и процесс после перезапуска
+        tasks = [job.task for job in self._jobs.values() if job.task is not None and not job.task.done()]
+        if self._maintainer is not None:
+            tasks.append(self._maintainer)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._jobs.clear()
+
+
+_manager: Optional[JobManager] = None
+
+
+def get_job_manager() -> JobManager:
+    """Возвращает общий менеджер задач, создавая его при первом обращении."""
+    global _manager
+    if _manager is None:
+        _manager = JobManager(config.JOB_DIR, config.JOB_CONCURRENCY, config.JOB_RESULT_TTL, config.JOB_MAX_QUEUED)
+    return _manager
+
+
+async def shutdown_jobs() -> None:
+    global _manager
+    if _manager is not None:
+        await _manager.shutdown()
+        _manager = None
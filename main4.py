@@ -1,18 +1,63 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import StreamingResponse
-from PIL import Image
-from pathlib import Path
-import io
-import zipfile
-import tempfile
-import shutil
+# Первым: отсчёт времени холодного старта начинается с импорта startup
+import startup
+from fastapi import FastAPI, File, Form, Request, UploadFile, HTTPException
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+import asyncio
+import hashlib
 from fastapi.middleware.cors import CORSMiddleware
 
+import config
+import metrics
+from admission import AdmissionMiddleware
+from cache import get_cache
+from imaging import TARGET_SIZE, use_codecs
+from jobs import get_job_manager, shutdown_jobs
+from operations import (
+    OPERATIONS, SHA256_PATTERN, build_pipeline, convert_body, convert_stream, convert_webp_form, convert_zip, encode_target,
+    negotiate, parse_archive_format, parse_digests, parse_optional_preset, parse_preset, parse_sizes, resize_args,
+    resize_jpeg,
+)
+import progress
+from pipeline import archive_response, etag_matches, image_response, not_modified, quote_etag, result_keys
+from transport import shutdown_spool
+from uploads import get_upload_manager, shutdown_uploads
+from workers import shutdown_pool
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Заголовки (preflight) читаются в основном процессе: те же форматы, что у воркеров
+    if config.CODECS:
+        use_codecs(config.CODECS)
+    # uvicorn начинает принимать запросы только после прогрева
+    await startup.state.warm_up()
+    yield
+    startup.state.stopping()
+    await shutdown_jobs()
+    shutdown_uploads()
+    shutdown_pool()
+    shutdown_spool()
+
+
 app = FastAPI(
     title="WebP to JPEG Converter API",
-    description="API для конвертации WebP в JPEG и изменения размера JPEG. Поддерживает 5 операций: конвертация WebP, конвертация WebP из ZIP, конвертация WebP с изменением размера, конвертация WebP из ZIP с изменением размера, изменение размера JPEG."
+    description="API для конвертации WebP в JPEG и изменения размера JPEG. Поддерживает 5 операций: конвертация WebP, конвертация WebP из ZIP, конвертация WebP с изменением размера, конвертация WebP из ZIP с изменением размера, изменение размера JPEG.",
+    lifespan=lifespan,
 )
 
+# Пути тяжёлых операций: для метрик и контроля допуска
+HEAVY_PATHS = {
+    **{f"/{operation}/": operation for operation in OPERATIONS}, "/image": "image", "/jobs": "jobs",
+    "/uploads/{upload_id}/finalize": "uploads-finalize", "/archive/{operation}": "archive",
+}
+
+# id прогресса для GET /progress/{id} запросам с заголовком X-Progress
+app.add_middleware(progress.ProgressMiddleware)
+
+# Ограничение одновременных запросов (внутри CORS, чтобы ответ 429 тоже получал CORS-заголовки)
+app.add_middleware(AdmissionMiddleware, paths=HEAVY_PATHS)
 
 # Добавление CORS
 app.add_middleware(
@@ -23,241 +68,291 @@ app.add_middleware(
     allow_headers=["*"],  # Разрешить все заголовки
 )
 
+# Время и число одновременных запросов для /metrics
+app.add_middleware(metrics.MetricsMiddleware, paths=HEAVY_PATHS)
+
 
-def resize_image(img: Image.Image, new_size: tuple) -> Image.Image:
-    """Изменяет размер изображения, сохраняя пропорции."""
-    img.thumbnail(new_size, Image.Resampling.LANCZOS)
-    if img.size != new_size:
-        new_img = Image.new("RGB", new_size, (255, 255, 255))
-        offset = ((new_size[0] - img.size[0]) // 2, (new_size[1] - img.size[1]) // 2)
-        new_img.paste(img, offset)
-        return new_img
-    return img
-
-@app.post("/convert-webp/", response_class=StreamingResponse)
-async def convert_webp_files(files: list[UploadFile] = File(...)):
-    with tempfile.TemporaryDirectory() as output_dir:
-        output_path = Path(output_dir)
-        converted_files = []
-
-        for file in files:
-            if not file.filename.lower().endswith(".webp"):
-                raise HTTPException(status_code=400, detail=f"Файл {file.filename} не WebP")
-            try:
-                content = await file.read()
-                img = Image.open(io.BytesIO(content)).convert("RGB")
-                output_file = output_path / f"{Path(file.filename).stem}.jpg"
-                output_file.parent.mkdir(parents=True, exist_ok=True)
-                img.save(output_file, "JPEG", quality=95)
-                converted_files.append(output_file)
-            except Exception as e:
-                print(f"Ошибка конвертации {file.filename}: {str(e)}")
-
-        if not converted_files:
-            raise HTTPException(status_code=400, detail="Нет валидных WebP файлов")
-
-        output_zip = output_path / "converted_images.zip"
-        with zipfile.ZipFile(output_zip, "w", zipfile.ZIP_DEFLATED) as zip_ref:
-            for jpeg_file in converted_files:
-                zip_ref.write(jpeg_file, jpeg_file.relative_to(output_path))
-
-        with open(output_zip, "rb") as f:
-            content = f.read()
-
-        return StreamingResponse(
-            io.BytesIO(content),
-            media_type="application/zip",
-            headers={"Content-Disposition": "attachment; filename=converted_images.zip"}
-        )
+def _form_body(**fields: dict) -> dict:
+    """Описание формы для OpenAPI у эндпоинтов, которые разбирают multipart сами, по мере приёма.
+
+    Параметры идут раньше files: Swagger UI отправляет поля формы в порядке схемы,
+    а параметры учитываются, только если пришли до файлов.
+    """
+    properties = {**fields, "files": {"type": "array", "items": {"type": "string", "format": "binary"}}}
+    schema = {"type": "object", "required": ["files"], "properties": properties}
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": schema}}}}
+
+_ENCODE_FIELDS = {
+    "max_bytes": {"type": "integer"}, "min_psnr": {"type": "number"},
+    "format": {"type": "string", "enum": ["zip", "tar", "tar.gz"]},
+}
+_RESIZE_FIELDS = {"sizes": {"type": "string"}, "preset": {"type": "string"}}
+
+@app.post("/convert-webp/", response_class=StreamingResponse, openapi_extra=_form_body(**_ENCODE_FIELDS))
+async def convert_webp_files(request: Request):
+    """Каждый файл конвертируется сразу после получения, не дожидаясь остальной формы; параметры — до файлов."""
+    pipeline, format = await convert_webp_form(request.headers.get("content-type"), request.stream())
+    return await archive_response(pipeline, format, duplex=True)
 
 @app.post("/convert-zip/", response_class=StreamingResponse)
-async def convert_webp_zip(file: UploadFile = File(...)):
-    if not file.filename.lower().endswith(".zip"):
-        raise HTTPException(status_code=400, detail="Загрузите .zip файл")
-
-    with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as output_dir:
-        input_path = Path(input_dir)
-        output_path = Path(output_dir)
-        zip_path = input_path / file.filename
-
-        with open(zip_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        with zipfile.ZipFile(zip_path, "r") as zip_ref:
-            zip_ref.extractall(input_path)
-
-        converted_files = []
-        for webp_file in input_path.rglob("*.webp"):
-            try:
-                with Image.open(webp_file) as img:
-                    rgb_img = img.convert("RGB")
-                    output_file = output_path / f"{webp_file.stem}.jpg"
-                    output_file.parent.mkdir(parents=True, exist_ok=True)
-                    rgb_img.save(output_file, "JPEG", quality=95)
-                    converted_files.append(output_file)
-            except Exception as e:
-                print(f"Ошибка конвертации {webp_file.name}: {str(e)}")
-
-        if not converted_files:
-            raise HTTPException(status_code=400, detail="Нет валидных WebP файлов в архиве")
-
-        output_zip = output_path / "converted_images.zip"
-        with zipfile.ZipFile(output_zip, "w", zipfile.ZIP_DEFLATED) as zip_ref:
-            for jpeg_file in converted_files:
-                zip_ref.write(jpeg_file, jpeg_file.relative_to(output_path))
-
-        with open(output_zip, "rb") as f:
-            content = f.read()
-
-        return StreamingResponse(
-            io.BytesIO(content),
-            media_type="application/zip",
-            headers={"Content-Disposition": "attachment; filename=converted_images.zip"}
-        )
-
-@app.post("/convert-webp-resize/", response_class=StreamingResponse)
-async def convert_webp_files_resize(files: list[UploadFile] = File(...)):
-    with tempfile.TemporaryDirectory() as output_dir:
-        output_path = Path(output_dir)
-        converted_files = []
-
-        for file in files:
-            if not file.filename.lower().endswith(".webp"):
-                raise HTTPException(status_code=400, detail=f"Файл {file.filename} не WebP")
-            try:
-                content = await file.read()
-                img = Image.open(io.BytesIO(content)).convert("RGB")
-                resized_img = resize_image(img, (1080, 1440))
-                output_file = output_path / f"{Path(file.filename).stem}.jpg"
-                output_file.parent.mkdir(parents=True, exist_ok=True)
-                resized_img.save(output_file, "JPEG", quality=95)
-                converted_files.append(output_file)
-            except Exception as e:
-                print(f"Ошибка конвертации {file.filename}: {str(e)}")
-
-        if not converted_files:
-            raise HTTPException(status_code=400, detail="Нет валидных WebP файлов")
-
-        output_zip = output_path / "converted_images.zip"
-        with zipfile.ZipFile(output_zip, "w", zipfile.ZIP_DEFLATED) as zip_ref:
-            for jpeg_file in converted_files:
-                zip_ref.write(jpeg_file, jpeg_file.relative_to(output_path))
-
-        with open(output_zip, "rb") as f:
-            content = f.read()
-
-        return StreamingResponse(
-            io.BytesIO(content),
-            media_type="application/zip",
-            headers={"Content-Disposition": "attachment; filename=converted_images.zip"}
-        )
+async def convert_webp_zip(
+    file: UploadFile = File(...), max_bytes: Optional[int] = Form(None), min_psnr: Optional[float] = Form(None),
+    format: Optional[str] = Form(None),
+):
+    format = parse_archive_format(format)
+    return await archive_response(await convert_zip(file, quality=encode_target(max_bytes, min_psnr)), format)
+
+@app.post(
+    "/convert-webp-resize/", response_class=StreamingResponse, openapi_extra=_form_body(**_RESIZE_FIELDS, **_ENCODE_FIELDS)
+)
+async def convert_webp_files_resize(request: Request):
+    """Как /convert-webp/, с изменением размера; параметры — до файлов."""
+    pipeline, format = await convert_webp_form(request.headers.get("content-type"), request.stream(), resize=True)
+    return await archive_response(pipeline, format, duplex=True)
 
 @app.post("/convert-zip-resize/", response_class=StreamingResponse)
-async def convert_webp_zip_resize(file: UploadFile = File(...)):
-    if not file.filename.lower().endswith(".zip"):
-        raise HTTPException(status_code=400, detail="Загрузите .zip файл")
-
-    with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as output_dir:
-        input_path = Path(input_dir)
-        output_path = Path(output_dir)
-        zip_path = input_path / file.filename
-
-        with open(zip_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        with zipfile.ZipFile(zip_path, "r") as zip_ref:
-            zip_ref.extractall(input_path)
-
-        converted_files = []
-        for webp_file in input_path.rglob("*.webp"):
-            try:
-                with Image.open(webp_file) as img:
-                    rgb_img = img.convert("RGB")
-                    resized_img = resize_image(rgb_img, (1080, 1440))
-                    output_file = output_path / f"{webp_file.stem}.jpg"
-                    output_file.parent.mkdir(parents=True, exist_ok=True)
-                    resized_img.save(output_file, "JPEG", quality=95)
-                    converted_files.append(output_file)
-            except Exception as e:
-                print(f"Ошибка конвертации {webp_file.name}: {str(e)}")
-
-        if not converted_files:
-            raise HTTPException(status_code=400, detail="Нет валидных WebP файлов в архиве")
-
-        output_zip = output_path / "converted_images.zip"
-        with zipfile.ZipFile(output_zip, "w", zipfile.ZIP_DEFLATED) as zip_ref:
-            for jpeg_file in converted_files:
-                zip_ref.write(jpeg_file, jpeg_file.relative_to(output_path))
-
-        with open(output_zip, "rb") as f:
-            content = f.read()
-
-        return StreamingResponse(
-            io.BytesIO(content),
-            media_type="application/zip",
-            headers={"Content-Disposition": "attachment; filename=converted_images.zip"}
-        )
+async def convert_webp_zip_resize(
+    file: UploadFile = File(...), sizes: Optional[str] = Form(None), preset: Optional[str] = Form(None),
+    max_bytes: Optional[int] = Form(None), min_psnr: Optional[float] = Form(None), format: Optional[str] = Form(None),
+):
+    format = parse_archive_format(format)
+    pipeline = await convert_zip(
+        file, parse_sizes(sizes) or [TARGET_SIZE], encode_target(max_bytes, min_psnr), parse_preset(preset)
+    )
+    return await archive_response(pipeline, format)
 
 @app.post("/resize-jpeg/", response_class=StreamingResponse)
-async def resize_jpeg_files(files: list[UploadFile] = File(...)):
-    with tempfile.TemporaryDirectory() as output_dir:
-        output_path = Path(output_dir)
-        resized_files = []
-
-        for file in files:
-            if not file.filename.lower().endswith((".jpg", ".jpeg")) and not file.filename.lower().endswith(".zip"):
-                raise HTTPException(status_code=400, detail=f"Файл {file.filename} не JPEG и не ZIP")
-
-            if file.filename.lower().endswith((".jpg", ".jpeg")):
-                try:
-                    content = await file.read()
-                    img = Image.open(io.BytesIO(content)).convert("RGB")
-                    resized_img = resize_image(img, (1080, 1440))
-                    output_file = output_path / f"{Path(file.filename).stem}_resized.jpg"
-                    output_file.parent.mkdir(parents=True, exist_ok=True)
-                    resized_img.save(output_file, "JPEG", quality=95)
-                    resized_files.append(output_file)
-                except Exception as e:
-                    print(f"Ошибка обработки {file.filename}: {str(e)}")
-            else:  # ZIP file
-                with tempfile.TemporaryDirectory() as input_dir:
-                    input_path = Path(input_dir)
-                    zip_path = input_path / file.filename
-                    with open(zip_path, "wb") as buffer:
-                        shutil.copyfileobj(file.file, buffer)
-
-                    with zipfile.ZipFile(zip_path, "r") as zip_ref:
-                        zip_ref.extractall(input_path)
-
-                    for jpeg_file in input_path.rglob("*.jp*g"):
-                        try:
-                            with Image.open(jpeg_file) as img:
-                                rgb_img = img.convert("RGB")
-                                resized_img = resize_image(rgb_img, (1080, 1440))
-                                output_file = output_path / f"{jpeg_file.stem}_resized.jpg"
-                                output_file.parent.mkdir(parents=True, exist_ok=True)
-                                resized_img.save(output_file, "JPEG", quality=95)
-                                resized_files.append(output_file)
-                        except Exception as e:
-                            print(f"Ошибка обработки {jpeg_file.name}: {str(e)}")
-
-        if not resized_files:
-            raise HTTPException(status_code=400, detail="Нет валидных JPEG файлов")
-
-        output_zip = output_path / "resized_images.zip"
-        with zipfile.ZipFile(output_zip, "w", zipfile.ZIP_DEFLATED) as zip_ref:
-            for jpeg_file in resized_files:
-                zip_ref.write(jpeg_file, jpeg_file.relative_to(output_path))
-
-        with open(output_zip, "rb") as f:
-            content = f.read()
-
-        return StreamingResponse(
-            io.BytesIO(content),
-            media_type="application/zip",
-            headers={"Content-Disposition": "attachment; filename=resized_images.zip"}
-        )
+async def resize_jpeg_files(
+    files: list[UploadFile] = File(...), sizes: Optional[str] = Form(None), preset: Optional[str] = Form(None),
+    max_bytes: Optional[int] = Form(None), min_psnr: Optional[float] = Form(None), format: Optional[str] = Form(None),
+):
+    format = parse_archive_format(format)
+    pipeline = await resize_jpeg(
+        files, parse_sizes(sizes), encode_target(max_bytes, min_psnr), parse_preset(preset)
+    )
+    return await archive_response(pipeline, format)
+
+async def _read_body(request: Request, limit: int, detail: str) -> bytes:
+    """Тело запроса целиком, но не больше limit байт: 413, как только оно превышено.
+
+    Content-Length проверяется сразу, а тело без него (chunked) считается
+    по мере приёма, чтобы не держать в памяти больше лимита.
+    """
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+        raise HTTPException(status_code=413, detail=detail)
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limit:
+            raise HTTPException(status_code=413, detail=detail)
+    return bytes(body)
+
+@app.post("/image", response_class=Response)
+async def convert_raw_image(
+    request: Request,
+    resize: bool = False,
+    size: Optional[str] = None,
+    quality: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    min_psnr: Optional[float] = None,
+    preset: Optional[str] = None,
+):
+    """Одно изображение телом запроса, без multipart; в ответе сразу JPEG, без архива.
+
+    resize=true вписывает изображение в 1080x1440, size=ШИРИНАxВЫСОТА — в заданный размер.
+    Ответ несёт ETag; при совпадении с If-None-Match — 304 без обработки.
+    """
+    sizes = parse_sizes(size)
+    if sizes is not None and len(sizes) != 1:
+        raise HTTPException(status_code=400, detail="Для /image можно указать только один размер")
+    target = sizes[0] if sizes else (TARGET_SIZE if resize else None)
+    preset = parse_optional_preset(preset)
+    if target is None and preset is not None:
+        raise HTTPException(status_code=400, detail="Параметр preset применим только с resize или size")
+    quality = encode_target(max_bytes, min_psnr, quality)
+    preset = parse_preset(preset)
+    content = await _read_body(request, config.MAX_IMAGE_BYTES, f"Изображение больше {config.MAX_IMAGE_BYTES} байт")
+    digest = await asyncio.to_thread(lambda: hashlib.sha256(content).hexdigest())
+    etag = result_keys(digest, quality, **resize_args(None if target is None else [target], preset))[0]
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    return await image_response(await convert_body(content, target, quality, preset), etag)
+
+@app.post("/archive/{operation}", response_class=StreamingResponse)
+async def convert_archive_stream(
+    operation: str,
+    request: Request,
+    sizes: Optional[str] = None,
+    preset: Optional[str] = None,
+    max_bytes: Optional[int] = None,
+    min_psnr: Optional[float] = None,
+    format: Optional[str] = None,
+):
+    """tar или tar.gz телом запроса (без multipart): файлы конвертируются, пока архив ещё загружается.
+
+    operation — convert-zip, convert-zip-resize или resize-jpeg; результаты
+    отдаются по мере готовности, одновременно с приёмом тела.
+    """
+    format = parse_archive_format(format)
+    pipeline = await convert_stream(
+        operation, request.stream(), parse_sizes(sizes), encode_target(max_bytes, min_psnr), parse_optional_preset(preset)
+    )
+    return await archive_response(pipeline, format, duplex=True)
+
+@app.post("/negotiate")
+async def negotiate_results(
+    operation: str = Form(...), hashes: list[str] = Form(...),
+    sizes: Optional[str] = Form(None), preset: Optional[str] = Form(None),
+    max_bytes: Optional[int] = Form(None), min_psnr: Optional[float] = Form(None),
+):
+    """По SHA-256 исходных изображений сообщает, какие результаты операции уже готовы, а какие файлы нужно загрузить."""
+    return negotiate(
+        operation, parse_digests(hashes), parse_sizes(sizes), encode_target(max_bytes, min_psnr),
+        parse_optional_preset(preset),
+    )
+
+@app.get("/results/{key}")
+async def get_result(key: str, request: Request):
+    """Готовый JPEG из хранилища результатов по ключу (он же ETag); 304 при совпадении с If-None-Match."""
+    if not SHA256_PATTERN.fullmatch(key):
+        raise HTTPException(status_code=404, detail="Результат не найден")
+    if etag_matches(request.headers.get("if-none-match"), key):
+        return not_modified(key)
+    data = await asyncio.to_thread(get_cache().get, key)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Результат не найден")
+    return Response(data, media_type="image/jpeg", headers={"ETag": quote_etag(key), "Cache-Control": "public, max-age=31536000, immutable"})
+
+@app.post("/jobs", status_code=202)
+async def create_job(
+    operation: str = Form(...), files: list[UploadFile] = File(...),
+    sizes: Optional[str] = Form(None), preset: Optional[str] = Form(None),
+    max_bytes: Optional[int] = Form(None), min_psnr: Optional[float] = Form(None), format: Optional[str] = Form(None),
+):
+    """Запускает любую из пяти операций в фоне и возвращает id задачи; 429, если очередь задач заполнена."""
+    format = parse_archive_format(format)
+    get_job_manager().check_capacity()
+    pipeline = await build_pipeline(
+        operation, files, parse_sizes(sizes), encode_target(max_bytes, min_psnr), parse_optional_preset(preset)
+    )
+    job = await get_job_manager().submit(pipeline, format)
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = get_job_manager().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/events")
+async def get_job_events(job_id: str, request: Request, format: Optional[str] = None):
+    """Поток событий задачи: по одному на изображение и итоговое (SSE или NDJSON)."""
+    manager = get_job_manager()
+    job = manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    if job.pipeline is not None:
+        return _progress_stream(job.pipeline.progress.follow(), request, format)
+    # Задачу выполняет другой процесс: события читаются из её файла
+    return _progress_stream(progress.follow_file(job.events_path, lambda: manager.finished(job_id)), request, format)
+
+@app.get("/progress/{progress_id}")
+async def get_progress(progress_id: str, request: Request, format: Optional[str] = None):
+    """Поток событий синхронного запроса, отправленного с заголовком X-Progress; id — из заголовка ответа X-Progress-Id."""
+    log = progress.registry.get(progress_id)
+    if log is None:
+        raise HTTPException(status_code=404, detail="Журнал прогресса с таким id не найден")
+    return _progress_stream(log.follow(), request, format)
+
+def _progress_stream(events: AsyncIterator[dict], request: Request, format: Optional[str]) -> StreamingResponse:
+    if format is not None and format not in progress.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Неизвестный формат {format}. Доступны: {', '.join(progress.FORMATS)}")
+    stream_format = progress.negotiate(format, request.headers.get("accept"))
+    return StreamingResponse(
+        progress.render(events, stream_format), media_type=progress.FORMATS[stream_format], headers=progress.stream_headers()
+    )
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = get_job_manager().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Результат недоступен (статус задачи {job.status})")
+    return FileResponse(job.result_path, media_type=job.media_type, filename=job.filename)
+
+@app.post("/uploads", status_code=201)
+async def create_upload(filename: str = Form(...), size: int = Form(...)):
+    """Создаёт сессию возобновляемой загрузки файла size байт; ответ содержит id и размер части."""
+    return get_upload_manager().create(filename, size).to_dict()
+
+def _get_upload(upload_id: str):
+    session = get_upload_manager().get(upload_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Загрузка не найдена")
+    return session
+
+@app.put("/uploads/{upload_id}/chunks/{index}")
+async def put_upload_chunk(upload_id: str, index: int, request: Request):
+    """Принимает часть index телом запроса; SHA-256 части передаётся в заголовке X-Chunk-SHA256."""
+    session = _get_upload(upload_id)
+    data = await _read_body(request, session.chunk_size, f"Часть больше {session.chunk_size} байт")
+    await get_upload_manager().write_chunk(session, index, data, request.headers.get("x-chunk-sha256"))
+    return session.to_dict()
+
+@app.get("/uploads/{upload_id}")
+async def get_upload(upload_id: str):
+    """Полученные диапазоны байт и недостающие части."""
+    return _get_upload(upload_id).to_dict()
+
+@app.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(
+    upload_id: str,
+    operation: str = Form(...),
+    background: bool = Form(False),
+    sizes: Optional[str] = Form(None), preset: Optional[str] = Form(None),
+    max_bytes: Optional[int] = Form(None), min_psnr: Optional[float] = Form(None), format: Optional[str] = Form(None),
+):
+    """Запускает операцию над загруженным файлом: сразу отдаёт архив или, с background, создаёт задачу."""
+    manager = get_upload_manager()
+    session = _get_upload(upload_id)
+    quality = encode_target(max_bytes, min_psnr)
+    format = parse_archive_format(format)
+    preset = parse_optional_preset(preset)
+    if background:
+        # До открытия: при заполненной очереди загрузка остаётся для повторного finalize
+        get_job_manager().check_capacity()
+    upload = manager.open_file(session)
+    try:
+        pipeline = await build_pipeline(operation, [upload], parse_sizes(sizes), quality, preset)
+    except HTTPException:
+        # Сессия остаётся: можно повторить finalize с другими параметрами
+        upload.file.close()
+        raise
+    # Файл уже открыт конвейером и удалится с диска после его закрытия
+    manager.remove(session)
+    if background:
+        return JSONResponse((await get_job_manager().submit(pipeline, format)).to_dict(), status_code=202)
+    return await archive_response(pipeline, format)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/cache")
+async def cache_stats():
+    return get_cache().stats()
+
+@app.get("/ready")
+async def ready():
+    """Готовность процесса к запросам (200/503) и замеры холодного старта."""
+    return JSONResponse(startup.state.to_dict(), status_code=200 if startup.state.ready else 503)
 
 @app.get("/")
 async def root():
-    return {"message": "API для конвертации WebP в JPEG и изменения размера JPEG. Используйте /docs для Swagger UI."}
\ No newline at end of file
+    return {"message": "API для конвертации WebP в JPEG и изменения размера JPEG. Используйте /docs для Swagger UI."}
+
+
+startup.state.imported()
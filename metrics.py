@@ -0,0 +1,196 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import bisect
+import time
+
+import config
+import startup
+from cache import get_cache
+from workers import queue_depth
+
+# Простые метрики в текстовом формате Prometheus без внешних зависимостей.
+# Все обновления происходят в потоке event loop, поэтому блокировки не нужны.
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    """Базовая метрика. Если задана function, значения вычисляются при каждом чтении:
+    function возвращает число или словарь {значения меток: число}.
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (), function: Callable = None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._function = function
+        self._values: Dict[LabelValues, float] = defaultdict(float)
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self) -> List[str]:
+        values = self._values
+        if self._function is not None:
+            values = self._function()
+            if not isinstance(values, dict):
+                values = {(): values}
+        return [f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in values.items()]
+
+    def render(self) -> str:
+        header = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(header + self.samples())
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        self._values[self._key(labels)] += amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        self._values[self._key(labels)] += amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self._values[self._key(labels)] -= amount
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = defaultdict(float)
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labels + ("le",), key + (le,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {self._sums[key]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+# Метрики конвертации
+
+STAGE_SECONDS = Histogram(
+    "convert_stage_seconds",
+    "Время стадии обработки одного изображения (read, unzip, queue, decode, convert, resize, encode, archive).",
+    ("endpoint", "stage"),
+)
+REQUEST_SECONDS = Histogram(
+    "convert_request_seconds", "Полное время запроса, включая потоковую отдачу ответа.", ("endpoint",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0),
+)
+IMAGES = Counter("convert_images_total", "Обработанные изображения по результату (ok, cached, duplicate, skipped, error).", ("endpoint", "status"))
+INPUT_BYTES = Counter("convert_input_bytes_total", "Байты исходных изображений.", ("endpoint",))
+OUTPUT_BYTES = Counter("convert_output_bytes_total", "Байты готовых JPEG.", ("endpoint",))
+IN_FLIGHT = Gauge("convert_requests_in_flight", "Запросы, обрабатываемые в данный момент.", ("endpoint",))
+POOL_WORKERS = Gauge("convert_pool_workers", "Число процессов в пуле.", function=lambda: config.WORKERS)
+POOL_QUEUE_DEPTH = Gauge("convert_pool_queue_depth", "Задачи, ожидающие свободного процесса пула.", function=queue_depth)
+READY = Gauge("convert_ready", "1, если процесс прогрет и принимает запросы.", function=lambda: int(startup.state.ready))
+STARTUP_SECONDS = Gauge(
+    "convert_startup_seconds",
+    "Холодный старт от начала импорта приложения: import, warmup (длительность прогрева), ready, first_conversion.",
+    ("phase",), function=lambda: {(phase,): seconds for phase, seconds in startup.state.seconds.items()},
+)
+
+
+def _cache_values(*fields: str) -> Callable[[], Dict[LabelValues, float]]:
+    def values() -> Dict[LabelValues, float]:
+        stats = get_cache().stats()
+        return {(field.split("_")[0],): stats[field] for field in fields if field in stats}
+    return values
+
+
+CACHE_LOOKUPS = Counter("convert_cache_lookups_total", "Обращения к кэшу результатов.", ("result",),
+                        function=lambda: {("hit",): get_cache().hits, ("miss",): get_cache().misses})
+CACHE_EVICTIONS = Counter("convert_cache_evictions_total", "Вытеснения из кэша.", ("tier",),
+                          function=_cache_values("memory_evictions", "disk_evictions"))
+CACHE_BYTES = Gauge("convert_cache_bytes", "Объём данных в кэше.", ("tier",),
+                    function=_cache_values("memory_bytes", "disk_bytes"))
+
+
+@contextmanager
+def stage_timer(endpoint: str, stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, stage=stage)
+
+
+def endpoint_for(paths: Dict[str, str], path: str) -> Optional[str]:
+    """Имя эндпоинта для пути запроса; в шаблонах путей сегмент {…} совпадает с любым значением."""
+    if path in paths:
+        return paths[path]
+    segments = path.split("/")
+    for pattern, endpoint in paths.items():
+        parts = pattern.split("/")
+        if "{" in pattern and len(parts) == len(segments) and all(
+            part == segment or (part.startswith("{") and part.endswith("}") and segment)
+            for part, segment in zip(parts, segments)
+        ):
+            return endpoint
+    return None
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: время и число одновременных запросов для отслеживаемых путей.
+
+    Учитывается всё время до отправки последнего байта, в том числе потоковая
+    отдача архива. Остальные пути попадают в метку endpoint="other".
+    """
+
+    def __init__(self, app, paths: Dict[str, str]):
+        self.app = app
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        endpoint = endpoint_for(self.paths, scope["path"]) or "other"
+        IN_FLIGHT.inc(endpoint=endpoint)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            IN_FLIGHT.dec(endpoint=endpoint)
+            REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
@@ -0,0 +1,361 @@
+from fastapi import HTTPException, UploadFile
+from pathlib import PurePosixPath
+from typing import AsyncIterator, List, Optional, Tuple
+import re
+
+import config
+from cache import get_cache
+
+from imaging import DEFAULT_PRESET, JPEG_QUALITY, RESAMPLING_PRESETS, TARGET_SIZE, JpegTarget, Letterbox, Quality, ToRGB
+from ingest import TAR_SUFFIXES, FormError, FormPart, MultipartReader
+from pipeline import (
+    ARCHIVE_FORMATS, ArchiveSource, BodySource, FormSource, Pipeline, TarSource, UploadSource, close_sources, keep_upload,
+    quote_etag, result_keys, upload_chunks,
+)
+
+
+def jpg_name(name: str) -> str:
+    return f"{PurePosixPath(name).stem}.jpg"
+
+
+def resized_name(name: str) -> str:
+    return f"{PurePosixPath(name).stem}_resized.jpg"
+
+
+MAX_SIZES = 8
+MAX_DIMENSION = 10000
+SHA256_PATTERN = re.compile(r"[0-9a-f]{64}")
+# Операции без изменения размера
+CONVERT_ONLY = ("convert-webp", "convert-zip")
+# Операции, принимающие архив телом запроса (POST /archive/{operation})
+STREAM_OPERATIONS = ("convert-zip", "convert-zip-resize", "resize-jpeg")
+ARCHIVE_SUFFIXES = (".zip",) + TAR_SUFFIXES
+
+
+def transforms_for(size: Optional[Tuple[int, int]], preset: str = DEFAULT_PRESET) -> list:
+    return [ToRGB()] if size is None else [Letterbox(size, preset)]
+
+
+def parse_preset(value: Optional[str]) -> str:
+    """Пресет ресэмплинга из запроса; без значения — пресет по умолчанию."""
+    if value is None or not value.strip():
+        return DEFAULT_PRESET
+    if value.strip() not in RESAMPLING_PRESETS:
+        raise HTTPException(
+            status_code=400, detail=f"Неизвестный пресет {value.strip()!r}. Доступны: {', '.join(RESAMPLING_PRESETS)}"
+        )
+    return value.strip()
+
+
+def parse_optional_preset(value: Optional[str]) -> Optional[str]:
+    """Пресет, если он задан; пустое значение (например, ?preset=) — как отсутствующее, None."""
+    if value is None or not value.strip():
+        return None
+    return parse_preset(value)
+
+
+def parse_archive_format(value: Optional[str]) -> str:
+    """Формат архива с результатами; по умолчанию zip."""
+    if value is None or not value.strip():
+        return "zip"
+    if value.strip().lower() not in ARCHIVE_FORMATS:
+        raise HTTPException(
+            status_code=400, detail=f"Неизвестный формат архива {value.strip()!r}. Доступны: {', '.join(ARCHIVE_FORMATS)}"
+        )
+    return value.strip().lower()
+
+
+def archive_source(file: UploadFile, suffixes: Tuple[str, ...]):
+    """ZIP читается по центральному каталогу, tar и tar.gz — последовательно, без перемотки."""
+    if file.filename.lower().endswith(TAR_SUFFIXES):
+        upload = keep_upload(file)
+        return TarSource(upload.filename, upload_chunks(upload), suffixes, upload)
+    return ArchiveSource(file, suffixes)
+
+
+def parse_sizes(value: Optional[str]) -> Optional[List[Tuple[int, int]]]:
+    """Разбирает список размеров вида "1080x1440,540x720"; None, если не задан."""
+    if value is None or not value.strip():
+        return None
+    sizes = []
+    for part in value.split(","):
+        try:
+            width, height = (int(v) for v in part.strip().lower().split("x"))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Неверный размер {part.strip()!r}, ожидается ШИРИНАxВЫСОТА")
+        if not (1 <= width <= MAX_DIMENSION and 1 <= height <= MAX_DIMENSION):
+            raise HTTPException(status_code=400, detail=f"Размер {width}x{height} вне диапазона 1..{MAX_DIMENSION}")
+        if (width, height) not in sizes:
+            sizes.append((width, height))
+    if len(sizes) > MAX_SIZES:
+        raise HTTPException(status_code=400, detail=f"Не больше {MAX_SIZES} размеров за запрос")
+    return sizes
+
+
+def encode_target(
+    max_bytes: Optional[int] = None, min_psnr: Optional[float] = None, quality: Optional[int] = None
+) -> Quality:
+    """Режим кодирования JPEG из параметров запроса: фиксированное качество или подбор под цель."""
+    if sum(value is not None for value in (max_bytes, min_psnr, quality)) > 1:
+        raise HTTPException(status_code=400, detail="Укажите только одно из quality, max_bytes и min_psnr")
+    if quality is not None:
+        if not 1 <= quality <= JPEG_QUALITY:
+            raise HTTPException(status_code=400, detail=f"quality должно быть от 1 до {JPEG_QUALITY}")
+        return quality
+    if max_bytes is None and min_psnr is None:
+        return JPEG_QUALITY
+    if max_bytes is not None and max_bytes < 1:
+        raise HTTPException(status_code=400, detail="max_bytes должен быть положительным")
+    if min_psnr is not None and not 10 <= min_psnr <= 100:
+        raise HTTPException(status_code=400, detail="min_psnr должен быть от 10 до 100 дБ")
+    return JpegTarget(max_bytes=max_bytes, min_psnr=min_psnr)
+
+
+def resize_args(sizes: Optional[List[Tuple[int, int]]], preset: str = DEFAULT_PRESET) -> dict:
+    """Стадии и размеры конвейера: один размер обрабатывается как раньше, несколько — пирамидой.
+
+    Для пирамиды стадий нет: каждый вариант уменьшается и приводится к RGB
+    внутри imaging.process_pyramid.
+    """
+    if sizes is None:
+        return {"transforms": transforms_for(None)}
+    if len(sizes) == 1:
+        return {"transforms": transforms_for(sizes[0], preset)}
+    return {"transforms": [], "sizes": sizes, "preset": preset}
+
+
+async def convert_webp(
+    files: List[UploadFile], sizes: Optional[List[Tuple[int, int]]] = None, quality: Quality = JPEG_QUALITY,
+    preset: str = DEFAULT_PRESET,
+) -> Pipeline:
+    operation = "convert-webp" if sizes is None else "convert-webp-resize"
+    for file in files:
+        if not file.filename.lower().endswith(".webp"):
+            raise HTTPException(status_code=400, detail=f"Файл {file.filename} не WebP")
+    return Pipeline(
+        operation, [UploadSource(files)], name=jpg_name,
+        filename="converted_images.zip", empty_detail="Нет валидных WebP файлов",
+        quality=quality, **resize_args(sizes, preset),
+    )
+
+
+def _form_number(fields: dict, name: str, kind: type):
+    value = fields.get(name)
+    if value is None or not value.strip():
+        return None
+    try:
+        return kind(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Поле {name} должно быть числом")
+
+
+async def convert_webp_form(
+    content_type: Optional[str], chunks: AsyncIterator[bytes], resize: bool = False
+) -> Tuple[Pipeline, str]:
+    """convert-webp(-resize) из формы, которая ещё принимается: каждый файл конвертируется сразу после получения.
+
+    Параметры (sizes, preset, max_bytes, min_psnr, format) читаются из полей,
+    пришедших до первого файла. Возвращает конвейер и формат архива.
+    """
+    try:
+        parts = MultipartReader(content_type, chunks, config.MAX_IMAGE_BYTES).parts()
+    except FormError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    fields = {}
+    first: Optional[FormPart] = None
+    try:
+        async for part in parts:
+            if part.filename is None:
+                fields[part.name] = part.text
+            elif part.name == "files":
+                first = part
+                break
+    except FormError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if first is None:
+        raise HTTPException(status_code=400, detail="Нет файлов в поле files")
+    if not first.filename.lower().endswith(".webp"):
+        raise HTTPException(status_code=400, detail=f"Файл {first.filename} не WebP")
+    quality = encode_target(_form_number(fields, "max_bytes", int), _form_number(fields, "min_psnr", float))
+    format = parse_archive_format(fields.get("format"))
+    sizes = (parse_sizes(fields.get("sizes")) or [TARGET_SIZE]) if resize else None
+    pipeline = Pipeline(
+        "convert-webp-resize" if resize else "convert-webp", [FormSource(parts, first, "files", (".webp",))],
+        name=jpg_name, filename="converted_images.zip", empty_detail="Нет валидных WebP файлов",
+        quality=quality, **resize_args(sizes, parse_preset(fields.get("preset"))),
+    )
+    return pipeline, format
+
+
+async def convert_zip(
+    file: UploadFile, sizes: Optional[List[Tuple[int, int]]] = None, quality: Quality = JPEG_QUALITY,
+    preset: str = DEFAULT_PRESET,
+) -> Pipeline:
+    operation = "convert-zip" if sizes is None else "convert-zip-resize"
+    if not file.filename.lower().endswith(ARCHIVE_SUFFIXES):
+        raise HTTPException(status_code=400, detail="Загрузите .zip, .tar или .tar.gz файл")
+    return Pipeline(
+        operation, [archive_source(file, (".webp",))], name=jpg_name,
+        filename="converted_images.zip", empty_detail="Нет валидных WebP файлов в архиве",
+        quality=quality, **resize_args(sizes, preset),
+    )
+
+
+async def resize_jpeg(
+    files: List[UploadFile], sizes: Optional[List[Tuple[int, int]]] = None, quality: Quality = JPEG_QUALITY,
+    preset: str = DEFAULT_PRESET,
+) -> Pipeline:
+    for file in files:
+        if not file.filename.lower().endswith((".jpg", ".jpeg") + ARCHIVE_SUFFIXES):
+            raise HTTPException(status_code=400, detail=f"Файл {file.filename} не JPEG и не архив (ZIP, tar, tar.gz)")
+    sources = []
+    try:
+        for file in files:
+            if file.filename.lower().endswith(ARCHIVE_SUFFIXES):
+                sources.append(archive_source(file, (".jpg", ".jpeg")))
+            else:
+                sources.append(UploadSource([file]))
+    except HTTPException:
+        await close_sources(sources)
+        raise
+    return Pipeline(
+        "resize-jpeg", sources, name=resized_name,
+        filename="resized_images.zip", empty_detail="Нет валидных JPEG файлов", error_prefix="Ошибка обработки",
+        quality=quality, **resize_args(sizes or [TARGET_SIZE], preset),
+    )
+
+
+async def convert_body(
+    content: bytes,
+    size: Optional[Tuple[int, int]] = None,
+    quality: Quality = JPEG_QUALITY,
+    preset: str = DEFAULT_PRESET,
+) -> Pipeline:
+    """Одно изображение из тела запроса (без multipart и ZIP): конвертация или изменение размера."""
+    if not content:
+        raise HTTPException(status_code=400, detail="Пустое тело запроса")
+    operation = "image" if size is None else "image-resize"
+    return Pipeline(
+        operation, [BodySource("image", content)], name=jpg_name,
+        filename="image.jpg", empty_detail="Тело запроса не является поддерживаемым изображением",
+        quality=quality, **resize_args(None if size is None else [size], preset),
+    )
+
+
+async def convert_stream(
+    operation: str,
+    chunks: AsyncIterator[bytes],
+    sizes: Optional[List[Tuple[int, int]]] = None,
+    quality: Quality = JPEG_QUALITY,
+    preset: Optional[str] = None,
+) -> Pipeline:
+    """tar или tar.gz телом запроса: файлы обрабатываются по мере поступления, не дожидаясь конца загрузки."""
+    args = operation_args(operation, sizes, preset)
+    if operation not in STREAM_OPERATIONS:
+        raise HTTPException(
+            status_code=400, detail=f"Архивом телом запроса принимаются только операции {', '.join(STREAM_OPERATIONS)}"
+        )
+    if operation == "resize-jpeg":
+        return Pipeline(
+            operation, [TarSource("archive", chunks, (".jpg", ".jpeg"))], name=resized_name,
+            filename="resized_images.zip", empty_detail="Нет валидных JPEG файлов в архиве", error_prefix="Ошибка обработки",
+            quality=quality, **args,
+        )
+    return Pipeline(
+        operation, [TarSource("archive", chunks, (".webp",))], name=jpg_name,
+        filename="converted_images.zip", empty_detail="Нет валидных WebP файлов в архиве",
+        quality=quality, **args,
+    )
+
+
+def operation_args(
+    operation: str, sizes: Optional[List[Tuple[int, int]]] = None, preset: Optional[str] = None
+) -> dict:
+    """Стадии и размеры, с которыми операция обрабатывает каждое изображение (см. resize_args).
+
+    sizes и preset допустимы только для операций с изменением размера.
+    """
+    if operation not in OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"Неизвестная операция {operation}. Доступны: {', '.join(OPERATIONS)}")
+    if (sizes is not None or preset is not None) and operation in CONVERT_ONLY:
+        raise HTTPException(
+            status_code=400, detail=f"Операция {operation} не меняет размер, параметры sizes и preset не применимы"
+        )
+    if operation in CONVERT_ONLY:
+        return resize_args(None)
+    return resize_args(sizes or [TARGET_SIZE], preset or DEFAULT_PRESET)
+
+
+def parse_digests(values: List[str]) -> List[str]:
+    """SHA-256 исходных изображений (hex) из запроса согласования."""
+    if len(values) > config.NEGOTIATE_MAX_HASHES:
+        raise HTTPException(status_code=400, detail=f"Не больше {config.NEGOTIATE_MAX_HASHES} хэшей за запрос")
+    digests = []
+    for value in values:
+        digest = value.strip().lower()
+        if not SHA256_PATTERN.fullmatch(digest):
+            raise HTTPException(status_code=400, detail=f"Неверный SHA-256 {value.strip()!r}, ожидается 64 hex-символа")
+        digests.append(digest)
+    return digests
+
+
+def negotiate(
+    operation: str, digests: List[str], sizes: Optional[List[Tuple[int, int]]] = None,
+    quality: Quality = JPEG_QUALITY, preset: Optional[str] = None,
+) -> dict:
+    """Делит исходные изображения на те, чьи результаты уже есть в хранилище, и те, что нужно загрузить.
+
+    Для найденных возвращаются ETag и адреса результатов (по одному на размер);
+    проверяется только наличие, результаты не читаются.
+    """
+    args = operation_args(operation, sizes, preset)
+    labels = [None] if operation in CONVERT_ONLY else [f"{width}x{height}" for width, height in sizes or [TARGET_SIZE]]
+    cache = get_cache()
+    hits, misses = [], []
+    for digest in dict.fromkeys(digests):
+        keys = result_keys(digest, quality, **args)
+        if not cache.enabled or not all(cache.contains(key) for key in keys):
+            misses.append(digest)
+            continue
+        hits.append({
+            "sha256": digest,
+            "outputs": [
+                {"size": label, "etag": quote_etag(key), "url": f"/results/{key}"}
+                for label, key in zip(labels, keys)
+            ],
+        })
+    return {"operation": operation, "hits": hits, "misses": misses}
+
+
+def _single_archive(files: List[UploadFile]) -> UploadFile:
+    if len(files) != 1:
+        raise HTTPException(status_code=400, detail="Загрузите один архив (.zip, .tar или .tar.gz)")
+    return files[0]
+
+
+async def build_pipeline(
+    operation: str,
+    files: List[UploadFile],
+    sizes: Optional[List[Tuple[int, int]]] = None,
+    quality: Quality = JPEG_QUALITY,
+    preset: Optional[str] = None,
+) -> Pipeline:
+    """Собирает конвейер одной из пяти операций API по имени эндпоинта.
+
+    sizes и preset допустимы только для операций с изменением размера.
+    """
+    # Проверка имени операции и применимости sizes и preset
+    operation_args(operation, sizes, preset)
+    preset = preset or DEFAULT_PRESET
+    if operation == "convert-webp":
+        return await convert_webp(files, quality=quality)
+    if operation == "convert-zip":
+        return await convert_zip(_single_archive(files), quality=quality)
+    if operation == "convert-webp-resize":
+        return await convert_webp(files, sizes or [TARGET_SIZE], quality, preset)
+    if operation == "convert-zip-resize":
+        return await convert_zip(_single_archive(files), sizes or [TARGET_SIZE], quality, preset)
+    return await resize_jpeg(files, sizes, quality, preset)
+
+
+OPERATIONS = ("convert-webp", "convert-zip", "convert-webp-resize", "convert-zip-resize", "resize-jpeg")
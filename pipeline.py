@@ -0,0 +1,916 @@
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import Response, StreamingResponse
+from starlette.requests import ClientDisconnect
+from PIL.Image import DecompressionBombError
+from functools import partial
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+import asyncio
+import hashlib
+import io
+import tempfile
+import time
+
+import config
+import metrics
+import startup
+from progress import ProgressLog, current_progress_id, image_event, registry
+from budget import Budget, BudgetExceeded
+from cache import ResultCache, get_cache
+from imaging import DEFAULT_PRESET, JPEG_QUALITY, Quality, probe, process_image, process_image_timed, process_pyramid, process_pyramid_timed
+from ingest import ArchiveError, FormError, FormPart, TarReader, copy_member, open_archive, read_member
+from transport import Payload, Spool, Spooled, call_spooled
+from workers import imap, run_in_pool
+from zipstream import ZipStream
+
+
+def keep_upload(file: UploadFile) -> UploadFile:
+    """Забирает буфер загруженного файла у FastAPI.
+
+    FastAPI закрывает файлы формы сразу после возврата из обработчика, а тело
+    потокового ответа формируется позже. Возвращённый UploadFile закрывается
+    тем, кто его читает.
+    """
+    kept = UploadFile(file.file, size=file.size, filename=file.filename, headers=file.headers)
+    file.file = io.BytesIO()
+    return kept
+
+
+def result_keys(
+    digest: str, quality: Quality, transforms: list, sizes: Optional[List[Tuple[int, int]]] = None,
+    preset: str = DEFAULT_PRESET,
+) -> List[str]:
+    """Ключи результатов одного входа по его SHA-256 (hex): по одному на размер пирамиды.
+
+    Аргументы совпадают с параметрами конвейера (см. operations.resize_args).
+    Ключи используются и для кэша, и как сильные ETag результатов.
+    """
+    if sizes is None:
+        return [ResultCache.key_for_digest(process_image.__name__, digest, (transforms, quality))]
+    params = (transforms, tuple(sizes), quality, preset)
+    return [ResultCache.key_for_digest(process_pyramid.__name__, digest, params + (index,)) for index in range(len(sizes))]
+
+
+# Источники: отдают пары (имя, байты файла) по одному; вместо байтов может
+# прийти исключение, если файл не удалось прочитать, а для номеров из skip —
+# None без чтения. Если передан spool, большие файлы источник может сразу
+# скопировать в файл обмена (Spooled), не собирая их в памяти.
+# fingerprints() дешёвые ключи для поиска дубликатов (None — не сравнивать),
+# digest(index) — SHA-256 содержимого. Потоковые источники заранее ничего не
+# знают о своих файлах: их fingerprints() возвращает None (дубликаты ищутся по
+# SHA-256 по мере поступления), а len() растёт по мере чтения.
+
+_HASH_BLOCK = 1024 * 1024
+
+# (номер источника, номер файла в нём)
+Position = Tuple[int, int]
+
+
+def _sha256(fileobj) -> str:
+    digest = hashlib.sha256()
+    for block in iter(lambda: fileobj.read(_HASH_BLOCK), b""):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+def _digest(content: Payload) -> str:
+    if isinstance(content, Spooled):
+        return content.sha256()
+    return hashlib.sha256(content).hexdigest()
+
+class UploadSource:
+    """Файлы multipart-формы."""
+
+    stage = "read"
+
+    def __init__(self, files: List[UploadFile]):
+        self.files = [keep_upload(file) for file in files]
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    async def items(self, skip: Set[int] = frozenset(), spool: Optional[Spool] = None):
+        for index, file in enumerate(self.files):
+            if index in skip:
+                content = None
+            else:
+                content = None
+                if spool is not None and spool.wants(file.size):
+                    # Из буфера загрузки FastAPI (в памяти или на диске) блоками, без await file.read()
+                    content = await asyncio.to_thread(spool.put_file, file.file)
+                if content is None:
+                    await file.seek(0)
+                    content = await file.read()
+            await file.close()
+            yield file.filename, content
+
+    def fingerprints(self) -> list:
+        return [file.size for file in self.files]
+
+    def digest(self, index: int) -> str:
+        file = self.files[index].file
+        file.seek(0)
+        try:
+            return _sha256(file)
+        finally:
+            file.seek(0)
+
+    async def close(self) -> None:
+        for file in self.files:
+            await file.close()
+
+
+class BodySource:
+    """Одно изображение, пришедшее телом запроса; уже целиком в памяти."""
+
+    stage = "read"
+
+    def __init__(self, name: str, content: bytes):
+        self.name = name
+        self.content = content
+
+    def __len__(self) -> int:
+        return 1
+
+    async def items(self, skip: Set[int] = frozenset(), spool: Optional[Spool] = None):
+        content, self.content = self.content, b""
+        yield self.name, content
+
+    def fingerprints(self) -> list:
+        return [None]
+
+    async def close(self) -> None:
+        self.content = b""
+
+
+class ArchiveSource:
+    """Элементы загруженного ZIP-архива, отобранные по расширению без распаковки на диск."""
+
+    stage = "unzip"
+
+    def __init__(self, file: UploadFile, suffixes: Tuple[str, ...]):
+        self.upload = keep_upload(file)
+        try:
+            self.archive, self.members = open_archive(self.upload.file, suffixes)
+        except ArchiveError as e:
+            self.upload.file.close()
+            raise HTTPException(status_code=400, detail=str(e))
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    async def items(self, skip: Set[int] = frozenset(), spool: Optional[Spool] = None):
+        for index, info in enumerate(self.members):
+            if index in skip:
+                yield info.filename, None
+                continue
+            try:
+                content = None
+                if spool is not None and spool.wants(info.file_size):
+                    content = await asyncio.to_thread(spool.write, partial(copy_member, self.archive, info))
+                if content is None:
+                    content = await asyncio.to_thread(read_member, self.archive, info)
+            except Exception as e:
+                yield info.filename, e
+            else:
+                yield info.filename, content
+
+    def fingerprints(self) -> list:
+        # CRC32 и размер из центрального каталога: без распаковки
+        return [(info.CRC, info.file_size) for info in self.members]
+
+    def digest(self, index: int) -> str:
+        with self.archive.open(self.members[index]) as member:
+            return _sha256(member)
+
+    async def close(self) -> None:
+        self.archive.close()
+        await self.upload.close()
+
+
+async def upload_chunks(file: UploadFile) -> AsyncIterator[bytes]:
+    while True:
+        chunk = await file.read(_HASH_BLOCK)
+        if not chunk:
+            return
+        yield chunk
+
+
+class TarSource:
+    """Элементы tar или tar.gz по мере чтения потока: первые файлы обрабатываются до конца загрузки.
+
+    chunks — тело запроса (request.stream()) или загруженный файл (upload_chunks).
+    Если архив повреждён или превышает лимиты, уже прочитанные файлы остаются
+    в работе, а ошибка засчитывается как один неудачный файл с именем архива.
+    """
+
+    stage = "untar"
+
+    def __init__(self, name: str, chunks: AsyncIterator[bytes], suffixes: Tuple[str, ...], upload: Optional[UploadFile] = None):
+        self.name = name
+        self.reader = TarReader(chunks, suffixes)
+        self.upload = upload
+        self.errors = 0
+
+    def __len__(self) -> int:
+        return self.reader.count + self.errors
+
+    async def items(self, skip: Set[int] = frozenset(), spool: Optional[Spool] = None):
+        try:
+            async for name, content in self.reader.members():
+                yield name, content
+        except ArchiveError as e:
+            self.errors += 1
+            yield self.name, e
+
+    def fingerprints(self) -> None:
+        return None
+
+    async def close(self) -> None:
+        await self.reader.close()
+        if self.upload is not None:
+            await self.upload.close()
+
+
+class FormSource:
+    """Файлы поля field формы по мере приёма тела запроса: каждый уходит на конвертацию, как только получен целиком.
+
+    parts — MultipartReader.parts(), first — уже полученная первая часть с
+    файлом (до неё читаются параметры операции). Текстовые поля после файлов
+    не учитываются и засчитываются ошибкой; части других полей пропускаются.
+    """
+
+    stage = "receive"
+
+    def __init__(self, parts: AsyncIterator[FormPart], first: FormPart, field: str, suffixes: Tuple[str, ...]):
+        self.parts = parts
+        self.first: Optional[FormPart] = first
+        self.field = field
+        self.suffixes = suffixes
+        self.count = 1
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _item(self, part: FormPart):
+        if part.error is not None:
+            # Единственная ошибка части — превышение размера файла: пропуск, как по бюджету
+            return part.filename, BudgetExceeded(str(part.error))
+        if not part.filename.lower().endswith(self.suffixes):
+            return part.filename, FormError(f"Файл {part.filename} пропущен: ожидается {', '.join(self.suffixes)}")
+        return part.filename, bytes(part.data)
+
+    async def items(self, skip: Set[int] = frozenset(), spool: Optional[Spool] = None):
+        first, self.first = self.first, None
+        yield self._item(first)
+        try:
+            async for part in self.parts:
+                if part.filename is None:
+                    self.count += 1
+                    yield part.name, FormError(f"Поле {part.name} пришло после файлов и не учтено: передавайте параметры до файлов")
+                elif part.name == self.field:
+                    self.count += 1
+                    yield self._item(part)
+        except FormError as e:
+            self.count += 1
+            yield "form", e
+
+    def fingerprints(self) -> None:
+        return None
+
+    async def close(self) -> None:
+        self.first = None
+        await self.parts.aclose()
+
+
+async def close_sources(sources: list) -> None:
+    for source in sources:
+        await source.close()
+
+
+# Сколько байт JPEG потоковых оригиналов держится для их будущих дубликатов;
+# после этого новые входы уже не запоминаются и повторы конвертируются заново
+_STREAM_DEDUP_MEMORY = 64 * 1024 * 1024
+
+
+class Pipeline:
+    """Конвейер: источники -> стадии преобразования -> JPEG -> приёмник.
+
+    Каждое изображение проходит все стадии за один проход в рабочем процессе
+    (imaging.process_image), без промежуточных файлов. entries отдаёт пары
+    (имя в архиве, JPEG) по мере готовности; total, processed и failed
+    позволяют следить за прогрессом.
+
+    Если задано несколько размеров sizes, из одного декодирования получается
+    по JPEG на каждый размер (imaging.process_pyramid); варианты кладутся в
+    архив в подпапки "ШИРИНАxВЫСОТА/".
+
+    progress получает событие на каждое изображение (статус, байты, время
+    стадий) и итоговое событие. Журнал создаётся, только если он кому-то
+    нужен: запрос попросил его заголовком X-Progress (журнал регистрируется
+    под выданным сервером id, когда конвейер начинает работу) или конвейер
+    запущен фоновой задачей (track_progress()); иначе progress — None.
+
+    До начала обработки одинаковые по содержимому входы находятся по дешёвым
+    ключам источников и SHA-256 кандидатов; каждый уникальный вход
+    обрабатывается один раз, а дубликаты получают копию его JPEG без чтения
+    и перекодирования. Их число известно заранее (deduplicated). У потоковых
+    источников дубликаты находятся по SHA-256 по мере поступления, и
+    deduplicated растёт вместе с ними.
+
+    Большие входы и JPEG передаются воркерам и обратно через файлы обмена
+    (transport.Spool): по каналу пула идут только пути. Каталог обмена
+    конвейера удаляется при его завершении, в том числе при отмене запроса.
+    """
+
+    def __init__(
+        self,
+        operation: str,
+        sources: list,
+        transforms: list,
+        name: Callable[[str], str],
+        filename: str,
+        empty_detail: str,
+        error_prefix: str = "Ошибка конвертации",
+        quality: Quality = JPEG_QUALITY,
+        sizes: Optional[List[Tuple[int, int]]] = None,
+        preset: str = DEFAULT_PRESET,
+    ):
+        self.operation = operation
+        self.sources = sources
+        self.transforms = transforms
+        self.name = name
+        self.filename = filename
+        self.empty_detail = empty_detail
+        self.error_prefix = error_prefix
+        self.quality = quality
+        self.sizes = list(sizes) if sizes and len(sizes) > 1 else None
+        self.preset = preset
+        self.processed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.deduplicated = 0
+        self.input_error: Optional[str] = None
+        self.input_bytes = 0
+        self.output_bytes = 0
+        self.budget = Budget()
+        self.spool = Spool()
+        self.progress: Optional[ProgressLog] = None
+        self._progress_id = current_progress_id.get()
+        self.started_at = time.perf_counter()
+        # Позиция входа -> позиция его первого вхождения; общие результаты оригиналов
+        self.duplicates: Dict[Position, Position] = {}
+        self._shared: Dict[Position, asyncio.Future] = {}
+        self._shared_left: Dict[Position, int] = {}
+        self._skip_items: Dict[int, Set[int]] = {}
+        # Потоковые оригиналы: SHA-256 -> позиция; их результаты держатся для будущих дубликатов
+        self._streamed: Dict[str, Position] = {}
+        self._streamed_originals: Set[Position] = set()
+        self._retained = 0
+        # SHA-256 входов и найденные в кэше результаты, пока входы ждут обработки
+        self._digests: Dict[Position, str] = {}
+        self._found: Dict[Position, List[bytes]] = {}
+        self.entries: AsyncIterator[Tuple[str, bytes]] = self._run()
+
+    @property
+    def total(self) -> int:
+        # У потоковых источников растёт по мере чтения
+        return sum(len(source) for source in self.sources)
+
+    @property
+    def streaming(self) -> bool:
+        """Есть ли источники, файлы которых заранее неизвестны: их дубликаты находятся по ходу обработки."""
+        return any(source.fingerprints() is None for source in self.sources)
+
+    def track_progress(self, path: Optional[Path] = None) -> ProgressLog:
+        """Журнал прогресса конвейера; создаётся при первом вызове, до начала обработки.
+
+        path — файл, в который журнал дублирует события (см. ProgressLog).
+        """
+        if self.progress is None:
+            self.progress = ProgressLog(path=path)
+        return self.progress
+
+    def _emit(self, name: str, status: str, **fields) -> None:
+        if self.progress is not None:
+            self.progress.emit(image_event(name, status, (self.processed, self.total), **fields))
+
+    def _fail(self, name: str, error: Exception) -> None:
+        self.processed += 1
+        self.failed += 1
+        if isinstance(error, (ArchiveError, FormError)):
+            self.input_error = str(error)
+        metrics.IMAGES.inc(endpoint=self.operation, status="error")
+        print(f"{self.error_prefix} {name}: {str(error)}")
+        self._emit(name, "error", error=str(error))
+
+    def _skip(self, name: str, reason: Exception) -> None:
+        self.processed += 1
+        self.skipped += 1
+        metrics.IMAGES.inc(endpoint=self.operation, status="skipped")
+        print(f"Пропущен {name}: {str(reason)}")
+        self._emit(name, "skipped", error=str(reason))
+
+    async def _preflight(self, name: str, content: Payload) -> Optional[Exception]:
+        """Проверяет заголовок изображения по бюджету до отправки на декодирование.
+
+        Заголовок читается в потоке, чтобы не занимать цикл событий. Возвращает
+        причину отказа (BudgetExceeded — пропуск) или None.
+        """
+        try:
+            with metrics.stage_timer(self.operation, "preflight"):
+                width, height, _ = await asyncio.to_thread(probe, content.path if isinstance(content, Spooled) else content)
+            self.budget.check(len(content), width, height)
+        except BudgetExceeded as e:
+            self._skip(name, e)
+            return e
+        except DecompressionBombError:
+            # Pillow отказывается открывать изображения больше 2x лимита
+            error = BudgetExceeded(f"больше лимита {self.budget.max_image_pixels} пикселей на изображение")
+            self._skip(name, error)
+            return error
+        except Exception as e:
+            self._fail(name, e)
+            return e
+        return None
+
+    async def _find_duplicates(self) -> None:
+        """Находит дубликаты до обработки: SHA-256 считается только для входов с совпавшим дешёвым ключом."""
+        groups: Dict[object, List[Position]] = {}
+        for index, source in enumerate(self.sources):
+            for local, key in enumerate(source.fingerprints() or []):
+                if key is not None:
+                    groups.setdefault(key, []).append((index, local))
+        for candidates in groups.values():
+            if len(candidates) < 2:
+                continue
+            originals: Dict[str, Position] = {}
+            for index, local in candidates:
+                try:
+                    digest = await asyncio.to_thread(self.sources[index].digest, local)
+                except Exception:
+                    # Ошибку чтения покажет обычная обработка
+                    continue
+                if digest in originals:
+                    self.duplicates[index, local] = originals[digest]
+                    self._skip_items.setdefault(index, set()).add(local)
+                else:
+                    originals[digest] = (index, local)
+        loop = asyncio.get_running_loop()
+        for original in self.duplicates.values():
+            if original not in self._shared:
+                self._shared[original] = loop.create_future()
+            self._shared_left[original] = self._shared_left.get(original, 0) + 1
+        self.deduplicated = len(self.duplicates)
+
+    def _share(self, position: Position, result=None, error: Optional[Exception] = None) -> None:
+        """Передаёт результат (или ошибку) оригинала его дубликатам."""
+        future = self._shared.get(position)
+        if future is None or future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+            if position in self._streamed_originals:
+                # Потоковому оригиналу дубликаты могут так и не прийти: ошибка не считается потерянной
+                future.exception()
+        else:
+            future.set_result(result)
+            if position in self._streamed_originals:
+                self._retained += sum(len(data) for data in result[0])
+
+    async def _copy(self, original: Position) -> Tuple[List[bytes], dict]:
+        """Результат дубликата: JPEG оригинала без повторной обработки."""
+        try:
+            outputs, info = await asyncio.shield(self._shared[original])
+        finally:
+            # Результаты потоковых оригиналов держатся до конца: дубликаты могут прийти позже
+            if original in self._shared_left:
+                self._shared_left[original] -= 1
+                if not self._shared_left[original]:
+                    del self._shared[original], self._shared_left[original]
+        metrics.IMAGES.inc(endpoint=self.operation, status="duplicate")
+        return outputs, {"status": "duplicate", "input_bytes": info["input_bytes"], "etags": info["etags"], "timings": {}}
+
+    async def _items(self):
+        for index, source in enumerate(self.sources):
+            streaming = source.fingerprints() is None
+            items = source.items(self._skip_items.get(index, frozenset()), self.spool).__aiter__()
+            local = -1
+            while True:
+                with metrics.stage_timer(self.operation, source.stage):
+                    try:
+                        name, content = await items.__anext__()
+                    except StopAsyncIteration:
+                        break
+                local += 1
+                position = (index, local)
+                if position in self.duplicates:
+                    yield name, (None, position)
+                    continue
+                if isinstance(content, BudgetExceeded):
+                    self._skip(name, content)
+                    self._share(position, error=content)
+                    continue
+                if isinstance(content, Exception):
+                    self._fail(name, content)
+                    self._share(position, error=content)
+                    continue
+                digest = await asyncio.to_thread(_digest, content)
+                if streaming:
+                    original = self._streamed.get(digest)
+                    if original is not None:
+                        if isinstance(content, Spooled):
+                            content.remove()
+                        self.duplicates[position] = original
+                        self.deduplicated += 1
+                        yield name, (None, position)
+                        continue
+                metrics.INPUT_BYTES.inc(len(content), endpoint=self.operation)
+                self.input_bytes += len(content)
+                # Сначала кэш: готовый результат не требует ни заголовка, ни бюджета на декодирование
+                found = await self._lookup(digest)
+                if found is None:
+                    error = await self._preflight(name, content)
+                    if error is not None:
+                        if isinstance(content, Spooled):
+                            content.remove()
+                        self._share(position, error=error)
+                        continue
+                    if isinstance(content, bytes) and self.spool.wants(len(content)):
+                        content = await asyncio.to_thread(self.spool.put, content) or content
+                else:
+                    self._found[position] = found
+                if streaming and self._retained < _STREAM_DEDUP_MEMORY:
+                    self._streamed[digest] = position
+                    self._streamed_originals.add(position)
+                    self._shared[position] = asyncio.get_running_loop().create_future()
+                self._digests[position] = digest
+                yield name, (content, position)
+
+    async def _process(self, content: Optional[Payload], position: Position) -> Tuple[List[bytes], dict]:
+        """Одно изображение; дубликат ждёт результат своего оригинала."""
+        if content is None:
+            return await self._copy(self.duplicates[position])
+        try:
+            result = await self._convert(content, self._digests.pop(position), self._found.pop(position, None))
+        except Exception as e:
+            self._share(position, error=e)
+            raise
+        finally:
+            # И при отмене: воркер, если ещё читает файл, дочитает его и после удаления
+            if isinstance(content, Spooled):
+                content.remove()
+        self._share(position, result)
+        return result
+
+    async def _lookup(self, digest: str) -> Optional[List[bytes]]:
+        """Готовые результаты входа из кэша или None."""
+        cache = get_cache()
+        if not cache.enabled:
+            return None
+        return await asyncio.to_thread(cache.lookup, result_keys(digest, self.quality, self.transforms, self.sizes, self.preset))
+
+    async def _convert(
+        self, content: Payload, digest: str, found: Optional[List[bytes]] = None
+    ) -> Tuple[List[bytes], dict]:
+        """Одно изображение: результат из кэша (found, найден в _items), иначе пул процессов.
+
+        Время стадий уходит в метрики. Возвращает список JPEG (один или по
+        одному на каждый размер пирамиды) и сведения для события прогресса.
+        """
+        cache = get_cache()
+        if self.sizes is None:
+            func, params = process_image_timed, (self.transforms, self.quality)
+        else:
+            func, params = process_pyramid_timed, (self.transforms, self.sizes, self.quality, self.preset)
+        keys = result_keys(digest, self.quality, self.transforms, self.sizes, self.preset)
+        if found is not None:
+            metrics.IMAGES.inc(endpoint=self.operation, status="cached")
+            return found, {"status": "cached", "input_bytes": len(content), "etags": keys, "timings": {}}
+
+        start = time.perf_counter()
+        if isinstance(content, Spooled):
+            # Большие JPEG воркер тоже вернёт файлами обмена; каталог уже создан для входа
+            result, timings = await run_in_pool(call_spooled, func, self.spool.directory, self.spool.min_bytes, content, *params)
+        else:
+            result, timings = await run_in_pool(func, content, *params)
+        outputs = [result] if self.sizes is None else result
+        for index, data in enumerate(outputs):
+            if isinstance(data, Spooled):
+                outputs[index] = await asyncio.to_thread(data.take)
+        timings["queue"] = max(0.0, time.perf_counter() - start - sum(timings.values()))
+        for stage, seconds in timings.items():
+            metrics.STAGE_SECONDS.observe(seconds, endpoint=self.operation, stage=stage)
+        metrics.IMAGES.inc(endpoint=self.operation, status="ok")
+        startup.state.converted()
+        if cache.enabled:
+            for key, data in zip(keys, outputs):
+                await asyncio.to_thread(cache.put, key, data)
+        return outputs, {"status": "ok", "input_bytes": len(content), "etags": keys, "timings": timings}
+
+    def _names(self, name: str) -> List[str]:
+        if self.sizes is None:
+            return [self.name(name)]
+        return [f"{width}x{height}/{self.name(name)}" for width, height in self.sizes]
+
+    async def _run(self):
+        try:
+            # Только теперь: конвейер, который так и не запустился (429, ошибка
+            # параметров), не оставляет в реестре журнал, который никогда не завершится
+            if self._progress_id is not None:
+                registry.register(self._progress_id, self.track_progress())
+            await self._find_duplicates()
+            async for name, result in imap(self._process, self._items()):
+                if isinstance(result, BudgetExceeded):
+                    # Дубликат пропущенного по бюджету оригинала
+                    self._skip(name, result)
+                    continue
+                if isinstance(result, Exception):
+                    self._fail(name, result)
+                    continue
+                outputs, info = result
+                self.processed += 1
+                names = self._names(name)
+                output_bytes = sum(len(data) for data in outputs)
+                self.output_bytes += output_bytes
+                if self.progress is not None:
+                    self._emit(
+                        name, info["status"],
+                        outputs=names, etags=info["etags"], input_bytes=info["input_bytes"], output_bytes=output_bytes,
+                        timings={stage: round(seconds, 4) for stage, seconds in info["timings"].items()},
+                    )
+                for entry, data in zip(names, outputs):
+                    metrics.OUTPUT_BYTES.inc(len(data), endpoint=self.operation)
+                    yield entry, data
+        finally:
+            await close_sources(self.sources)
+            await asyncio.to_thread(self.spool.close)
+            if self.progress is not None:
+                self.progress.finish(self.summary())
+
+    def summary(self) -> dict:
+        """Итог обработки для потока прогресса."""
+        seconds = time.perf_counter() - self.started_at
+        done = self.processed - self.failed - self.skipped
+        return {
+            "event": "summary",
+            "operation": self.operation,
+            "total": self.total,
+            "processed": self.processed,
+            "converted": done,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "deduplicated": self.deduplicated,
+            "complete": self.processed == self.total,
+            "input_bytes": self.input_bytes,
+            "output_bytes": self.output_bytes,
+            "seconds": round(seconds, 3),
+            "images_per_sec": round(done / seconds, 2) if seconds > 0 else 0.0,
+        }
+
+    async def first(self) -> Tuple[str, bytes]:
+        """Возвращает первый готовый JPEG; 400, если валидных файлов нет."""
+        try:
+            return await self.entries.__anext__()
+        except StopAsyncIteration:
+            raise HTTPException(status_code=400, detail=self.result_detail())
+
+    def result_detail(self) -> str:
+        """Причина пустого результата; упоминает пропущенные по бюджету файлы."""
+        if self.skipped:
+            return f"{self.empty_detail}: {self.skipped} пропущено из-за лимитов ({self.budget.describe()})"
+        if self.input_error:
+            return f"{self.empty_detail}: {self.input_error}"
+        return self.empty_detail
+
+
+# Приёмники
+
+# Формат архива с результатами -> (тип содержимого, расширение)
+ARCHIVE_FORMATS = {
+    "zip": ("application/zip", ".zip"),
+    "tar": ("application/x-tar", ".tar"),
+    "tar.gz": ("application/gzip", ".tar.gz"),
+}
+
+
+def archive_writer(format: str):
+    """ZipStream или TarStream: add(имя, данные) и close() возвращают готовые фрагменты архива."""
+    if format == "zip":
+        return ZipStream()
+    from tarstream import TarStream  # импорт tarfile только для запросов tar
+    return TarStream(compress=format == "tar.gz")
+
+
+def archive_filename(filename: str, format: str) -> str:
+    stem = filename[:-len(".zip")] if filename.endswith(".zip") else filename
+    return stem + ARCHIVE_FORMATS[format][1]
+
+
+# Сколько байт ответа, ещё не забранных клиентом, держится в памяти; остальное — во временном файле
+_BACKLOG_MEMORY = 8 * 1024 * 1024
+# Сколько байт отдаётся клиенту за одно сообщение
+_BACKLOG_BLOCK = 1024 * 1024
+
+
+class _Backlog:
+    """Очередь байтов ответа между формированием архива и отправкой клиенту.
+
+    Запись не ждёт клиента, пока записанное не достигло max_bytes: в памяти до
+    _BACKLOG_MEMORY байт, дальше во временном файле. Когда клиент забрал всё
+    записанное, файл очищается; если клиент стоит, запись ждёт этого, и
+    временный файл не растёт больше max_bytes. Клиенту данные отдаются
+    блоками не больше _BACKLOG_BLOCK байт.
+    """
+
+    def __init__(self, max_bytes: int = config.DUPLEX_BACKLOG_BYTES):
+        self.max_bytes = max_bytes
+        self._file = tempfile.SpooledTemporaryFile(max_size=_BACKLOG_MEMORY)
+        self._lock = asyncio.Lock()
+        self._changed = asyncio.Event()
+        self._drained = asyncio.Event()
+        self._written = 0
+        self._sent = 0
+        self.closed = False
+
+    async def put(self, chunk: bytes) -> None:
+        while self._written >= self.max_bytes:
+            self._drained.clear()
+            await self._drained.wait()
+
+        def write() -> None:
+            self._file.seek(self._written)
+            self._file.write(chunk)
+
+        async with self._lock:
+            await asyncio.to_thread(write)
+            self._written += len(chunk)
+        self._changed.set()
+
+    def close(self) -> None:
+        self.closed = True
+        self._changed.set()
+
+    async def get(self) -> Optional[bytes]:
+        """Следующие неотправленные байты; None, если ответ закончился."""
+        while self._sent == self._written:
+            if self.closed:
+                return None
+            self._changed.clear()
+            await self._changed.wait()
+
+        def read() -> bytes:
+            self._file.seek(self._sent)
+            data = self._file.read(min(self._written - self._sent, _BACKLOG_BLOCK))
+            if self._sent + len(data) == self._written:
+                self._file.seek(0)
+                self._file.truncate()
+            return data
+
+        async with self._lock:
+            data = await asyncio.to_thread(read)
+            self._sent += len(data)
+            if self._sent == self._written:
+                self._sent = self._written = 0
+                self._drained.set()
+        return data
+
+    def discard(self) -> None:
+        self._file.close()
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """Потоковый ответ на запрос, тело которого ещё читается, пока ответ отдаётся.
+
+    Обычный StreamingResponse параллельно ждёт сообщения об отключении клиента
+    и забирает при этом части тела запроса; здесь отключение замечает сам
+    читатель тела (ClientDisconnect из request.stream()).
+
+    Многие клиенты (requests, httpx, большинство HTTP-библиотек) не читают
+    ответ, пока не отправят тело целиком. Если бы архив писался прямо в
+    сокет, такой клиент и сервер ждали бы друг друга, как только ответ
+    переполнит буферы сокета. Поэтому архив формируется отдельной задачей
+    в _Backlog, а клиенту отдаётся из него по мере чтения.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+        if self.background is not None:
+            await self.background()
+
+    async def stream_response(self, send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        backlog = _Backlog()
+
+        async def produce() -> None:
+            try:
+                async for chunk in self.body_iterator:
+                    await backlog.put(chunk)
+            finally:
+                backlog.close()
+
+        producer = asyncio.ensure_future(produce())
+        try:
+            while True:
+                chunk = await backlog.get()
+                if chunk is None:
+                    break
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            # Ошибку формирования архива показывает так же, как обычный StreamingResponse
+            await producer
+        finally:
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+            backlog.discard()
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+async def archive_response(pipeline: Pipeline, format: str = "zip", duplex: bool = False) -> StreamingResponse:
+    """Отдаёт результаты потоковым архивом (ZIP, tar или tar.gz) по мере их готовности.
+
+    Первый элемент получается до отправки заголовков, чтобы при отсутствии
+    валидных файлов вернуть 400. duplex — источник читает тело запроса во
+    время отдачи ответа (см. DuplexStreamingResponse).
+
+    X-Deduplicated отправляется, только если дубликаты найдены заранее: у
+    потоковых источников к отправке заголовков они ещё не известны, и их
+    число есть только в итоговом событии прогресса.
+    """
+    first = await pipeline.first()
+    headers = {"Content-Disposition": f"attachment; filename={archive_filename(pipeline.filename, format)}"}
+    if not pipeline.streaming:
+        headers["X-Deduplicated"] = str(pipeline.deduplicated)
+
+    async def body():
+        archive = archive_writer(format)
+        try:
+            with metrics.stage_timer(pipeline.operation, "archive"):
+                chunk = archive.add(*first)
+            yield chunk
+            async for name, data in pipeline.entries:
+                with metrics.stage_timer(pipeline.operation, "archive"):
+                    chunk = archive.add(name, data)
+                yield chunk
+            yield archive.close()
+        finally:
+            await pipeline.entries.aclose()
+
+    response_class = DuplexStreamingResponse if duplex else StreamingResponse
+    return response_class(
+        body(),
+        media_type=ARCHIVE_FORMATS[format][0],
+        headers={**headers, **pipeline.budget.headers()},
+    )
+
+
+def quote_etag(key: str) -> str:
+    return f'"{key}"'
+
+
+def etag_matches(if_none_match: Optional[str], key: str) -> bool:
+    """Совпадает ли заголовок If-None-Match с ETag результата (слабое сравнение, как в RFC 9110)."""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == "*" or tag == quote_etag(key):
+            return True
+    return False
+
+
+def not_modified(key: str) -> Response:
+    return Response(status_code=304, headers={"ETag": quote_etag(key)})
+
+
+async def image_response(pipeline: Pipeline, etag: Optional[str] = None) -> Response:
+    """Отдаёт первый (единственный) результат как JPEG без архива; etag — ключ результата."""
+    try:
+        name, data = await pipeline.first()
+    finally:
+        await pipeline.entries.aclose()
+    headers = {"Content-Disposition": f"attachment; filename={name}", **pipeline.budget.headers()}
+    if etag is not None:
+        headers["ETag"] = quote_etag(etag)
+    return Response(data, media_type="image/jpeg", headers=headers)
+
+
+async def write_archive(pipeline: Pipeline, path: Path, format: str = "zip") -> int:
+    """Записывает результаты архивом в файл; возвращает число записанных JPEG."""
+    archive = archive_writer(format)
+    written = 0
+    with open(path, "wb") as output:
+        try:
+            async for name, data in pipeline.entries:
+                with metrics.stage_timer(pipeline.operation, "archive"):
+                    chunk = archive.add(name, data)
+                await asyncio.to_thread(output.write, chunk)
+                written += 1
+        finally:
+            await pipeline.entries.aclose()
+        output.write(archive.close())
+    return written
@@ -0,0 +1,196 @@
+from collections import deque
+from contextvars import ContextVar
+from pathlib import Path
+from typing import AsyncIterator, Callable, Deque, Dict, Optional, Tuple
+import asyncio
+import json
+import time
+import uuid
+
+import config
+
+# id прогресса текущего запроса, выданный ProgressMiddleware
+current_progress_id: ContextVar[Optional[str]] = ContextVar("current_progress_id", default=None)
+
+
+class ProgressLog:
+    """События обработки одного конвейера: по одному на изображение и итоговое.
+
+    Хранятся последние max_events событий (0 — все), поэтому подписчик,
+    подключившийся позже, сначала получает уже случившееся, а затем новые
+    события по мере появления. Если подписчик отстал больше чем на
+    max_events, более старые события он пропускает; итоговое событие
+    последнее и не теряется.
+
+    Если задан path, каждое событие дописывается туда строкой NDJSON целиком,
+    без ограничения max_events: так события видны другим процессам
+    (см. follow_file).
+    """
+
+    def __init__(self, max_events: int = config.PROGRESS_MAX_EVENTS, path: Optional[Path] = None):
+        self.path = path
+        self.events: Deque[dict] = deque(maxlen=max_events or None)
+        # Сколько событий вытеснено из начала журнала
+        self.dropped = 0
+        self.finished_at: Optional[float] = None
+        self._waiter: Optional[asyncio.Future] = None
+
+    def emit(self, event: dict) -> None:
+        if len(self.events) == self.events.maxlen:
+            self.dropped += 1
+        self.events.append(event)
+        if self.path is not None:
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(event, ensure_ascii=False) + "\n")
+            except OSError as e:
+                print(f"Не удалось записать событие прогресса в {self.path}: {e}")
+        self._wake()
+
+    def finish(self, summary: dict) -> None:
+        if self.finished_at is None:
+            self.finished_at = time.time()
+            self.emit(summary)
+
+    def _wake(self) -> None:
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+        self._waiter = None
+
+    async def follow(self) -> AsyncIterator[dict]:
+        """Отдаёт все хранящиеся события с начала и ждёт новые, пока не придёт итоговое."""
+        # Номер следующего события от начала журнала, включая вытесненные
+        index = 0
+        while True:
+            while True:
+                index = max(index, self.dropped)
+                if index >= self.dropped + len(self.events):
+                    break
+                yield self.events[index - self.dropped]
+                index += 1
+            if self.finished_at is not None:
+                return
+            if self._waiter is None:
+                self._waiter = asyncio.get_running_loop().create_future()
+            # shield: отключение одного подписчика не должно будить остальных ошибкой
+            await asyncio.shield(self._waiter)
+
+
+async def follow_file(path: Path, finished: Callable[[], bool], interval: float = 0.5) -> AsyncIterator[dict]:
+    """События из файла журнала (ProgressLog с path), который пишет другой процесс.
+
+    Файл перечитывается раз в interval секунд с места, где остановилось
+    чтение, до итогового события. Если его нет, а finished() сообщает, что
+    писать больше некому (процесс завершился) или файл удалён, поток заканчивается.
+    """
+    offset = 0
+    pending = b""
+    while True:
+        try:
+            with open(path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            data = None
+        if data:
+            offset += len(data)
+            *lines, pending = (pending + data).split(b"\n")
+            for line in lines:
+                event = json.loads(line)
+                yield event
+                if event["event"] == "summary":
+                    return
+        elif finished():
+            return
+        await asyncio.sleep(interval)
+
+
+class ProgressRegistry:
+    """Журналы прогресса синхронных запросов по id, который выдал сервер (см. ProgressMiddleware).
+
+    Завершённые журналы хранятся PROGRESS_TTL секунд, чтобы опоздавший
+    подписчик получил итог.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._logs: Dict[str, ProgressLog] = {}
+
+    def register(self, progress_id: str, log: ProgressLog) -> None:
+        self.purge_expired()
+        self._logs[progress_id] = log
+
+    def get(self, progress_id: str) -> Optional[ProgressLog]:
+        self.purge_expired()
+        return self._logs.get(progress_id)
+
+    def purge_expired(self) -> None:
+        now = time.time()
+        for progress_id, log in list(self._logs.items()):
+            if log.finished_at is not None and now - log.finished_at > self.ttl:
+                del self._logs[progress_id]
+
+
+registry = ProgressRegistry(config.PROGRESS_TTL)
+
+
+class ProgressMiddleware:
+    """ASGI-middleware: выдаёт id журнала прогресса запросу с заголовком X-Progress.
+
+    id генерирует сервер, поэтому клиенты не могут ни совпасть, ни угадать
+    чужой id. Он доступен конвейеру запроса через current_progress_id и
+    возвращается клиенту в заголовке ответа X-Progress-Id.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not dict(scope["headers"]).get(b"x-progress", b"").strip():
+            await self.app(scope, receive, send)
+            return
+        progress_id = uuid.uuid4().hex
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                headers = [*message.get("headers", []), (b"x-progress-id", progress_id.encode())]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        token = current_progress_id.set(progress_id)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            current_progress_id.reset(token)
+
+
+FORMATS = {"sse": "text/event-stream", "ndjson": "application/x-ndjson"}
+
+
+def negotiate(format: Optional[str], accept: Optional[str]) -> str:
+    """Формат потока событий: явный параметр format, иначе по заголовку Accept; по умолчанию SSE."""
+    if format in FORMATS:
+        return format
+    if accept and FORMATS["ndjson"] in accept:
+        return "ndjson"
+    return "sse"
+
+
+async def render(events: AsyncIterator[dict], format: str) -> AsyncIterator[bytes]:
+    """События журнала (ProgressLog.follow() или follow_file()) в виде Server-Sent Events или NDJSON (одна JSON-строка на событие)."""
+    async for event in events:
+        data = json.dumps(event, ensure_ascii=False)
+        if format == "ndjson":
+            yield (data + "\n").encode()
+        else:
+            yield f"event: {event['event']}\ndata: {data}\n\n".encode()
+
+
+def stream_headers() -> Dict[str, str]:
+    # Прокси не должны буферизовать поток событий
+    return {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def image_event(name: str, status: str, progress: Tuple[int, int], **fields) -> dict:
+    processed, total = progress
+    return {"event": "image", "name": name, "status": status, "processed": processed, "total": total, **fields}
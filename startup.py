@@ -0,0 +1,72 @@
+import time
+
+# Начало отсчёта холодного старта. main4 импортирует этот модуль первым,
+# а отсчёт стоит до остальных импортов, чтобы учесть и их
+STARTED = time.perf_counter()
+
+from typing import Dict, Optional  # noqa: E402
+
+import config  # noqa: E402
+from workers import warm_up_pool  # noqa: E402
+
+
+def _elapsed() -> float:
+    return time.perf_counter() - STARTED
+
+
+class Startup:
+    """Замеры холодного старта процесса и его готовность к запросам.
+
+    Все времена отсчитываются от начала импорта приложения: import — до
+    конца импорта main4, ready — до завершения прогрева, first_conversion —
+    до первой успешной конвертации (прогревочной, а если прогрев отключён —
+    из первого запроса). warmup — длительность самого прогрева.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.error: Optional[str] = None
+        self.warm_workers = 0
+        self.seconds: Dict[str, float] = {}
+
+    def imported(self) -> None:
+        self.seconds["import"] = _elapsed()
+
+    def converted(self) -> None:
+        self.seconds.setdefault("first_conversion", _elapsed())
+
+    async def warm_up(self) -> None:
+        """Прогревает пул процессов (если не отключено CONVERT_WARMUP) и отмечает процесс готовым.
+
+        Если прогревочная конвертация не удалась, процесс остаётся неготовым,
+        а ошибка видна в GET /ready.
+        """
+        start = time.perf_counter()
+        if config.WARMUP:
+            try:
+                self.warm_workers = await warm_up_pool()
+            except Exception as e:
+                self.error = str(e) or type(e).__name__
+                print(f"Ошибка прогрева: {self.error}")
+                return
+            self.converted()
+        self.seconds["warmup"] = time.perf_counter() - start
+        self.seconds["ready"] = _elapsed()
+        self.ready = True
+
+    def stopping(self) -> None:
+        """Снимает готовность на время остановки, чтобы балансировщик перестал слать запросы."""
+        self.ready = False
+
+    def to_dict(self) -> dict:
+        return {
+            "ready": self.ready,
+            "error": self.error,
+            "workers": config.WORKERS,
+            "warm_workers": self.warm_workers,
+            "codecs": config.CODECS,
+            "seconds": self.seconds,
+        }
+
+
+state = Startup()
@@ -0,0 +1,41 @@
+from typing import Set
+import tarfile
+import time
+import zlib
+
+from zipstream import unique_name
+
+
+class TarStream:
+    """Потоково формирует tar (или tar.gz): каждый add() возвращает готовый фрагмент архива.
+
+    В отличие от ZIP, размер элемента пишется в его заголовок до данных, а
+    каталога в конце нет, поэтому фрагменты не нужно дописывать задним числом.
+    JPEG уже сжат, так что gzip почти не уменьшает архив и нужен только
+    клиентам, которые ждут tar.gz.
+    """
+
+    def __init__(self, compress: bool = False):
+        self._deflate = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+        self._names: Set[str] = set()
+
+    def _output(self, data: bytes) -> bytes:
+        if self._deflate is None:
+            return data
+        # Z_SYNC_FLUSH: клиент получает элемент сразу, а не когда наберётся блок сжатия
+        return self._deflate.compress(data) + self._deflate.flush(zlib.Z_SYNC_FLUSH)
+
+    def add(self, name: str, data: bytes) -> bytes:
+        info = tarfile.TarInfo(unique_name(self._names, name))
+        info.size = len(data)
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        padding = -len(data) % tarfile.BLOCKSIZE
+        return self._output(info.tobuf(tarfile.PAX_FORMAT) + data + b"\0" * padding)
+
+    def close(self) -> bytes:
+        # Конец архива: два нулевых блока
+        end = b"\0" * (2 * tarfile.BLOCKSIZE)
+        if self._deflate is None:
+            return end
+        return self._deflate.compress(end) + self._deflate.flush()
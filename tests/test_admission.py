@@ -0,0 +1,137 @@
+"""Допуск запросов: очередь, 429 с Retry-After, 413 и учёт объёма загрузок."""
+from pathlib import Path
+import asyncio
+import json
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from admission import AdmissionController, AdmissionMiddleware  # noqa: E402
+
+PATHS = {"/convert-webp/": "convert-webp"}
+
+
+class GatedApp:
+    """Приложение, которое отвечает только после open(); считает принятые байты тела."""
+
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.received = 0
+
+    async def __call__(self, scope, receive, send):
+        while True:
+            message = await receive()
+            self.received += len(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        await self.gate.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+
+async def _request(app, method="POST", path="/convert-webp/", body=b"", content_length=None, chunks=None):
+    headers = []
+    if content_length is not None:
+        headers.append((b"content-length", content_length))
+    elif chunks is None:
+        headers.append((b"content-length", str(len(body)).encode()))
+    messages = [{"type": "http.request", "body": chunk, "more_body": True} for chunk in chunks or []]
+    messages.append({"type": "http.request", "body": body, "more_body": False})
+    response = {}
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = dict(message["headers"])
+        else:
+            response["body"] = message["body"]
+
+    await app({"type": "http", "method": method, "path": path, "headers": headers}, receive, send)
+    return response
+
+
+def test_queue_overflow_and_timeout_give_429():
+    async def scenario():
+        controller = AdmissionController(1, 1000, 1, 0.2)
+        inner = GatedApp()
+        app = AdmissionMiddleware(inner, PATHS, controller)
+
+        first = asyncio.create_task(_request(app, body=b"x" * 10))
+        await asyncio.sleep(0.01)
+        queued = asyncio.create_task(_request(app, body=b"x" * 10))
+        await asyncio.sleep(0.01)
+        assert (controller.active, controller.queued) == (1, 1)
+
+        overflow = await _request(app, body=b"x" * 10)
+        assert overflow["status"] == 429
+        assert int(overflow["headers"][b"retry-after"]) >= 1
+        assert "detail" in json.loads(overflow["body"])
+
+        # Ожидание в очереди дольше queue_timeout — тоже 429, место в очереди освобождается
+        timed_out = await queued
+        assert timed_out["status"] == 429 and b"retry-after" in timed_out["headers"]
+        assert controller.queued == 0
+
+        # Не тяжёлые пути и GET проходят мимо контроллера
+        inner.gate.set()
+        assert (await _request(app, method="GET"))["status"] == 200
+        assert (await _request(app, path="/health"))["status"] == 200
+        assert (await first)["status"] == 200
+        assert (controller.active, controller.active_bytes, controller.rejected) == (0, 0, 2)
+
+    asyncio.run(scenario())
+
+
+def test_queued_request_is_admitted_after_release():
+    async def scenario():
+        controller = AdmissionController(1, 1000, 1, 5.0)
+        inner = GatedApp()
+        app = AdmissionMiddleware(inner, PATHS, controller)
+
+        first = asyncio.create_task(_request(app, body=b"x" * 10))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(_request(app, body=b"x" * 10))
+        await asyncio.sleep(0.01)
+        assert controller.queued == 1
+        inner.gate.set()
+        assert [(await first)["status"], (await second)["status"]] == [200, 200]
+        assert (controller.active, controller.queued) == (0, 0)
+
+    asyncio.run(scenario())
+
+
+def test_size_limits_and_bad_content_length():
+    async def scenario():
+        controller = AdmissionController(4, 100, 4, 1.0)
+        inner = GatedApp()
+        inner.gate.set()
+        app = AdmissionMiddleware(inner, PATHS, controller)
+
+        too_big = await _request(app, body=b"x" * 101)
+        assert too_big["status"] == 413 and b"retry-after" not in too_big["headers"]
+        bad = await _request(app, content_length=b"12abc")
+        assert bad["status"] == 400
+        assert inner.received == 0
+        assert (controller.active, controller.active_bytes) == (0, 0)
+
+    asyncio.run(scenario())
+
+
+def test_chunked_body_is_metered():
+    async def scenario():
+        controller = AdmissionController(4, 100, 4, 1.0, unknown_size=10)
+        inner = GatedApp()
+        app = AdmissionMiddleware(inner, PATHS, controller)
+
+        request = asyncio.create_task(_request(app, body=b"x" * 20, chunks=[b"x" * 20]))
+        await asyncio.sleep(0.01)
+        # Без Content-Length сначала занято unknown_size, затем фактически принятые байты
+        assert controller.active_bytes == 40
+        inner.gate.set()
+        assert (await request)["status"] == 200
+        assert (controller.active, controller.active_bytes) == (0, 0)
+
+    asyncio.run(scenario())
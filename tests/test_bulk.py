@@ -0,0 +1,47 @@
+"""Повторные запуски bulk.py на том же дереве не берут собственные результаты за входы."""
+from pathlib import Path
+import sys
+
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import bulk  # noqa: E402
+
+
+def _image(path: Path, format: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.new("RGB", (64, 48), (200, 30, 30)).save(path, format)
+
+
+def _files(root: Path) -> list:
+    return sorted(path.relative_to(root).as_posix() for path in root.rglob("*") if path.is_file())
+
+
+def _run_twice(tree: Path, *args: str) -> list:
+    for _ in range(2):
+        assert bulk.main([str(tree), "--workers", "1", "--skip", "none", *args]) == 0
+    return _files(tree)
+
+
+def test_resize_jpeg_in_place(tmp_path):
+    _image(tmp_path / "a.jpg", "JPEG")
+    _image(tmp_path / "sub" / "b.jpeg", "JPEG")
+    assert _run_twice(tmp_path, "--operation", "resize-jpeg") == [
+        "a.jpg", "a_resized.jpg", "sub/b.jpeg", "sub/b_resized.jpg",
+    ]
+
+
+def test_pyramid_in_place(tmp_path):
+    _image(tmp_path / "a.jpg", "JPEG")
+    assert _run_twice(tmp_path, "--operation", "resize-jpeg", "--sizes", "32x24,16x12") == [
+        "16x12/a_resized.jpg", "32x24/a_resized.jpg", "a.jpg",
+    ]
+
+
+def test_output_inside_input(tmp_path):
+    _image(tmp_path / "a.jpg", "JPEG")
+    output = tmp_path / "out"
+    assert _run_twice(tmp_path, "--operation", "resize-jpeg", "--output", str(output)) == [
+        "a.jpg", "out/a_resized.jpg",
+    ]
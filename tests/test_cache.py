@@ -0,0 +1,81 @@
+"""Уровни кэша результатов: LRU в памяти, общий каталог на диске, ETag."""
+from pathlib import Path
+import os
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import cache  # noqa: E402
+from pipeline import etag_matches, quote_etag  # noqa: E402
+
+
+def test_memory_tier_evicts_least_recently_used():
+    tier = cache.MemoryTier(10)
+    tier.put("a", b"1234")
+    tier.put("b", b"1234")
+    assert tier.get("a") == b"1234"
+    tier.put("c", b"1234")
+    assert tier.get("b") is None
+    assert tier.get("a") == tier.get("c") == b"1234"
+    assert (tier.size, tier.evictions) == (8, 1)
+
+
+def test_disk_tier_is_private(tmp_path):
+    directory = tmp_path / "cache"
+    directory.mkdir(mode=0o777)
+    directory.chmod(0o777)
+    cache.DiskTier(str(directory), 100)
+    assert directory.stat().st_mode & 0o777 == 0o700
+
+
+def test_disk_tier_sees_other_processes(tmp_path):
+    first = cache.DiskTier(str(tmp_path), 100)
+    second = cache.DiskTier(str(tmp_path), 100)
+    first.put("a", b"x" * 10)
+    assert second.contains("a")
+    assert second.get("a") == b"x" * 10
+    (tmp_path / "a.bin").unlink()
+    assert not first.contains("a")
+    assert second.get("a") is None
+
+
+def test_disk_tier_keeps_shared_budget(tmp_path):
+    first = cache.DiskTier(str(tmp_path), 100)
+    second = cache.DiskTier(str(tmp_path), 100)
+    for i in range(6):
+        (first if i % 2 else second).put(str(i), b"x" * 30)
+        os.utime(tmp_path / f"{i}.bin", (i, i))
+    first._rescan()
+    assert sum(path.stat().st_size for path in tmp_path.glob("*.bin")) <= 100
+    assert sorted(path.stem for path in tmp_path.glob("*.bin")) == ["3", "4", "5"]
+
+
+def test_disk_tier_removes_stale_temp_files(tmp_path):
+    stale = tmp_path / "old.tmp"
+    fresh = tmp_path / "new.tmp"
+    stale.write_bytes(b"x")
+    fresh.write_bytes(b"x")
+    old = time.time() - 2 * cache._DISK_TMP_MAX_AGE
+    os.utime(stale, (old, old))
+    cache.DiskTier(str(tmp_path), 100)
+    assert not stale.exists()
+    assert fresh.exists()
+
+
+def test_result_cache_promotes_disk_hits(tmp_path):
+    results = cache.ResultCache(100, 100, str(tmp_path))
+    key = results.key("convert-webp", b"input", ())
+    assert key == results.key_for_digest("convert-webp", cache.hashlib.sha256(b"input").hexdigest(), ())
+    results.disk.put(key, b"jpeg")
+    assert results.memory.get(key) is None
+    assert results.get(key) == b"jpeg"
+    assert results.memory.get(key) == b"jpeg"
+
+
+def test_etag_matches():
+    assert etag_matches(quote_etag("k"), "k")
+    assert etag_matches(f'"other", W/{quote_etag("k")}', "k")
+    assert etag_matches("*", "k")
+    assert not etag_matches('"other"', "k")
+    assert not etag_matches(None, "k")
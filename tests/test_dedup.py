@@ -0,0 +1,67 @@
+"""Одинаковые файлы внутри запроса обрабатываются один раз."""
+from pathlib import Path
+import io
+import json
+import sys
+import zipfile
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import cache  # noqa: E402
+import main4  # noqa: E402
+
+
+def _webp(color) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), color).save(buffer, "WEBP")
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope="module")
+def client():
+    # Без дискового кэша: тесты не должны зависеть от результатов прошлых запусков
+    previous, cache._cache = cache._cache, cache.ResultCache(1024 * 1024, 0, "")
+    try:
+        with TestClient(main4.app) as client:
+            yield client
+    finally:
+        cache._cache = previous
+
+
+def _entries(content: bytes) -> dict:
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        return {name: archive.read(name) for name in archive.namelist()}
+
+
+def test_zip_duplicates_share_one_result(client):
+    red, blue = _webp((200, 30, 30)), _webp((30, 30, 200))
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("a.webp", red)
+        archive.writestr("b.webp", red)
+        archive.writestr("c.webp", blue)
+    response = client.post("/convert-zip/", files={"file": ("images.zip", buffer.getvalue())})
+    assert response.status_code == 200
+    assert response.headers["x-deduplicated"] == "1"
+    entries = _entries(response.content)
+    assert sorted(entries) == ["a.jpg", "b.jpg", "c.jpg"]
+    assert entries["a.jpg"] == entries["b.jpg"] != entries["c.jpg"]
+
+
+def test_streamed_duplicates_are_counted_in_summary(client):
+    red, blue = _webp((200, 30, 30)), _webp((30, 30, 200))
+    files = [("files", (name, data)) for name, data in (("a.webp", red), ("b.webp", blue), ("c.webp", red))]
+    response = client.post("/convert-webp/", files=files, headers={"X-Progress": "1"})
+    assert response.status_code == 200
+    # Заголовки уходят до того, как дубликаты известны
+    assert "x-deduplicated" not in response.headers
+    entries = _entries(response.content)
+    assert entries["a.jpg"] == entries["c.jpg"] != entries["b.jpg"]
+    events = client.get(f"/progress/{response.headers['x-progress-id']}?format=ndjson").text.splitlines()
+    statuses = {event["name"]: event.get("status") for event in map(json.loads, events) if event["event"] == "image"}
+    assert statuses["c.webp"] == "duplicate"
+    assert json.loads(events[-1])["deduplicated"] == 1
@@ -0,0 +1,32 @@
+"""Подбор качества JPEG по PSNR на холсте letterbox."""
+from pathlib import Path
+import io
+import sys
+
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import imaging  # noqa: E402
+
+
+def _letterboxed() -> Image.Image:
+    # Узкое изображение: большая часть холста 1080x1440 — белые поля
+    return imaging.letterbox(Image.effect_noise((300, 1440), 40).convert("RGB"), imaging.TARGET_SIZE)
+
+
+def test_psnr_ignores_letterbox_borders():
+    img = _letterboxed()
+    box = img.info["letterbox"]
+    assert box == (390, 0, 690, 1440)
+    data = imaging._save_jpeg(img, 60)
+    assert imaging.psnr(img, data, box) < imaging.psnr(img, data) - 3
+
+
+def test_min_psnr_target_holds_inside_box():
+    img = _letterboxed()
+    target = imaging.JpegTarget(min_psnr=36)
+    data = target.encode(img)
+    assert imaging.psnr(img, data, img.info["letterbox"]) >= 36
+    with Image.open(io.BytesIO(data)) as decoded:
+        assert decoded.size == imaging.TARGET_SIZE
@@ -0,0 +1,72 @@
+"""Разбор multipart/form-data по мере приёма тела запроса."""
+from pathlib import Path
+import asyncio
+import sys
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ingest import FormError, MultipartReader  # noqa: E402
+
+BOUNDARY = "test-boundary"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+
+
+def _form(parts) -> bytes:
+    body = b""
+    for name, filename, data in parts:
+        disposition = f'form-data; name="{name}"' + ("" if filename is None else f'; filename="{filename}"')
+        body += f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + data + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+def test_each_part_is_yielded_before_the_body_ends():
+    body = _form([("sizes", None, b"100x100"), ("files", "a.webp", b"a" * 3000), ("files", "b.webp", b"b" * 10)])
+    split = body.index(b"b" * 10)
+    consumed = []
+
+    async def chunks():
+        for chunk in (body[:split], body[split:]):
+            consumed.append(len(chunk))
+            yield chunk
+
+    async def read():
+        result = []
+        async for part in MultipartReader(CONTENT_TYPE, chunks(), 4096).parts():
+            result.append((part.name, part.filename, bytes(part.data), len(consumed)))
+        return result
+
+    parts = asyncio.run(read())
+    # Первые две части готовы после первого фрагмента тела
+    assert parts == [
+        ("sizes", None, b"100x100", 1),
+        ("files", "a.webp", b"a" * 3000, 1),
+        ("files", "b.webp", b"b" * 10, 2),
+    ]
+
+
+async def _single(body: bytes):
+    yield body
+
+
+def _parts(body: bytes, content_type: str = CONTENT_TYPE, max_file_size: int = 100):
+    async def read():
+        return [part async for part in MultipartReader(content_type, _single(body), max_file_size).parts()]
+
+    return asyncio.run(read())
+
+
+def test_oversized_file_is_reported_and_not_kept():
+    big, small = _parts(_form([("files", "big.webp", b"a" * 101), ("files", "small.webp", b"a" * 100)]))
+    assert isinstance(big.error, FormError) and not big.data
+    assert small.error is None and small.data == b"a" * 100
+
+
+def test_malformed_bodies():
+    with pytest.raises(FormError):
+        _parts(b"", content_type="application/json")
+    with pytest.raises(FormError):
+        _parts(_form([("files", "a.webp", b"a")])[:-20])
+    with pytest.raises(FormError):
+        _parts(_form([("sizes", None, b"x" * 70000)]))
@@ -0,0 +1,84 @@
+"""Потоковое чтение и запись tar/tar.gz: длинные имена PAX и GNU, gzip, лимиты."""
+from pathlib import Path
+import asyncio
+import gzip
+import io
+import sys
+import tarfile
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import config  # noqa: E402
+from ingest import ArchiveError, TarReader  # noqa: E402
+from tarstream import TarStream  # noqa: E402
+
+SUFFIXES = (".webp",)
+LONG_NAME = "каталог/" + "очень-длинное-имя-" * 8 + ".webp"
+
+
+def _tar(members, format=tarfile.PAX_FORMAT) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w", format=format) as archive:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+async def _chunks(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def _read(data: bytes, chunk_size: int = 100):
+    async def read():
+        reader = TarReader(_chunks(data, chunk_size), SUFFIXES)
+        try:
+            return [(name, value) async for name, value in reader.members()]
+        finally:
+            await reader.close()
+
+    return asyncio.run(read())
+
+
+@pytest.mark.parametrize("format", [tarfile.PAX_FORMAT, tarfile.GNU_FORMAT])
+def test_long_names_and_filtering(format):
+    members = [(LONG_NAME, b"a" * 700), ("notes.txt", b"skip"), ("b.WEBP", b"b")]
+    assert _read(_tar(members, format)) == [(LONG_NAME, b"a" * 700), ("b.WEBP", b"b")]
+
+
+def test_gzip_split_inside_magic():
+    data = gzip.compress(_tar([("a.webp", b"a" * 5000)]))
+    # Первый фрагмент короче сигнатуры gzip
+    assert _read(data, chunk_size=1) == [("a.webp", b"a" * 5000)]
+
+
+def test_truncated_and_invalid_archives():
+    data = _tar([("a.webp", b"a" * 2000)])
+    with pytest.raises(ArchiveError):
+        _read(data[:1024])
+    with pytest.raises(ArchiveError):
+        _read(b"x" * 512)
+    with pytest.raises(ArchiveError):
+        _read(b"\x1f\x8b" + b"x" * 100)
+
+
+def test_oversized_member_is_reported(monkeypatch):
+    monkeypatch.setattr(config, "ZIP_MAX_MEMBER_SIZE", 100)
+    members = _read(_tar([("big.webp", b"a" * 101), ("small.webp", b"a" * 100)]))
+    assert isinstance(members[0][1], ArchiveError)
+    assert members[1] == ("small.webp", b"a" * 100)
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_tar_stream_round_trip(compress):
+    stream = TarStream(compress)
+    data = stream.add(LONG_NAME, b"a" * 700) + stream.add(LONG_NAME, b"b") + stream.close()
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r:*") as archive:
+        names = archive.getnames()
+        assert archive.extractfile(names[1]).read() == b"b"
+    assert names[0] == LONG_NAME and names[1] != LONG_NAME
+    assert [name for name, _ in _read(data)] == names
@@ -0,0 +1,111 @@
+"""Возобновляемые загрузки: проверка частей, состояние сессии и finalize."""
+from pathlib import Path
+import hashlib
+import io
+import sys
+import zipfile
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import cache  # noqa: E402
+import main4  # noqa: E402
+import uploads  # noqa: E402
+
+CHUNK_SIZE = 1024
+
+
+@pytest.fixture
+def client(tmp_path):
+    previous_cache, cache._cache = cache._cache, cache.ResultCache(1024 * 1024, 0, "")
+    # Свой каталог и маленькие части; при остановке приложения менеджер сбрасывается сам
+    uploads._manager = uploads.UploadManager(str(tmp_path), CHUNK_SIZE, 1024 * 1024, 3600)
+    try:
+        with TestClient(main4.app) as client:
+            yield client
+    finally:
+        cache._cache = previous_cache
+
+
+def _webp() -> bytes:
+    buffer = io.BytesIO()
+    # Шум, чтобы файл занял несколько частей
+    Image.effect_noise((64, 64), 64).convert("RGB").save(buffer, "WEBP", lossless=True)
+    return buffer.getvalue()
+
+
+def _chunks(data: bytes):
+    return [data[start:start + CHUNK_SIZE] for start in range(0, len(data), CHUNK_SIZE)]
+
+
+def _put(client, upload_id: str, index: int, chunk: bytes, checksum=None):
+    checksum = hashlib.sha256(chunk).hexdigest() if checksum is None else checksum
+    return client.put(f"/uploads/{upload_id}/chunks/{index}", content=chunk, headers={"X-Chunk-SHA256": checksum})
+
+
+def _create(client, data: bytes) -> dict:
+    response = client.post("/uploads", data={"filename": "photo.webp", "size": str(len(data))})
+    assert response.status_code == 201
+    return response.json()
+
+
+def test_create_rejects_bad_size(client):
+    assert client.post("/uploads", data={"filename": "photo.webp", "size": "0"}).status_code == 400
+    assert client.post("/uploads", data={"filename": "photo.webp", "size": str(2 * 1024 * 1024)}).status_code == 400
+
+
+def test_chunks_are_checked(client):
+    data = _webp()
+    session = _create(client, data)
+    chunks = _chunks(data)
+    assert session["chunks"] == len(chunks) > 2
+
+    assert _put(client, session["id"], len(chunks), chunks[0]).status_code == 400
+    assert _put(client, session["id"], 0, chunks[0][:-1]).status_code == 400
+    assert _put(client, session["id"], 0, chunks[0], hashlib.sha256(b"other").hexdigest()).status_code == 400
+    response = client.put(f"/uploads/{session['id']}/chunks/0", content=chunks[0])
+    assert response.status_code == 400
+    assert client.get(f"/uploads/{session['id']}").json()["received_bytes"] == 0
+    assert client.get(f"/uploads/{'0' * 32}").status_code == 404
+
+
+def test_chunks_in_any_order_and_finalize(client):
+    data = _webp()
+    session = _create(client, data)
+    chunks = _chunks(data)
+
+    # Последняя часть короче остальных, первая приходит последней, вторая — дважды
+    for index in [len(chunks) - 1, 1, 1] + list(range(2, len(chunks) - 1)):
+        assert _put(client, session["id"], index, chunks[index]).status_code == 200
+    state = client.get(f"/uploads/{session['id']}").json()
+    assert state["missing"] == [0]
+    assert state["ranges"] == [[CHUNK_SIZE, len(data)]]
+    assert state["received_bytes"] == len(data) - CHUNK_SIZE
+
+    response = client.post(f"/uploads/{session['id']}/finalize", data={"operation": "convert-webp"})
+    assert response.status_code == 409
+
+    state = _put(client, session["id"], 0, chunks[0]).json()
+    assert state["complete"] and state["ranges"] == [[0, len(data)]]
+
+    response = client.post(f"/uploads/{session['id']}/finalize", data={"operation": "convert-webp"})
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        assert archive.namelist() == ["photo.jpg"]
+        with Image.open(io.BytesIO(archive.read("photo.jpg"))) as image:
+            assert (image.format, image.size) == ("JPEG", (64, 64))
+    # После finalize сессия удалена
+    assert client.get(f"/uploads/{session['id']}").status_code == 404
+
+
+def test_failed_finalize_keeps_session(client):
+    data = _webp()
+    session = _create(client, data)
+    for index, chunk in enumerate(_chunks(data)):
+        _put(client, session["id"], index, chunk)
+    response = client.post(f"/uploads/{session['id']}/finalize", data={"operation": "unknown"})
+    assert response.status_code == 400
+    assert client.get(f"/uploads/{session['id']}").json()["complete"]
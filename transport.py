@@ -0,0 +1,182 @@
+from typing import BinaryIO, Callable, Optional, Union
+import hashlib
+import mmap
+import os
+import shutil
+import tempfile
+import uuid
+
+import config
+
+_BLOCK = 1024 * 1024
+
+
+class Spooled:
+    """Данные в файле каталога обмена: между процессами передаются только путь и размер.
+
+    Каталог обмена по умолчанию лежит в /dev/shm (tmpfs), так что файл — это
+    страницы общей памяти: один процесс записывает их, другой читает напрямую,
+    без сериализации и копирования через канал пула процессов.
+    """
+
+    __slots__ = ("path", "size")
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __repr__(self) -> str:
+        return f"Spooled({self.path!r}, {self.size!r})"
+
+    def sha256(self) -> str:
+        """SHA-256 содержимого по отображению файла в память, без чтения в буфер процесса."""
+        digest = hashlib.sha256()
+        if self.size:
+            with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                digest.update(mapped)
+        return digest.hexdigest()
+
+    def take(self) -> bytes:
+        """Читает данные и удаляет файл."""
+        try:
+            with open(self.path, "rb") as f:
+                return f.read()
+        finally:
+            self.remove()
+
+    def remove(self) -> None:
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+# Данные для воркера или от него: байты (через канал пула) или файл обмена
+Payload = Union[bytes, Spooled]
+
+
+def _write(directory: str, write: Callable[[BinaryIO], None]) -> Spooled:
+    fd, path = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+            size = f.tell()
+    except BaseException:
+        os.unlink(path)
+        raise
+    return Spooled(path, size)
+
+
+_root: Optional[str] = None
+
+
+def _process_root() -> str:
+    """Каталог обмена этого процесса сервиса; при создании удаляет каталоги завершившихся процессов."""
+    global _root
+    if _root is None:
+        os.makedirs(config.SPOOL_DIR, exist_ok=True)
+        for name in os.listdir(config.SPOOL_DIR):
+            if name.isdigit() and not _alive(int(name)):
+                shutil.rmtree(os.path.join(config.SPOOL_DIR, name), ignore_errors=True)
+        _root = os.path.join(config.SPOOL_DIR, str(os.getpid()))
+        os.makedirs(_root, exist_ok=True)
+    return _root
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def shutdown_spool() -> None:
+    global _root
+    if _root is not None:
+        shutil.rmtree(_root, ignore_errors=True)
+        _root = None
+
+
+class Spool:
+    """Каталог обмена одного конвейера: файлы его входов и готовых JPEG.
+
+    Через файлы передаются данные не меньше min_bytes; меньшие дешевле
+    отправить через канал пула (0 отключает обмен через файлы). Каталог
+    создаётся при записи первого файла, так что конвейер с одними мелкими
+    файлами его не создаёт. Файлы удаляются по одному, как только не нужны,
+    а close() удаляет каталог целиком, вместе с файлами отменённых задач:
+    воркер, доделавший такую задачу, уже не сможет создать файл в удалённом
+    каталоге.
+
+    Если файл обмена создать не удалось (например, /dev/shm переполнен —
+    в Docker он по умолчанию 64 МБ), write() возвращает None, и данные
+    передаются байтами, как без обмена через файлы.
+    """
+
+    def __init__(self, min_bytes: int = config.SPOOL_MIN_BYTES):
+        self.min_bytes = min_bytes
+        self._directory: Optional[str] = None
+
+    def wants(self, size: Optional[int]) -> bool:
+        return 0 < self.min_bytes <= (size or 0)
+
+    @property
+    def directory(self) -> str:
+        if self._directory is None:
+            self._directory = os.path.join(_process_root(), uuid.uuid4().hex)
+            os.makedirs(self._directory)
+        return self._directory
+
+    def write(self, copy: Callable[[BinaryIO], None]) -> Optional[Spooled]:
+        """Создаёт файл обмена и заполняет его через copy(файл); при ошибке файл удаляется.
+
+        Ошибки самого файла обмена (OSError) дают None; ошибки copy, не связанные
+        с вводом-выводом (например, ArchiveError), передаются вызывающему.
+        """
+        try:
+            return _write(self.directory, copy)
+        except OSError as e:
+            print(f"Файл обмена не создан, данные передаются через канал пула: {str(e)}")
+            return None
+
+    def put(self, data: bytes) -> Optional[Spooled]:
+        return self.write(lambda f: f.write(data))
+
+    def put_file(self, fileobj: BinaryIO) -> Optional[Spooled]:
+        """Копирует файл блоками с текущей позиции, не собирая его в памяти."""
+        return self.write(lambda f: shutil.copyfileobj(fileobj, f, _BLOCK))
+
+    def close(self) -> None:
+        if self._directory is not None:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
+
+
+def call_spooled(func: Callable, directory: str, min_bytes: int, source: Payload, *args):
+    """Выполняется в воркере: func(source, *args) с входом и JPEG через файлы обмена.
+
+    func возвращает (JPEG или список JPEG, время стадий), как
+    imaging.process_image_timed и process_pyramid_timed. Вход из файла
+    обмена декодируется прямо из файла; JPEG не меньше min_bytes
+    записываются в файлы directory, и вместо них возвращаются Spooled
+    (или сами байты, если файл создать не удалось).
+    """
+    result, timings = func(source.path if isinstance(source, Spooled) else source, *args)
+
+    def output(data: bytes) -> Payload:
+        if len(data) < min_bytes:
+            return data
+        try:
+            return _write(directory, lambda f: f.write(data))
+        except OSError:
+            return data
+
+    if isinstance(result, list):
+        return [output(data) for data in result], timings
+    return output(result), timings
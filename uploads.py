@@ -0,0 +1,233 @@
+from fastapi import HTTPException, UploadFile
+from pathlib import Path
+from typing import Dict, List, Optional
+import asyncio
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import time
+import uuid
+
+import config
+
+
+UPLOAD_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+class UploadSession:
+    """Возобновляемая загрузка одного файла частями в общий файл на диске.
+
+    Часть с номером index пишется по смещению index * chunk_size, поэтому
+    части могут приходить в любом порядке и повторно, а файл никогда не
+    собирается в памяти.
+
+    Всё состояние сессии лежит на диске рядом с файлом: {id}.json — имя и
+    размеры, {id}.chunks/{index} — SHA-256 каждой записанной части, время
+    изменения {id}.json — последняя активность. Поэтому загрузку можно
+    продолжить после перезапуска сервиса и через любой воркер uvicorn, а
+    части, пришедшие в разные процессы одновременно, не затирают друг друга.
+    """
+
+    def __init__(self, filename: str, size: int, chunk_size: int, directory: Path, upload_id: Optional[str] = None):
+        self.id = upload_id or uuid.uuid4().hex
+        self.filename = filename
+        self.size = size
+        self.chunk_size = chunk_size
+        self.chunks = max(1, math.ceil(size / chunk_size))
+        self.path = directory / f"{self.id}.upload"
+        self.meta_path = directory / f"{self.id}.json"
+        self.chunks_dir = directory / f"{self.id}.chunks"
+        self.received: Dict[int, str] = {}
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+
+    @classmethod
+    def load(cls, directory: Path, upload_id: str) -> Optional["UploadSession"]:
+        """Читает сессию с диска; None, если её нет (или её удалил другой процесс)."""
+        meta_path = directory / f"{upload_id}.json"
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            updated_at = meta_path.stat().st_mtime
+        except (FileNotFoundError, ValueError):
+            return None
+        session = cls(meta["filename"], meta["size"], meta["chunk_size"], directory, upload_id)
+        session.created_at = meta["created_at"]
+        session.updated_at = updated_at
+        try:
+            names = os.listdir(session.chunks_dir)
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            if name.isdigit():
+                try:
+                    session.received[int(name)] = (session.chunks_dir / name).read_text()
+                except FileNotFoundError:
+                    pass
+        return session
+
+    def save(self) -> None:
+        self.chunks_dir.mkdir(exist_ok=True)
+        meta = {"filename": self.filename, "size": self.size, "chunk_size": self.chunk_size, "created_at": self.created_at}
+        _write_atomic(self.meta_path, json.dumps(meta, ensure_ascii=False))
+
+    def touch(self) -> None:
+        self.updated_at = time.time()
+        os.utime(self.meta_path, (self.updated_at, self.updated_at))
+
+    def chunk_length(self, index: int) -> int:
+        if index == self.chunks - 1:
+            return self.size - index * self.chunk_size
+        return self.chunk_size
+
+    def missing(self) -> List[int]:
+        return [index for index in range(self.chunks) if index not in self.received]
+
+    def ranges(self) -> List[List[int]]:
+        """Полученные байты как отсортированные диапазоны [начало, конец)."""
+        ranges: List[List[int]] = []
+        for index in sorted(self.received):
+            start = index * self.chunk_size
+            end = start + self.chunk_length(index)
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+        return ranges
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "chunks": self.chunks,
+            "received_bytes": sum(self.chunk_length(index) for index in self.received),
+            "ranges": self.ranges(),
+            "missing": self.missing(),
+            "complete": not self.missing(),
+            "expires_at": self.updated_at + config.UPLOAD_TTL,
+        }
+
+
+def _write_atomic(path: Path, text: str) -> None:
+    partial_path = path.with_name(path.name + ".part")
+    partial_path.write_text(text, encoding="utf-8")
+    os.replace(partial_path, path)
+
+
+class UploadManager:
+    """Сессии возобновляемых загрузок в каталоге UPLOAD_DIR.
+
+    Процесс не держит сессии в памяти: каждое обращение читает их с диска
+    (см. UploadSession), так что каталог можно делить между воркерами и он
+    переживает перезапуск. Сессия без новых частей дольше UPLOAD_TTL секунд
+    удаляется вместе с файлом.
+    """
+
+    def __init__(self, directory: str, chunk_size: int, max_bytes: int, ttl: float):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+    def create(self, filename: str, size: int) -> UploadSession:
+        self.purge_expired()
+        if not filename:
+            raise HTTPException(status_code=400, detail="Укажите имя файла")
+        if not 0 < size <= self.max_bytes:
+            raise HTTPException(status_code=400, detail=f"Размер загрузки должен быть от 1 до {self.max_bytes} байт")
+        session = UploadSession(os.path.basename(filename), size, self.chunk_size, self.directory)
+        # Файл сразу нужной длины: части пишутся по своим смещениям
+        with open(session.path, "wb") as f:
+            f.truncate(size)
+        # Метаданные последними: сессия видна другим процессам, только когда файл уже есть
+        session.save()
+        return session
+
+    def get(self, upload_id: str) -> Optional[UploadSession]:
+        self.purge_expired()
+        if not UPLOAD_ID_PATTERN.fullmatch(upload_id):
+            return None
+        return UploadSession.load(self.directory, upload_id)
+
+    async def write_chunk(self, session: UploadSession, index: int, data: bytes, checksum: Optional[str]) -> None:
+        """Проверяет часть по номеру, длине и SHA-256 и записывает её на место в файле."""
+        if not 0 <= index < session.chunks:
+            raise HTTPException(status_code=400, detail=f"Номер части должен быть от 0 до {session.chunks - 1}")
+        if len(data) != session.chunk_length(index):
+            raise HTTPException(
+                status_code=400, detail=f"Часть {index} должна быть {session.chunk_length(index)} байт, получено {len(data)}"
+            )
+        if not checksum:
+            raise HTTPException(status_code=400, detail="Не указан заголовок X-Chunk-SHA256")
+        digest = hashlib.sha256(data).hexdigest()
+        if digest != checksum.strip().lower():
+            raise HTTPException(status_code=400, detail=f"Контрольная сумма части {index} не совпадает")
+
+        def write() -> None:
+            with open(session.path, "r+b") as f:
+                f.seek(index * session.chunk_size)
+                f.write(data)
+            # Отметка о части — только после записи данных: прерванная запись останется недостающей частью
+            _write_atomic(session.chunks_dir / str(index), digest)
+            session.touch()
+
+        try:
+            await asyncio.to_thread(write)
+        except FileNotFoundError:
+            # Сессию удалил другой процесс (finalize или истечение срока)
+            raise HTTPException(status_code=404, detail="Загрузка не найдена")
+        session.received[index] = digest
+
+    def open_file(self, session: UploadSession) -> UploadFile:
+        """Открывает полностью загруженный файл как UploadFile для конвейера; 409, если не все части получены."""
+        missing = session.missing()
+        if missing:
+            raise HTTPException(status_code=409, detail=f"Загрузка не завершена: не хватает частей {missing[:20]}")
+        try:
+            session.touch()
+            return UploadFile(open(session.path, "rb"), size=session.size, filename=session.filename)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Загрузка не найдена")
+
+    def remove(self, session: UploadSession) -> None:
+        """Удаляет сессию; уже открытый файл остаётся доступен до закрытия."""
+        self._remove(session.id)
+
+    def _remove(self, upload_id: str) -> None:
+        # Метаданные первыми: для других процессов сессия исчезает сразу целиком
+        (self.directory / f"{upload_id}.json").unlink(missing_ok=True)
+        (self.directory / f"{upload_id}.upload").unlink(missing_ok=True)
+        shutil.rmtree(self.directory / f"{upload_id}.chunks", ignore_errors=True)
+
+    def purge_expired(self) -> None:
+        now = time.time()
+        for meta_path in self.directory.glob("*.json"):
+            try:
+                expired = now - meta_path.stat().st_mtime > self.ttl
+            except FileNotFoundError:
+                continue
+            if expired and UPLOAD_ID_PATTERN.fullmatch(meta_path.stem):
+                self._remove(meta_path.stem)
+
+
+_manager: Optional[UploadManager] = None
+
+
+def get_upload_manager() -> UploadManager:
+    """Возвращает общий менеджер загрузок, создавая его при первом обращении."""
+    global _manager
+    if _manager is None:
+        _manager = UploadManager(config.UPLOAD_DIR, config.UPLOAD_CHUNK_SIZE, config.UPLOAD_MAX_BYTES, config.UPLOAD_TTL)
+    return _manager
+
+
+def shutdown_uploads() -> None:
+    # Незавершённые загрузки остаются на диске: их можно докачать после перезапуска
+    global _manager
+    _manager = None
@@ -0,0 +1,259 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import collections
+import itertools
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+
+import config
+from imaging import codec_plugins, use_codecs, warm_up
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pending = 0
+# Задачи, ожидающие результата, по пулам; нужен, чтобы знать, когда можно
+# остановить процессы пула, выведенного из работы после таймаута
+_inflight: collections.Counter = collections.Counter()
+# Процессы выведенных из работы пулов, которые всё ещё выполняют задачи с истёкшим таймаутом
+_stuck: Dict[ProcessPoolExecutor, List[Tuple[int, Future]]] = collections.defaultdict(list)
+
+# Воркер сообщает в очередь (номер задачи, pid), когда берёт задачу: таймаут
+# отсчитывается от начала выполнения, а не от постановки в очередь пула
+_tokens = itertools.count()
+_started: Dict[int, Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = {}
+_started_queue: Optional[Any] = None
+_started_reader: Optional[threading.Thread] = None
+
+
+def _init_worker(started_queue: Any, codecs: List[str], plugins: List[str], warm: bool) -> None:
+    """Инициализатор процесса пула."""
+    global _started_queue
+    _started_queue = started_queue
+    if codecs:
+        use_codecs(codecs, plugins)
+    if warm:
+        # Каждый новый процесс, в том числе заменяющий отработавший свои
+        # MAX_TASKS_PER_CHILD задач, прогревается до того, как взять задачу
+        warm_up()
+
+
+def _call(token: int, func: Callable[..., Any], args: tuple, kwargs: dict) -> Any:
+    """Выполняется в воркере: сообщает о начале задачи и выполняет её."""
+    _started_queue.put((token, os.getpid()))
+    return func(*args, **kwargs)
+
+
+def _read_started(queue: Any) -> None:
+    """Поток основного процесса: передаёт сообщения о начале задач их ожидающим."""
+    while True:
+        message = queue.get()
+        if message is None:
+            return
+        token, pid = message
+        waiter = _started.get(token)
+        if waiter is not None:
+            loop, started = waiter
+            try:
+                loop.call_soon_threadsafe(_set_started, started, pid)
+            except RuntimeError:
+                # Цикл событий ожидающего уже закрыт
+                pass
+
+
+def _set_started(started: asyncio.Future, pid: int) -> None:
+    if not started.done():
+        started.set_result(pid)
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """Возвращает общий пул процессов, создавая его при первом обращении."""
+    global _pool, _started_queue, _started_reader
+    if _pool is None:
+        context = multiprocessing.get_context("spawn")
+        if _started_reader is None:
+            _started_queue = context.SimpleQueue()
+            _started_reader = threading.Thread(
+                target=_read_started, args=(_started_queue,), name="pool-started", daemon=True,
+            )
+            _started_reader.start()
+        kwargs = {}
+        if sys.version_info >= (3, 11):
+            kwargs["max_tasks_per_child"] = config.MAX_TASKS_PER_CHILD
+        _pool = ProcessPoolExecutor(
+            max_workers=config.WORKERS,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(_started_queue, config.CODECS, codec_plugins(config.CODECS), bool(config.WARMUP)),
+            **kwargs,
+        )
+    return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool, _started_reader
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+    for pool in list(_inflight):
+        _terminate(pool)
+    _inflight.clear()
+    if _started_reader is not None:
+        _started_queue.put(None)
+        _started_reader = None
+
+
+def _retire(pool: ProcessPoolExecutor, pid: int, future: Future) -> None:
+    """Выводит пул из работы после таймаута задачи, выполняемой процессом pid.
+
+    Отменить задачу, уже выполняющуюся в процессе, нельзя: asyncio.wait_for
+    отменяет только ожидание, а процесс продолжает работу и занимает место
+    в пуле. Поэтому новые задачи идут в новый пул, а процесс с зависшей
+    задачей завершается, когда дождутся результата (или своего таймаута)
+    остальные задачи, отправленные в старый пул.
+    """
+    global _pool
+    _stuck[pool].append((pid, future))
+    if _pool is pool:
+        print(f"Задача превысила таймаут {config.TASK_TIMEOUT} с, пул процессов будет перезапущен")
+        _pool = None
+
+
+def _terminate(pool: ProcessPoolExecutor) -> None:
+    """Останавливает пул, завершая процессы с зависшими задачами.
+
+    Ожидание остановки (join потока управления и процессов пула) уходит в
+    отдельный поток, чтобы не задерживать event loop.
+    """
+    for pid, future in _stuck.pop(pool, ()):
+        if not future.done():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    threading.Thread(
+        target=pool.shutdown, kwargs={"wait": True, "cancel_futures": True}, name="pool-shutdown",
+    ).start()
+
+
+async def run_in_pool(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Выполняет func в пуле процессов, не блокируя event loop.
+
+    Если задача, начав выполняться, не уложилась в CONVERT_TASK_TIMEOUT,
+    выбрасывается asyncio.TimeoutError, а пул перезапускается (см. _retire),
+    чтобы зависший процесс не занимал его место. Время ожидания в очереди
+    пула в таймаут не входит. Упавший пул пересоздаётся при следующем вызове.
+    """
+    global _pool, _pending
+    loop = asyncio.get_running_loop()
+    pool = get_pool()
+    token = next(_tokens)
+    started = loop.create_future()
+    _started[token] = (loop, started)
+    _pending += 1
+    _inflight[pool] += 1
+    try:
+        future = pool.submit(_call, token, func, args, kwargs)
+        result = asyncio.wrap_future(future)
+        try:
+            await asyncio.wait((result, started), return_when=asyncio.FIRST_COMPLETED)
+            if result.done():
+                return result.result()
+            pid = started.result()
+            try:
+                return await asyncio.wait_for(result, timeout=config.TASK_TIMEOUT)
+            except asyncio.TimeoutError:
+                _retire(pool, pid, future)
+                raise
+        finally:
+            # Отмена ожидания снимает с очереди пула ещё не начатую задачу
+            future.cancel()
+    except BrokenProcessPool:
+        if _pool is pool:
+            _pool = None
+        raise
+    finally:
+        del _started[token]
+        _pending -= 1
+        _inflight[pool] -= 1
+        if not _inflight[pool]:
+            del _inflight[pool]
+            if pool is not _pool:
+                _terminate(pool)
+
+
+async def warm_up_pool() -> int:
+    """Запускает процессы пула и выполняет в них прогревочную конвертацию.
+
+    Отправляет по задаче на процесс: пул запускает новый процесс на каждую
+    задачу, пока их меньше WORKERS. Возвращает число разных процессов,
+    выполнивших задачи; процесс, которому задачи не досталось, прогревается
+    сам, но возможно уже после возврата.
+    """
+    pids = await asyncio.gather(*(run_in_pool(warm_up) for _ in range(config.WORKERS)))
+    return len(set(pids))
+
+
+def queue_depth() -> int:
+    """Число задач, отправленных в пул и ещё не взятых воркерами."""
+    return max(0, _pending - config.WORKERS)
+
+
+async def imap(
+    func: Callable[..., Awaitable[Any]],
+    items: AsyncIterable[Tuple[Any, tuple]],
+    window: Optional[int] = None,
+) -> AsyncIterator[Tuple[Any, Any]]:
+    """Запускает корутину func для аргументов каждой пары (key, args) из items.
+
+    Пары (key, результат) отдаются в исходном порядке; одновременно в работе
+    не больше window задач, так что входные данные не накапливаются в памяти,
+    а пул процессов всё время загружен. Следующий элемент items ожидается
+    одновременно с первой задачей очереди: элемент уходит в работу, как только
+    получен (например, файл формы, которая ещё загружается), а готовый
+    результат отдаётся сразу, не дожидаясь следующего элемента. Ошибка
+    отдельной задачи возвращается как объект исключения вместо результата.
+    """
+    window = window or config.WORKERS * 2
+    pending: collections.deque = collections.deque()
+    items = items.__aiter__()
+    next_item: Optional[asyncio.Future] = None
+    exhausted = False
+
+    async def settle(task: asyncio.Future) -> Any:
+        try:
+            return await task
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return e
+
+    try:
+        while True:
+            if next_item is None and not exhausted and len(pending) < window:
+                next_item = asyncio.ensure_future(items.__anext__())
+            waiting = [task for task in (next_item, pending[0][1] if pending else None) if task is not None]
+            if not waiting:
+                return
+            await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+            while pending and pending[0][1].done():
+                key, task = pending.popleft()
+                yield key, await settle(task)
+            if next_item is not None and next_item.done():
+                try:
+                    key, args = next_item.result()
+                except StopAsyncIteration:
+                    exhausted = True
+                else:
+                    pending.append((key, asyncio.ensure_future(func(*args))))
+                next_item = None
+    finally:
+        if next_item is not None:
+            next_item.cancel()
+            # Источник нельзя закрывать, пока его __anext__ ещё выполняется
+            await asyncio.gather(next_item, return_exceptions=True)
+        for _, task in pending:
+            task.cancel()
@@ -0,0 +1,74 @@
+from typing import Set
+import io
+import zipfile
+
+
+def unique_name(names: Set[str], name: str) -> str:
+    """Имя элемента архива, ещё не занятое в names (image.jpg, image_1.jpg, ...); добавляется в names."""
+    stem, dot, suffix = name.rpartition(".")
+    if not dot:
+        stem, suffix = name, ""
+    candidate, index = name, 1
+    while candidate in names:
+        candidate = f"{stem}_{index}{dot}{suffix}"
+        index += 1
+    names.add(candidate)
+    return candidate
+
+
+class _Output(io.RawIOBase):
+    """Буфер для zipfile, который хранит только ещё не отданные клиенту байты.
+
+    zipfile после записи элемента возвращается к его локальному заголовку,
+    чтобы проставить CRC и размеры, поэтому буфер поддерживает seek в пределах
+    текущего, ещё не отданного, фрагмента.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._buffer = io.BytesIO()
+        self._base = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        return self._buffer.write(data)
+
+    def tell(self) -> int:
+        return self._base + self._buffer.tell()
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            offset -= self._base
+        self._buffer.seek(offset, whence)
+        return self.tell()
+
+    def drain(self) -> bytes:
+        data = self._buffer.getvalue()
+        self._base += len(data)
+        self._buffer = io.BytesIO()
+        return data
+
+
+class ZipStream:
+    """Потоково формирует ZIP-архив: каждый add() возвращает готовый фрагмент архива.
+
+    JPEG уже сжат, поэтому элементы по умолчанию пишутся без сжатия (ZIP_STORED).
+    """
+
+    def __init__(self, compression: int = zipfile.ZIP_STORED):
+        self._output = _Output()
+        self._zip = zipfile.ZipFile(self._output, "w", compression)
+        self._names: Set[str] = set()
+
+    def add(self, name: str, data: bytes) -> bytes:
+        self._zip.writestr(unique_name(self._names, name), data)
+        return self._output.drain()
+
+    def close(self) -> bytes:
+        self._zip.close()
+        return self._output.drain()